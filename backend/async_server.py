@@ -0,0 +1,658 @@
+"""
+Filename: async_server.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Async (Starlette + PyMongo AsyncMongoClient) variant of the
+UrgentCareQ backend.
+
+Serves the same /api/staff/* and /api/patient/* routes as server.py with the
+same request and response formats, and shares its scheduling rules through
+queue_logic.py. Every Mongo call is awaited, so one process holds thousands of
+open kiosk requests and queue streams without a thread for each.
+
+Run from backend/ (needs starlette, uvicorn and python-multipart):
+
+    uvicorn async_server:app --host 127.0.0.1 --port 5001
+
+Settings are read from the same environment variables as server.py. Sync and
+async processes compete for the same maintenance lease, so only one of them
+prunes.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import sys
+import time
+
+from pymongo.errors import PyMongoError
+from starlette.applications import Starlette
+from starlette.convertors import Convertor, register_url_convertor
+from starlette.middleware import Middleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+from queue_cache import QueueCache
+from deadline_index import DeadlineIndex
+from estimator import DurationEstimator
+from queue_events import AsyncSubscriber, QueueEventBroker
+import database
+import metrics
+from lease import AsyncMongoLease
+from batch_writer import AsyncBatchWriter
+from projection import parse_changes, project_queue
+from event_log import (
+    EVENT_LOG_FLUSH_SECONDS, log_event, take_snapshots, restore_snapshots,
+)
+from queue_logic import (
+    QUEUE_ID, QUEUE_ID_PATTERN, ACTIVE_STATUSES, JOIN_BATCH_MAX, normalize_name,
+    expected_duration_minutes_for, parse_join_batch, checkout_update,
+    checkout_body, render_queue, visit_delta, sse_message, stream_step,
+    reason_key, DURATION_EWMA_ALPHA, DURATION_QUANTILE, DURATION_MIN_SAMPLES,
+    DURATION_STATS_SAVE_SECONDS,
+    # step functions, see run()
+    bump_version, refresh_cache, transition_visit, transition_failure,
+    find_checkin_visit, reserve_and_insert, settle_checkout, expire_no_shows,
+    archive_visits, reset_queue, find_clinics, read_duration_stats,
+    write_duration_stats,
+)
+
+PORT: int = 5001
+
+# Set in lifespan(): the async client must be created on the serving event loop
+db = None
+queue_collection = None
+visits_collection = None
+log_collection = None
+snapshots_collection = None
+history_collection = None
+stats_collection = None
+change_log = None
+
+# Same settings as server.py
+QUEUE_CACHE_MAX_AGE = float(os.environ.get("QUEUE_CACHE_MAX_AGE", "1.0"))
+SSE_BUFFER_SIZE = int(os.environ.get("SSE_BUFFER_SIZE", "256"))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+STAFF_ORIGIN = os.environ.get("STAFF_ORIGIN", "http://127.0.0.1:5002")
+MAINTENANCE_LEASE_SECONDS = float(os.environ.get("MAINTENANCE_LEASE_SECONDS", "15"))
+PRUNE_INTERVAL_SECONDS = float(os.environ.get("PRUNE_INTERVAL_SECONDS", "60"))
+
+# queue_id -> QueueCache. Everything runs on one event loop, so no lock is
+# needed around the dict itself.
+_queue_caches = {}
+
+# queue_id -> DurationEstimator, saved every DURATION_STATS_SAVE_SECONDS (see server.py)
+_estimators = {}
+
+queue_events = QueueEventBroker(buffer_size=SSE_BUFFER_SIZE, subscriber_class=AsyncSubscriber)
+
+# Set in lifespan() when Mongo is configured
+maintenance_lease = None
+# Check-in deadlines the pruner is waiting on (only filled in the maintenance
+# leader); deadline_added wakes it when a new one comes first
+deadlines = DeadlineIndex()
+deadline_added = asyncio.Event()
+
+
+class QueueIdConvertor(Convertor):
+    regex = QUEUE_ID_PATTERN
+
+    def convert(self, value):
+        return value
+
+    def to_string(self, value):
+        return value
+
+
+register_url_convertor("queue_id", QueueIdConvertor())
+
+
+def route_queue_id(request):
+    """Clinic from /api/clinics/{queue_id}/..., or the main queue on the routes without one."""
+    return request.path_params.get("queue_id", QUEUE_ID)
+
+
+def json_response(body, status=200):
+    return Response(json.dumps(body), status_code=status, media_type="application/json")
+
+
+def not_configured():
+    return json_response({"error": "MONGODB_URI not set"}, 500)
+
+
+def etag_matches(header, etag):
+    """True if an If-None-Match header value matches the (unquoted) etag."""
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"') == etag:
+            return True
+    return False
+
+
+async def run(steps):
+    """Run a queue_logic step function against the database."""
+    return await database.run_steps_async(steps, db)
+
+
+def _queue_cache(queue_id):
+    cache = _queue_caches.get(queue_id)
+    if cache is None:
+        cache = _queue_caches[queue_id] = QueueCache(queue_id, ACTIVE_STATUSES)
+    return cache
+
+
+def get_estimator(queue_id):
+    estimator = _estimators.get(queue_id)
+    if estimator is None:
+        estimator = _estimators[queue_id] = DurationEstimator(
+            alpha=DURATION_EWMA_ALPHA, quantile=DURATION_QUANTILE, min_samples=DURATION_MIN_SAMPLES
+        )
+    return estimator
+
+
+async def save_duration_stats_loop():
+    while True:
+        await asyncio.sleep(DURATION_STATS_SAVE_SECONDS)
+        try:
+            await run(write_duration_stats(list(_estimators.items()), datetime.now()))
+        except PyMongoError:
+            pass
+
+
+async def get_queue_cache(queue_id):
+    """Return the cache for queue_id, reloading it from Mongo if another process changed the queue."""
+    return await run(refresh_cache(_queue_cache(queue_id), QUEUE_CACHE_MAX_AGE))
+
+
+def track_deadlines(visits):
+    """Tell the pruner about new or moved check-in deadlines (only the maintenance leader prunes)."""
+    if maintenance_lease is not None and maintenance_lease.held:
+        for visit in visits:
+            if deadlines.add(visit.get("checkin_deadline")):
+                deadline_added.set()
+
+
+def record_change(queue_id, version, event_type, visit=None, meta=None, removed=(), shift=None, visits=(), **data):
+    """Apply a change that has already been persisted to Mongo to the cache and
+    publish it to live subscribers."""
+    _queue_cache(queue_id).apply(version, visit=visit, meta=meta, removed=removed, shift=shift, visits=visits)
+    if version is None:
+        return
+    change_log.add(log_event(queue_id, version, event_type, datetime.now(),
+                             visit=visit, meta=meta, removed=removed, shift=shift, visits=visits))
+    if visit is not None:
+        data["visit"] = visit_delta(visit)
+    if visits:
+        data["visits"] = [visit_delta(v) for v in visits]
+    publish_event(queue_id, version, event_type, **data)
+
+
+def publish_event(queue_id, version, event_type, **data):
+    queue_events.publish(queue_id, dict(data, type=event_type, version=version))
+
+
+async def transition_error(queue_id, name, from_status, message):
+    """Build the error response for a transition that matched no visit."""
+    return json_response(*await run(transition_failure(queue_id, name, from_status, message)))
+
+
+async def join_visits(queue_id, rows):
+    """Reserve slots for rows of join form values and insert their visits.
+
+    Returns (version, queue document, visits, response rows), or None if the
+    queue does not exist.
+    """
+    now = datetime.now()
+    estimator = get_estimator(queue_id)
+    durations = [expected_duration_minutes_for(fields.get("reason"), estimator) for fields in rows]
+    joined = await run(reserve_and_insert(queue_id, rows, durations, now))
+    if joined is None:
+        return None
+    qdoc, patients, results = joined
+    track_deadlines(patients)
+    return qdoc.get("version"), qdoc, patients, results
+
+
+async def form_name(request):
+    form = await request.form()
+    return form, (form.get("patient_name") or "").strip()
+
+
+# -----------------------------------------------------------
+# routes
+# -----------------------------------------------------------
+
+
+async def root_service(request):
+    return json_response({"msg": "UrgentCareQ Backend", "port": PORT})
+
+
+async def staff_db_pool(request):
+    return json_response(database.pool_metrics.snapshot())
+
+
+async def metrics_endpoint(request):
+    gauges = metrics.scrape_gauges(
+        dict(_queue_caches),
+        dict(_estimators),
+        database.pool_metrics.snapshot(),
+        change_log.stats() if change_log is not None else None
+    )
+    return Response(metrics.registry.render(gauges), status_code=200, media_type=metrics.CONTENT_TYPE)
+
+
+async def list_clinics(request):
+    if queue_collection is None:
+        return not_configured()
+    return json_response({"clinics": await run(find_clinics())})
+
+
+async def staff_get_queue(request):
+    if queue_collection is None:
+        return not_configured()
+    queue_id = route_queue_id(request)
+
+    cache = await get_queue_cache(queue_id)
+    version, body = cache.serialized(render_queue)
+    if body is None:
+        return json_response({"error": "queue not initialized", "patients": []})
+
+    headers = {"Cache-Control": "no-cache"}
+    if not cache.settled:
+        # may still be missing a join that already moved the version, so no tag
+        return Response(body, media_type="application/json", headers=headers)
+
+    etag = f"{cache.queue_id}-{version}"
+    headers["ETag"] = f'"{etag}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def staff_queue_stream(request):
+    if queue_collection is None:
+        return not_configured()
+    queue_id = route_queue_id(request)
+
+    # subscribe before taking the snapshot so no change falls in between
+    sub = queue_events.subscribe(queue_id)
+
+    async def stream():
+        try:
+            resync = True
+            version = None
+            while True:
+                if resync:
+                    version, body = (await get_queue_cache(queue_id)).serialized(render_queue)
+                    snapshot_version = version
+                    yield sse_message("resync", body.decode("utf-8") if body else "null", version)
+                    resync = False
+
+                overflowed, pending = await sub.drain(SSE_HEARTBEAT_SECONDS)
+                if sub.closed:
+                    return  # server is shutting down, the client reconnects elsewhere
+                if overflowed:
+                    resync = True
+                    continue
+
+                if not pending:
+                    # changes made by other processes are not published here
+                    if (await get_queue_cache(queue_id)).version != version:
+                        resync = True
+                    else:
+                        yield ": keepalive\n\n"
+                    continue
+
+                for event in pending:
+                    step = stream_step(event, version, snapshot_version)
+                    if step == "skip":
+                        continue
+                    if step == "resync":
+                        resync = True
+                        break
+                    version = event["version"]
+                    yield sse_message(event["type"], json.dumps(event), version)
+        finally:
+            queue_events.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "Access-Control-Allow-Origin": STAFF_ORIGIN
+    })
+
+
+async def staff_queue_projection(request):
+    if queue_collection is None:
+        return not_configured()
+    queue_id = route_queue_id(request)
+
+    raw = await request.body()
+    try:
+        body = json.loads(raw) if raw else None
+    except ValueError:
+        return json_response({"error": "Body must be JSON"}, 400)
+    try:
+        changes = parse_changes(body)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+
+    cache = await get_queue_cache(queue_id)
+    if not cache.is_loaded():
+        return json_response({"error": "queue not initialized"}, 400)
+    qdoc, visits = cache.snapshot()
+
+    started = time.perf_counter()
+    try:
+        projection = project_queue(qdoc, visits, changes, datetime.now())
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    projection["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return json_response(projection)
+
+
+async def staff_reset(request):
+    if queue_collection is None:
+        return not_configured()
+    queue_id = route_queue_id(request)
+
+    # only this clinic's documents; other clinics are untouched
+    now = datetime.now()
+    doc = await run(reset_queue(queue_id, now))
+    _queue_cache(queue_id).load(doc, [])
+    change_log.add(log_event(queue_id, doc["version"], "reset", now, meta=doc))
+    publish_event(queue_id, doc["version"], "reset")
+    return json_response({
+        "queue_id": queue_id,
+        "start_time": now.isoformat(),
+        "room_free_at": None,
+        "rooms": [{"room": r["room"], "free_at": r["free_at"].isoformat()} for r in doc["rooms"]],
+        "global_delay_minutes": 0
+    })
+
+
+async def patient_joinqueue(request):
+    if queue_collection is None:
+        return not_configured()
+    queue_id = route_queue_id(request)
+
+    form = await request.form()
+    joined = await join_visits(queue_id, [form])
+    if joined is None:
+        return json_response({"error": "queue not initialized"}, 400)
+    version, qdoc, patients, rows = joined
+    record_change(queue_id, version, "joined", visit=patients[0], meta=qdoc)
+    return json_response(rows[0])
+
+
+async def patient_joinqueue_batch(request):
+    if queue_collection is None:
+        return not_configured()
+    queue_id = route_queue_id(request)
+
+    mimetype = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        rows = parse_join_batch((await request.body()).decode("utf-8"), mimetype)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    if len(rows) > JOIN_BATCH_MAX:
+        return json_response({"error": f"At most {JOIN_BATCH_MAX} patients per batch"}, 413)
+
+    joined = await join_visits(queue_id, rows)
+    if joined is None:
+        return json_response({"error": "queue not initialized"}, 400)
+    version, qdoc, patients, results = joined
+    record_change(queue_id, version, "joined", visits=patients, meta=qdoc)
+    return json_response({"count": len(results), "patients": results})
+
+
+async def patient_checkin(request):
+    if queue_collection is None:
+        return not_configured()
+    queue_id = route_queue_id(request)
+
+    form, name = await form_name(request)
+    dob = (form.get("dob") or "").strip()
+    if not name:
+        return json_response({"error": "Patient name is required"}, 400)
+
+    cache = await get_queue_cache(queue_id)
+    if not cache.is_loaded():
+        return json_response({"error": "queue not initialized"}, 400)
+
+    # in-memory name index first, the Mongo index if this process has not seen the join
+    patient, error = await run(find_checkin_visit(cache, name, dob))
+    if error is not None:
+        return json_response(*error)
+
+    scheduled_time = patient.get("scheduled_time")
+    updated = await run(transition_visit(
+        {"_id": patient["_id"]},
+        "waiting",
+        {"$set": {"checked_in": True, "checked_in_at": datetime.now(), "status": "checked_in"}}
+    ))
+    if updated is None:
+        return json_response({"error": f"Patient '{name}' was already checked in", "conflict": True}, 409)
+    record_change(updated["queue_id"], await run(bump_version(updated["queue_id"])), "checked_in", visit=updated)
+
+    return json_response({
+        "message": "Check-in successful",
+        "patient_name": name,
+        "checked_in": True,
+        "scheduled_time": scheduled_time.isoformat() if scheduled_time else None
+    })
+
+
+async def staff_admit(request):
+    if queue_collection is None:
+        return not_configured()
+    queue_id = route_queue_id(request)
+
+    form, name = await form_name(request)
+    if not name:
+        return json_response({"error": "Patient name is required"}, 400)
+
+    updated = await run(transition_visit(
+        {"queue_id": queue_id, "name_normalized": normalize_name(name)},
+        "checked_in",
+        {"$set": {"status": "admitted", "admitted_at": datetime.now()}}
+    ))
+    if updated is None:
+        return await transition_error(queue_id, name, "checked_in", "Patient must be checked in before being admitted")
+    record_change(queue_id, await run(bump_version(queue_id)), "admitted", visit=updated)
+
+    return json_response({
+        "message": "Patient admitted successfully",
+        "patient_name": name,
+        "status": "admitted"
+    })
+
+
+async def staff_checkout(request):
+    if queue_collection is None:
+        return not_configured()
+    queue_id = route_queue_id(request)
+
+    form, name = await form_name(request)
+    if not name:
+        return json_response({"error": "Patient name is required"}, 400)
+
+    removed_patient = await run(transition_visit(
+        {"queue_id": queue_id, "name_normalized": normalize_name(name)},
+        "admitted",
+        checkout_update(datetime.now())
+    ))
+    if removed_patient is None:
+        return await transition_error(queue_id, name, "admitted", "Patient must be admitted before checkout")
+    # learn this reason's duration for future joins
+    get_estimator(queue_id).observe(reason_key(removed_patient.get("reason")), removed_patient.get("actual_duration_minutes"))
+
+    room = removed_patient.get("room")
+    qdoc, delta_minutes, shift, pulled, shifted = await run(settle_checkout(queue_id, removed_patient))
+    track_deadlines(pulled)
+    record_change(queue_id, qdoc.get("version"), "completed", visit=removed_patient, meta=qdoc, shift=shift, visits=pulled)
+    if delta_minutes or pulled:
+        publish_event(
+            queue_id, qdoc.get("version"), "delay_changed",
+            delta_minutes=delta_minutes,
+            shifted=shifted,
+            room=room,
+            room_free_at=qdoc.get("room_free_at").isoformat(),
+            global_delay_minutes=qdoc.get("global_delay_minutes", 0)
+        )
+
+    return json_response(checkout_body(name, removed_patient, delta_minutes, qdoc))
+
+
+# -----------------------------------------------------------
+# maintenance and lifecycle
+# -----------------------------------------------------------
+
+
+async def prune_no_shows():
+    if queue_collection is None:
+        return
+    now = datetime.now()
+    deadlines.pop_due(now)
+    removed, upcoming = await run(expire_no_shows(now))
+    for queue_id, qdoc, expired in removed:
+        version = qdoc.get("version") if qdoc is not None else None
+        record_change(queue_id, version, "pruned", meta=qdoc, removed=expired, ids=[str(i) for i in expired])
+    if upcoming is not None:
+        deadlines.add(upcoming)
+
+
+async def archive_completed_visits():
+    if visits_collection is not None:
+        await run(archive_visits())
+
+
+async def snapshot_queues():
+    if queue_collection is not None:
+        await run(take_snapshots())
+
+
+async def wait_for_deadline():
+    """Sleep until the next tracked deadline, at most PRUNE_INTERVAL_SECONDS.
+
+    A join adding an earlier deadline meanwhile shortens the sleep.
+    """
+    loop = asyncio.get_running_loop()
+    give_up = loop.time() + PRUNE_INTERVAL_SECONDS
+    while True:
+        deadline_added.clear()
+        timeout = give_up - loop.time()
+        upcoming = deadlines.next_deadline()
+        if upcoming is not None:
+            timeout = min(timeout, (upcoming - datetime.now()).total_seconds())
+        if timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(deadline_added.wait(), timeout)
+        except asyncio.TimeoutError:
+            return
+
+
+async def run_maintenance():
+    """Prune no-shows as their deadlines pass, archive completed visits and
+    snapshot busy queues while this process holds the maintenance lease."""
+    while True:
+        if not await maintenance_lease.try_acquire():
+            await asyncio.sleep(MAINTENANCE_LEASE_SECONDS / 3)
+            continue
+        for task in (prune_no_shows, archive_completed_visits, snapshot_queues):
+            try:
+                await task()
+            except Exception:
+                pass
+        await wait_for_deadline()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global db, queue_collection, visits_collection, log_collection, snapshots_collection, history_collection
+    global stats_collection
+    global change_log, maintenance_lease
+    database.load_env()
+    db = database.get_async_db()
+    maintenance = None
+    stats_saver = None
+    if db is not None:
+        queue_collection = db.queue
+        visits_collection = db.visits
+        log_collection = db.queue_log
+        snapshots_collection = db.queue_snapshots
+        history_collection = db.visit_history
+        stats_collection = db.duration_stats
+        await database.ensure_indexes_async(db)
+        await run(restore_snapshots(_queue_cache))
+        await run(read_duration_stats(get_estimator))
+        stats_saver = asyncio.create_task(save_duration_stats_loop())
+        change_log = AsyncBatchWriter(log_collection, flush_interval=EVENT_LOG_FLUSH_SECONDS)
+        change_log.start()
+        maintenance_lease = AsyncMongoLease(db.leases, "maintenance", MAINTENANCE_LEASE_SECONDS)
+        maintenance = asyncio.create_task(run_maintenance())
+    try:
+        yield
+    finally:
+        if maintenance is not None:
+            maintenance.cancel()
+            try:
+                await maintenance
+            except asyncio.CancelledError:
+                pass
+            # hand the lease over right away
+            await maintenance_lease.release()
+        if change_log is not None:
+            await change_log.stop()
+        if stats_saver is not None:
+            stats_saver.cancel()
+            try:
+                await run(write_duration_stats(list(_estimators.items()), datetime.now()))
+            except PyMongoError:
+                pass
+        queue_events.close()
+        await database.close_async_client()
+
+
+# Every clinic has its own queue under /api/clinics/{queue_id}/...; the
+# routes without a clinic serve the "main" queue.
+QUEUE_ROUTES = [
+    ("/staff/queue", staff_get_queue, ["GET"]),
+    ("/staff/queue/stream", staff_queue_stream, ["GET"]),
+    ("/staff/queue/projection", staff_queue_projection, ["POST"]),
+    ("/staff/reset", staff_reset, ["POST"]),
+    ("/patient/joinqueue", patient_joinqueue, ["POST"]),
+    ("/patient/joinqueue/batch", patient_joinqueue_batch, ["POST"]),
+    ("/patient/checkin", patient_checkin, ["POST"]),
+    ("/staff/admit", staff_admit, ["POST"]),
+    ("/staff/checkout", staff_checkout, ["POST"]),
+]
+
+# every request is timed for /metrics
+MIDDLEWARE = [Middleware(metrics.MetricsMiddleware, registry=metrics.registry)]
+
+app = Starlette(lifespan=lifespan, middleware=MIDDLEWARE, routes=[
+    Route("/", root_service),
+    Route("/api/staff/db/pool", staff_db_pool),
+    Route("/metrics", metrics_endpoint),
+    Route("/api/clinics", list_clinics),
+    *[Route("/api" + path, endpoint, methods=methods) for path, endpoint, methods in QUEUE_ROUTES],
+    *[Route("/api/clinics/{queue_id:queue_id}" + path, endpoint, methods=methods) for path, endpoint, methods in QUEUE_ROUTES],
+])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=PORT)
@@ -0,0 +1,221 @@
+"""
+Filename: batch_writer.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Buffered background inserts for the append-only queue event
+log (queue_log), so request handlers never wait on it. Visit history is not
+written here: archiving copies completed visits to visit_history directly
+(see queue_logic.archive_visits).
+"""
+
+import asyncio
+from collections import deque
+import logging
+import threading
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+DUPLICATE_KEY = 11000
+
+log = logging.getLogger(__name__)
+
+
+def _only_duplicates(error):
+    """True if a bulk insert failed only on documents that were already written."""
+    errors = error.details.get("writeErrors", [])
+    return bool(errors) and all(e.get("code") == DUPLICATE_KEY for e in errors) \
+        and not error.details.get("writeConcernErrors")
+
+
+def _duplicate_count(collection, error):
+    """Number of documents a duplicates-only bulk insert skipped, logged as a warning."""
+    skipped = len(error.details["writeErrors"])
+    log.warning("%s: skipped %d documents that already existed", collection.name, skipped)
+    return skipped
+
+
+class _Buffer:
+    """Bounded FIFO of pending documents. When full the oldest are dropped."""
+
+    def __init__(self, max_buffer):
+        self.docs = deque()
+        self.max_buffer = max_buffer
+        self.written = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+    def push(self, doc):
+        if len(self.docs) >= self.max_buffer:
+            self.docs.popleft()
+            self.dropped += 1
+        self.docs.append(doc)
+
+    def take(self, n):
+        return [self.docs.popleft() for _ in range(min(n, len(self.docs)))]
+
+    def put_back(self, batch):
+        """Return a batch that failed to the front of the buffer, to be retried."""
+        room = self.max_buffer - len(self.docs)
+        keep = batch[:max(room, 0)]
+        self.dropped += len(batch) - len(keep)
+        self.docs.extendleft(reversed(keep))
+
+    def stats(self):
+        return {
+            "pending": len(self.docs),
+            "written": self.written,
+            "duplicates": self.duplicates,
+            "dropped": self.dropped,
+            "failed_batches": self.failed_batches,
+        }
+
+
+class BatchWriter:
+    """Inserts documents into a collection in batches from a daemon thread.
+
+    add() only appends to an in-memory buffer. The writer flushes every
+    flush_interval seconds, or as soon as max_batch documents are waiting,
+    with one unordered insert_many. A batch that fails on a network error is
+    retried on the next flush; documents that already exist (a retried batch
+    that had partly landed) are skipped and counted as duplicates. Anything still buffered when the
+    process is killed is lost, so only use this for data that is rebuilt or
+    best-effort.
+    """
+
+    def __init__(self, collection, max_batch=500, flush_interval=1.0, max_buffer=50000):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.buffer = _Buffer(max_buffer)
+        self.cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, doc):
+        with self.cond:
+            self.buffer.push(doc)
+            if len(self.buffer.docs) >= self.max_batch:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self._stop and len(self.buffer.docs) < self.max_batch:
+                    self.cond.wait(self.flush_interval)
+                stopping = self._stop
+            self.flush()
+            if stopping:
+                return
+
+    def flush(self):
+        """Write everything buffered now. Returns False if a batch failed and was kept for retry."""
+        while True:
+            with self.cond:
+                batch = self.buffer.take(self.max_batch)
+            if not batch:
+                return True
+            duplicates = 0
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                written = len(batch)
+            except BulkWriteError as e:
+                if not _only_duplicates(e):
+                    with self.cond:
+                        self.buffer.failed_batches += 1
+                    return False  # nothing put back: the non-duplicate errors will not succeed on retry
+                written = e.details.get("nInserted", 0)
+                duplicates = _duplicate_count(self.collection, e)
+            except PyMongoError:
+                with self.cond:
+                    self.buffer.failed_batches += 1
+                    self.buffer.put_back(batch)
+                return False
+            with self.cond:
+                self.buffer.written += written
+                self.buffer.duplicates += duplicates
+
+    def stop(self, timeout=None):
+        """Flush what is buffered and stop the thread."""
+        with self.cond:
+            self._stop = True
+            self.cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        else:
+            self.flush()
+
+    def stats(self):
+        with self.cond:
+            return self.buffer.stats()
+
+
+class AsyncBatchWriter:
+    """BatchWriter for an async collection (async_server.py), flushed from an asyncio task."""
+
+    def __init__(self, collection, max_batch=500, flush_interval=1.0, max_buffer=50000):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.buffer = _Buffer(max_buffer)
+        self._full = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def add(self, doc):
+        self.buffer.push(doc)
+        if len(self.buffer.docs) >= self.max_batch:
+            self._full.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        while True:
+            batch = self.buffer.take(self.max_batch)
+            if not batch:
+                return True
+            duplicates = 0
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+                written = len(batch)
+            except BulkWriteError as e:
+                if not _only_duplicates(e):
+                    self.buffer.failed_batches += 1
+                    return False
+                written = e.details.get("nInserted", 0)
+                duplicates = _duplicate_count(self.collection, e)
+            except PyMongoError:
+                self.buffer.failed_batches += 1
+                self.buffer.put_back(batch)
+                return False
+            self.buffer.written += written
+            self.buffer.duplicates += duplicates
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return self.buffer.stats()
@@ -0,0 +1,330 @@
+"""
+Filename: database.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Shared MongoDB client for the backend and its scripts.
+
+The client is configured from the environment (backend/.env or
+backend/envfile.txt) and created on first use. It is built with
+connect=False, so no connection is opened until the first operation.
+async_server.py uses an AsyncMongoClient built from the same options.
+
+run_steps() and run_steps_async() carry out the Mongo call sequences in
+queue_logic.py, so the sync and async backends share them.
+
+Environment:
+    MONGODB_URI                        connection string (required)
+    MONGO_MAX_POOL_SIZE                connections per server (default 100)
+    MONGO_MIN_POOL_SIZE                connections kept open while idle (default 0)
+    MONGO_WAIT_QUEUE_TIMEOUT_MS        max wait for a free pooled connection (default: no limit)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS  max wait to find a usable server (default 30000)
+    MONGO_CONNECT_TIMEOUT_MS           TCP connect timeout (default 20000)
+    MONGO_SOCKET_TIMEOUT_MS            max wait for a reply (default: no limit)
+    MONGO_READ_PREFERENCE              primary, primaryPreferred, secondary, ... (default primary)
+    MONGO_WRITE_CONCERN                w value, e.g. 1 or majority (default: server default)
+    MONGO_JOURNAL                      true to wait for the journal on writes
+    VISIT_HISTORY_RETENTION_DAYS       days completed visits are kept in visit_history,
+                                       0 keeps them forever (default 730)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, AsyncMongoClient, monitoring
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from metrics import command_metrics
+
+_env_dir = Path(__file__).resolve().parent
+
+# Completed visits expire from visit_history this many days after checkout.
+# Export anything needed for longer (e.g. to cold storage) before then. The
+# TTL is fixed when the index is first built; change it with collMod.
+VISIT_HISTORY_RETENTION_DAYS = int(os.environ.get("VISIT_HISTORY_RETENTION_DAYS", "730"))
+
+
+def load_env():
+    _env_path = _env_dir / ".env"
+    if _env_path.exists():
+        load_dotenv(dotenv_path=_env_path)
+    else:
+        _envfile = _env_dir / "envfile.txt"
+        if _envfile.exists():
+            load_dotenv(dotenv_path=_envfile)
+
+
+def _env_int(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters, fed by the driver's pool events.
+
+    wait time is measured from the start of a checkout until a connection is
+    handed out (or the checkout fails). Drivers that report the duration on
+    the event are trusted; otherwise it is timed on the requesting thread,
+    which only works for the sync client.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_out = 0  # connections currently in use
+        self.max_checked_out = 0
+        self.open = 0  # connections created and not yet closed
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._local = threading.local()
+
+    def _waited(self, event):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            return duration
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._waited(event)
+        with self.lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def connection_check_out_failed(self, event):
+        waited = self._waited(event)
+        with self.lock:
+            self.checkout_failures += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+
+    # events the metrics do not use
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self):
+        with self.lock:
+            attempts = self.checkouts + self.checkout_failures
+            return {
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "open": self.open,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "wait_seconds_avg": self.wait_seconds_total / attempts if attempts else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+pool_metrics = PoolMetrics()
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+
+def client_options():
+    """MongoClient keyword arguments built from the environment."""
+    options = {
+        "server_api": ServerApi('1'),
+        "connect": False,
+        "maxPoolSize": _env_int("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _env_int("MONGO_MIN_POOL_SIZE", 0),
+        "serverSelectionTimeoutMS": _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000),
+        "connectTimeoutMS": _env_int("MONGO_CONNECT_TIMEOUT_MS", 20000),
+        # pool counters for /api/staff/db/pool, command timings for /metrics
+        "event_listeners": [pool_metrics, command_metrics],
+    }
+    wait_queue_timeout = _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS")
+    if wait_queue_timeout is not None:
+        options["waitQueueTimeoutMS"] = wait_queue_timeout
+    socket_timeout = _env_int("MONGO_SOCKET_TIMEOUT_MS")
+    if socket_timeout is not None:
+        options["socketTimeoutMS"] = socket_timeout
+    read_preference = os.environ.get("MONGO_READ_PREFERENCE")
+    if read_preference:
+        options["readPreference"] = read_preference
+    w = os.environ.get("MONGO_WRITE_CONCERN")
+    if w:
+        options["w"] = int(w) if w.isdigit() else w
+    if os.environ.get("MONGO_JOURNAL", "").lower() in ("1", "true", "yes"):
+        options["journal"] = True
+    return options
+
+
+def get_client():
+    """Return the shared client, creating it on first call. None if MONGODB_URI is not set."""
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            load_env()
+            uri = os.environ.get("MONGODB_URI")
+            if uri:
+                _client = MongoClient(uri, **client_options())
+        return _client
+
+
+def get_db():
+    client = get_client()
+    return client.urgentcare if client is not None else None
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_async_client():
+    """Return the shared async client, creating it on first call. None if MONGODB_URI is not set.
+
+    Must be called from the event loop that will use it.
+    """
+    global _async_client
+    if _async_client is None:
+        load_env()
+        uri = os.environ.get("MONGODB_URI")
+        if uri:
+            _async_client = AsyncMongoClient(uri, **client_options())
+    return _async_client
+
+
+def get_async_db():
+    client = get_async_client()
+    return client.urgentcare if client is not None else None
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+
+def index_specs():
+    """(collection, keys, options) of every index the backend relies on.
+
+    Everything a request touches is keyed by queue_id first, so each clinic's
+    traffic stays on its own queue document and its own range of visits. On
+    a sharded cluster, shard visits on {queue_id: 1} (or hashed queue_id for
+    many small clinics); the queue collection is small and can stay unsharded.
+    """
+    specs = [
+        # one queue document per clinic
+        ("queue", [("queue_id", ASCENDING)], {"unique": True}),
+        # queue reads: indexed range scan over active visits in queue order
+        ("visits", [("queue_id", ASCENDING), ("status", ASCENDING), ("position", ASCENDING)], {}),
+        # check-in/admit/checkout lookups by name, DOB disambiguates duplicates
+        ("visits", [("queue_id", ASCENDING), ("name_normalized", ASCENDING), ("dob", ASCENDING)], {}),
+        # no-show pruning: expired and next-due check-in deadlines across all clinics
+        ("visits", [("status", ASCENDING), ("checkin_deadline", ASCENDING)], {}),
+        # change log replay: one event per queue version (see event_log.py)
+        ("queue_log", [("queue_id", ASCENDING), ("version", ASCENDING)], {"unique": True}),
+        # maintenance leases nobody renews any more (see lease.py)
+        ("leases", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+        # visit history: per-clinic, per-reason durations over a time range
+        ("visit_history", [("queue_id", ASCENDING), ("reason", ASCENDING), ("completed_at", ASCENDING)], {}),
+        # learned visit durations, one document per clinic and reason (see estimator.py)
+        ("duration_stats", [("queue_id", ASCENDING), ("reason", ASCENDING)], {"unique": True}),
+    ]
+    if VISIT_HISTORY_RETENTION_DAYS > 0:
+        # retention: the TTL monitor drops visits older than the retention period
+        specs.append(("visit_history", [("completed_at", ASCENDING)],
+                      {"expireAfterSeconds": VISIT_HISTORY_RETENTION_DAYS * 86400}))
+    return specs
+
+
+def ensure_indexes(db):
+    for collection, keys, options in index_specs():
+        db[collection].create_index(keys, **options)
+
+
+async def ensure_indexes_async(db):
+    for collection, keys, options in index_specs():
+        await db[collection].create_index(keys, **options)
+
+
+def run_steps(steps, db):
+    """Run a step function (see queue_logic.Op) with blocking calls on db and return its result.
+
+    An exception raised by a call is thrown into the step function at the
+    yield that asked for it.
+    """
+    advance, value = steps.send, None
+    while True:
+        try:
+            op = advance(value)
+        except StopIteration as done:
+            return done.value
+        try:
+            if op.collection is None:
+                time.sleep(*op.args)
+                value = None
+            else:
+                value = getattr(db[op.collection], op.method)(*op.args, **op.kwargs)
+                if op.method == "find":
+                    value = list(value)
+            advance = steps.send
+        except Exception as error:
+            advance, value = steps.throw, error
+
+
+async def run_steps_async(steps, db):
+    """run_steps() for an async database (async_server.py): every call is awaited."""
+    advance, value = steps.send, None
+    while True:
+        try:
+            op = advance(value)
+        except StopIteration as done:
+            return done.value
+        try:
+            if op.collection is None:
+                await asyncio.sleep(*op.args)
+                value = None
+            elif op.method == "find":
+                value = await db[op.collection].find(*op.args, **op.kwargs).to_list(None)
+            else:
+                value = await getattr(db[op.collection], op.method)(*op.args, **op.kwargs)
+            advance = steps.send
+        except Exception as error:
+            advance, value = steps.throw, error
@@ -0,0 +1,167 @@
+"""
+Filename: event_log.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Append-only log of queue changes and the snapshots it is
+replayed from. Shared by server.py and async_server.py; no I/O here (the
+Mongo calls are step functions, see queue_logic.Op).
+
+Every change the backends make (join, check-in, admit, checkout, prune,
+reset) is logged as one compact event in queue_log, keyed by the
+(queue_id, version) the change produced:
+
+    {queue_id, version, type, at, visits?, set?, removed?, meta?, shift?}
+
+- visits: full documents of newly joined visits (or other visits a change
+  rewrote, e.g. ones pulled in after an early checkout)
+- set: only the fields a transition changed on its visit
+- removed: ids of visits that left the queue (pruned no-shows)
+- meta: the queue document after the change, when the change touched it
+- shift: {delta_ms, room} when a checkout moved the pending visits
+
+The maintenance leader writes a snapshot of each queue (queue document plus
+active visits at one version) to queue_snapshots every SNAPSHOT_EVERY_EVENTS
+versions. On startup a worker loads the latest snapshot and replays only the
+events logged after it, so recovery costs O(events since snapshot). Any gap
+in the replayed versions (an event still buffered when a worker died) just
+means the cache is reloaded from the live collections as before; the live
+documents remain the source of truth.
+"""
+
+from datetime import datetime, timedelta
+import os
+
+from pymongo import ASCENDING
+
+from queue_logic import VISIT_STATUSES, PENDING_STATUSES, SHIFTED_FIELDS, Op, find_active_visits, joins_settled
+
+# Versions between two snapshots of the same queue
+SNAPSHOT_EVERY_EVENTS = int(os.environ.get("SNAPSHOT_EVERY_EVENTS", "500"))
+# Seconds between event log flushes; events are buffered in memory until then
+EVENT_LOG_FLUSH_SECONDS = float(os.environ.get("EVENT_LOG_FLUSH_SECONDS", "1.0"))
+
+# Fields each transition changes, logged instead of the whole visit
+TRANSITION_FIELDS = {
+    "checked_in": ["status", "checked_in", "checked_in_at"],
+    "admitted": ["status", "admitted_at"],
+    "completed": ["status", "completed_at", "actual_duration_minutes"],
+}
+
+
+def _strip_id(doc):
+    return {k: v for k, v in doc.items() if k != "_id"}
+
+
+def log_event(queue_id, version, event_type, now, visit=None, meta=None, removed=(), shift=None, visits=()):
+    """Build the log entry for a change record_change() applied at version."""
+    event = {"queue_id": queue_id, "version": version, "type": event_type, "at": now}
+    changed = list(visits)
+    fields = TRANSITION_FIELDS.get(event_type)
+    if visit is not None and fields is not None:
+        event["set"] = [dict({f: visit.get(f) for f in fields if f in visit}, _id=visit["_id"])]
+    elif visit is not None:
+        changed.insert(0, visit)
+    if changed:
+        event["visits"] = changed
+    if removed:
+        event["removed"] = list(removed)
+    if meta is not None:
+        event["meta"] = _strip_id(meta)
+    if shift is not None:
+        delta, _statuses, _fields, *room = shift
+        event["shift"] = {"delta_ms": int(delta.total_seconds() * 1000), "room": room[0] if room else None}
+    return event
+
+
+def snapshot_doc(qdoc, visits, now):
+    """Snapshot of one queue, stored with _id = queue_id so each queue keeps only its latest."""
+    return {
+        "_id": qdoc["queue_id"],
+        "queue_id": qdoc["queue_id"],
+        "version": qdoc.get("version", 0),
+        "at": now,
+        "queue": _strip_id(qdoc),
+        "visits": visits,
+    }
+
+
+def snapshot_due(version, snapshot_version):
+    return snapshot_version is None or version - snapshot_version >= SNAPSHOT_EVERY_EVENTS
+
+
+def replay_event(cache, event):
+    """Apply one logged event to a loaded QueueCache. Returns False on a version gap."""
+    if event["type"] == "reset":
+        cache.load(dict(event["meta"], version=event["version"]), [])
+        return True
+    changed = list(event.get("visits", []))
+    for fields in event.get("set", []):
+        base = cache.visits.get(fields["_id"]) or {}
+        visit = dict(base, **fields)
+        if VISIT_STATUSES.index(base.get("status", "waiting")) > VISIT_STATUSES.index(fields["status"]):
+            # a transition's write and its version bump are two steps, so a
+            # check-in can be numbered after the admit that followed it
+            visit["status"] = base["status"]
+        changed.append(visit)
+    shift = None
+    if "shift" in event:
+        delta = timedelta(milliseconds=event["shift"]["delta_ms"])
+        shift = (delta, PENDING_STATUSES, SHIFTED_FIELDS, event["shift"]["room"])
+    return cache.apply(
+        event["version"],
+        meta=event.get("meta"),
+        visits=changed,
+        removed=event.get("removed", ()),
+        shift=shift
+    )
+
+
+def restore_cache(cache, snapshot, events):
+    """Load snapshot into cache and replay events (sorted by version) on top.
+
+    Returns the number of events replayed, or None if the log has a gap and
+    the cache was invalidated. The restored cache is marked for a version
+    check on its first read, so a queue that moved on since is reloaded.
+    """
+    cache.load(dict(snapshot["queue"], version=snapshot["version"]), snapshot["visits"])
+    replayed = 0
+    for event in events:
+        if not replay_event(cache, event):
+            return None
+        replayed += 1
+    cache.expire()
+    return replayed
+
+
+def take_snapshot(queue_id):
+    """Store the queue document and its active visits, if they were read at one version."""
+    qdoc = yield Op("queue", "find_one", {"queue_id": queue_id})
+    if qdoc is None:
+        return False
+    visits = yield from find_active_visits(queue_id)
+    head = yield Op("queue", "find_one", {"queue_id": queue_id}, {"version": 1})
+    if head is None or head.get("version") != qdoc.get("version") or not (yield from joins_settled(qdoc, visits)):
+        return False  # changed while reading; try again on the next run
+    yield Op("queue_snapshots", "replace_one", {"_id": queue_id}, snapshot_doc(qdoc, visits, datetime.now()), upsert=True)
+    return True
+
+
+def take_snapshots():
+    """Snapshot every queue that has moved SNAPSHOT_EVERY_EVENTS versions since its last snapshot."""
+    taken = {s["_id"]: s["version"] for s in (yield Op("queue_snapshots", "find", {}, {"version": 1}))}
+    for head in (yield Op("queue", "find", {}, {"queue_id": 1, "version": 1})):
+        if snapshot_due(head.get("version", 0), taken.get(head["queue_id"])):
+            yield from take_snapshot(head["queue_id"])
+
+
+def restore_snapshots(cache_for):
+    """Warm cache_for(queue_id) of every snapshotted queue from its latest
+    snapshot plus the events logged since."""
+    for snapshot in (yield Op("queue_snapshots", "find")):
+        queue_id = snapshot["queue_id"]
+        events = yield Op(
+            "queue_log", "find",
+            {"queue_id": queue_id, "version": {"$gt": snapshot["version"]}},
+            sort=[("version", ASCENDING)]
+        )
+        restore_cache(cache_for(queue_id), snapshot, events)
@@ -0,0 +1,53 @@
+"""
+Filename: gunicorn.conf.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: gunicorn settings for the UrgentCareQ backend (see wsgi.py).
+"""
+
+import multiprocessing
+import os
+import signal
+from pathlib import Path
+
+wsgi_app = "wsgi:app"
+chdir = str(Path(__file__).resolve().parent)
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:5001")
+
+# Threaded workers: Mongo calls release the GIL, so threads overlap I/O inside
+# a worker. Each open /api/staff/queue/stream holds one thread for its lifetime,
+# and a worker takes at most SSE_MAX_STREAMS (server.py, default 16) of them, so
+# the default 32 threads leave at least 16 for the API. Keep GUNICORN_THREADS
+# above SSE_MAX_STREAMS, or serve the streams from async_server.py (see wsgi.py).
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+
+timeout = 30
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "20"))
+keepalive = 5
+
+# Load the app in each worker after fork: the Mongo client and background
+# threads must not be created in the master
+preload_app = False
+
+
+def post_worker_init(worker):
+    # End streams and hand over maintenance as soon as the worker is told to
+    # stop, instead of after the graceful timeout
+    import server
+
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        server.begin_shutdown()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    import server as app_server
+
+    app_server.shutdown()
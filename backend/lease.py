@@ -0,0 +1,185 @@
+"""
+Filename: lease.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Mongo-backed leases, so background maintenance runs in exactly one
+backend replica however many hosts and workers are started.
+
+A lease is one document in the leases collection:
+
+    {_id: name, holder: "<host>:<pid>:<nonce>", expires_at: <server time + ttl>}
+
+The holder renews it every ttl / 3 seconds (heartbeat). Anyone may take it
+over once expires_at has passed, so a crashed or partitioned holder is
+replaced within ttl seconds, and immediately when it shuts down cleanly and
+deletes the lease. All times come from the server's clock ($$NOW), so clock
+skew between replicas does not matter. A TTL index on expires_at removes
+leases nobody renews any more.
+"""
+
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+
+def lease_holder_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_filter(name, holder):
+    """Matches the lease if it is ours or has expired."""
+    return {"_id": name, "$or": [
+        {"holder": holder},
+        {"$expr": {"$lte": ["$expires_at", "$$NOW"]}}
+    ]}
+
+
+def acquire_update(holder, ttl):
+    return [{"$set": {
+        "holder": holder,
+        "expires_at": {"$add": ["$$NOW", int(ttl * 1000)]}
+    }}]
+
+
+class MongoLease:
+    """Lease held by this process, renewed on a heartbeat thread.
+
+    Has the same try_acquire() / release() / held interface as FileLock, so
+    MaintenanceRunner can use either. held turns False on its own once a
+    renewal has not succeeded within ttl, even if Mongo is unreachable.
+    """
+
+    def __init__(self, collection, name, ttl, holder=None):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or lease_holder_id()
+        self._valid_until = 0.0  # monotonic time the lease is known good until
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    @property
+    def held(self):
+        return time.monotonic() < self._valid_until
+
+    def _renew(self):
+        """Take or extend the lease in one round trip. Returns True if we hold it."""
+        started = time.monotonic()
+        try:
+            doc = self.collection.find_one_and_update(
+                acquire_filter(self.name, self.holder),
+                acquire_update(self.holder, self.ttl),
+                projection={"holder": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            doc = None  # someone else holds an unexpired lease
+        except PyMongoError:
+            return self.held  # keep what we had until it runs out locally
+        with self._lock:
+            if doc is not None and doc.get("holder") == self.holder:
+                self._valid_until = started + self.ttl
+            else:
+                self._valid_until = 0.0
+        return self.held
+
+    def try_acquire(self):
+        if not self._renew():
+            return False
+        if self._heartbeat is None or not self._heartbeat.is_alive():
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._beat, name=f"lease-{self.name}", daemon=True)
+            self._heartbeat.start()
+        return True
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl / 3):
+            if not self._renew() and self._valid_until == 0.0:
+                return  # lost to another holder
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None and self._heartbeat is not threading.current_thread():
+            self._heartbeat.join(self.ttl)
+        self._heartbeat = None
+        was_held = self.held
+        self._valid_until = 0.0
+        if was_held:
+            try:
+                # hand over right away instead of after the ttl
+                self.collection.delete_one({"_id": self.name, "holder": self.holder})
+            except PyMongoError:
+                pass
+
+
+class AsyncMongoLease:
+    """MongoLease for an async collection (async_server.py), renewed on an asyncio task."""
+
+    def __init__(self, collection, name, ttl, holder=None):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or lease_holder_id()
+        self._valid_until = 0.0
+        self._heartbeat = None
+
+    @property
+    def held(self):
+        return time.monotonic() < self._valid_until
+
+    async def _renew(self):
+        started = time.monotonic()
+        try:
+            doc = await self.collection.find_one_and_update(
+                acquire_filter(self.name, self.holder),
+                acquire_update(self.holder, self.ttl),
+                projection={"holder": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            doc = None
+        except PyMongoError:
+            return self.held
+        if doc is not None and doc.get("holder") == self.holder:
+            self._valid_until = started + self.ttl
+        else:
+            self._valid_until = 0.0
+        return self.held
+
+    async def try_acquire(self):
+        if not await self._renew():
+            return False
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._beat())
+        return True
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            if not await self._renew() and self._valid_until == 0.0:
+                return
+
+    async def release(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        was_held = self.held
+        self._valid_until = 0.0
+        if was_held:
+            try:
+                await self.collection.delete_one({"_id": self.name, "holder": self.holder})
+            except PyMongoError:
+                pass
@@ -0,0 +1,111 @@
+"""
+Filename: maintenance.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Background maintenance (no-show pruning, ...) that runs in exactly
+one process, however many server workers are started. The leader is picked
+with a Mongo lease across replicas (lease.py), or with a file lock on one host.
+"""
+
+import fcntl
+import os
+import threading
+
+
+class FileLock:
+    """Non-blocking exclusive flock on a file.
+
+    The kernel drops the lock when the holding process exits, so a crashed
+    worker never leaves a stale lock behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class MaintenanceRunner:
+    """Runs tasks every interval seconds on a daemon thread, but only while
+    this process holds the maintenance lock.
+
+    lock is a FileLock, a MongoLease or a file path (for a FileLock). Every
+    worker starts a runner; the one that gets the lock does the work and the
+    others retry every retry_interval seconds (default interval), so another
+    worker takes over within that long of the holder losing the lock.
+
+    waiter, if given, lets the leader run early: an object with wait(timeout),
+    returning once work is due or timeout seconds pass, and wake(), which
+    releases a pending wait (see DeadlineIndex).
+    """
+
+    def __init__(self, tasks, interval, lock, waiter=None, retry_interval=None):
+        self.tasks = list(tasks)
+        self.interval = interval
+        self.retry_interval = interval if retry_interval is None else retry_interval
+        self.lock = FileLock(lock) if isinstance(lock, str) else lock
+        self.waiter = waiter
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self):
+        return self.lock.held
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.lock.try_acquire():
+                for task in self.tasks:
+                    if self._stop.is_set():
+                        break
+                    try:
+                        task()
+                    except Exception:
+                        pass
+            if self._stop.is_set():
+                break
+            if not self.lock.held:
+                self._stop.wait(self.retry_interval)
+            elif self.waiter is not None:
+                self.waiter.wait(self.interval)
+            else:
+                self._stop.wait(self.interval)
+
+    def stop(self, timeout=None):
+        """Stop after the current task and release the lock so another process can take over."""
+        self._stop.set()
+        if self.waiter is not None:
+            self.waiter.wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self.lock.release()
@@ -0,0 +1,324 @@
+"""
+Filename: metrics.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Request latency and Mongo command metrics for /metrics, in the
+Prometheus text format. Shared by server.py and async_server.py.
+
+Every request is timed from the moment it reaches the app until its response
+starts (for a stream, until the stream opens) and labelled with its route
+template, so /api/clinics/<queue_id>/... traffic of all clinics shares one
+series per route. The driver reports every Mongo command to CommandMetrics
+(registered on the client in database.py). Commands run while a request is
+being handled are also counted against that request, through a context
+variable that follows the request's thread or task, so each route gets the
+number of commands it sends, their total time and a breakdown per command.
+
+    urgentcareq_http_request_duration_seconds{route,method}         histogram
+    urgentcareq_http_requests_total{route,method,status}             counter
+    urgentcareq_mongo_commands_per_request{route}                    histogram
+    urgentcareq_mongo_request_seconds{route}                         histogram
+    urgentcareq_mongo_route_commands_total{route,command}            counter
+    urgentcareq_mongo_route_command_seconds_total{route,command}     counter
+    urgentcareq_mongo_command_duration_seconds{command}              histogram
+    urgentcareq_mongo_command_failures_total{command}                counter
+
+The servers add gauges at scrape time (queue sizes, document bytes, the
+connection pool, the event log writer and the learned visit durations).
+"""
+
+from bisect import bisect_left
+import contextvars
+import threading
+import time
+
+import bson
+from pymongo import monitoring
+
+PREFIX = "urgentcareq_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21, 34)
+
+# Routes of requests that matched none
+UNMATCHED_ROUTE = "unmatched"
+
+# Mongo commands of the request being handled
+_request_commands = contextvars.ContextVar("request_commands", default=None)
+
+
+class Histogram:
+    """Counts per bucket plus sum and count, rendered cumulatively as Prometheus expects."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestCommands:
+    """Mongo commands sent while handling one request."""
+
+    __slots__ = ("count", "seconds", "by_command")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.by_command = {}  # command -> [count, seconds]
+
+    def add(self, command, seconds):
+        self.count += 1
+        self.seconds += seconds
+        entry = self.by_command.get(command)
+        if entry is None:
+            self.by_command[command] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """In-process registry of the request and command metrics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_seconds = {}  # (route, method) -> Histogram
+        self.requests = {}  # (route, method, status) -> count
+        self.commands_per_request = {}  # route -> Histogram
+        self.mongo_request_seconds = {}  # route -> Histogram
+        self.route_commands = {}  # (route, command) -> [count, seconds]
+        self.command_seconds = {}  # command -> Histogram
+        self.command_failures = {}  # command -> count
+
+    def begin_request(self):
+        """Start counting the current request's commands. Pass the result to end_request()."""
+        commands = RequestCommands()
+        _request_commands.set(commands)
+        return commands
+
+    def end_request(self, commands, route, method, status, seconds):
+        # set rather than reset: a streamed response starts from a task
+        # running in a copy of the request's context
+        _request_commands.set(None)
+        route = route or UNMATCHED_ROUTE
+        with self.lock:
+            histogram = self.request_seconds.get((route, method))
+            if histogram is None:
+                histogram = self.request_seconds[(route, method)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.commands_per_request.get(route)
+            if histogram is None:
+                histogram = self.commands_per_request[route] = Histogram(COUNT_BUCKETS)
+                self.mongo_request_seconds[route] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(commands.count)
+            self.mongo_request_seconds[route].observe(commands.seconds)
+            for command, (count, command_seconds) in commands.by_command.items():
+                entry = self.route_commands.setdefault((route, command), [0, 0.0])
+                entry[0] += count
+                entry[1] += command_seconds
+
+    def observe_command(self, command, seconds, failed=False):
+        commands = _request_commands.get()
+        if commands is not None:
+            commands.add(command, seconds)
+        with self.lock:
+            histogram = self.command_seconds.get(command)
+            if histogram is None:
+                histogram = self.command_seconds[command] = Histogram(COMMAND_BUCKETS)
+            histogram.observe(seconds)
+            if failed:
+                self.command_failures[command] = self.command_failures.get(command, 0) + 1
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of everything recorded, plus gauges.
+
+        gauges are (name, help, type, label names, [(label values, value)])
+        families collected by the caller, type being "gauge" or "counter".
+        """
+        out = []
+        with self.lock:
+            _histograms(out, "http_request_duration_seconds", "Time from request to response start.",
+                        ("route", "method"), self.request_seconds)
+            _samples(out, "http_requests_total", "Requests handled.", "counter",
+                     ("route", "method", "status"), self.requests.items())
+            _histograms(out, "mongo_commands_per_request", "Mongo commands sent per request.",
+                        ("route",), {(k,): v for k, v in self.commands_per_request.items()})
+            _histograms(out, "mongo_request_seconds", "Time per request spent in Mongo commands.",
+                        ("route",), {(k,): v for k, v in self.mongo_request_seconds.items()})
+            _samples(out, "mongo_route_commands_total", "Mongo commands sent by each route, per command.",
+                     "counter", ("route", "command"), [(k, v[0]) for k, v in self.route_commands.items()])
+            _samples(out, "mongo_route_command_seconds_total", "Time in Mongo commands by route and command.",
+                     "counter", ("route", "command"), [(k, v[1]) for k, v in self.route_commands.items()])
+            _histograms(out, "mongo_command_duration_seconds", "Mongo command round trips.",
+                        ("command",), {(k,): v for k, v in self.command_seconds.items()})
+            _samples(out, "mongo_command_failures_total", "Mongo commands that failed.", "counter",
+                     ("command",), [((k,), v) for k, v in self.command_failures.items()])
+        for name, help_text, kind, label_names, samples in gauges:
+            _samples(out, name, help_text, kind, label_names, samples)
+        return "\n".join(out) + "\n"
+
+
+def _histograms(out, name, help_text, label_names, histograms):
+    if not histograms:
+        return
+    name = PREFIX + name
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} histogram")
+    for values, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = 'le="%s"' % _number(bound)
+            out.append(f"{name}_bucket{_labels(label_names, values, le)} {cumulative}")
+        out.append(f"{name}_sum{_labels(label_names, values)} {_number(histogram.sum)}")
+        out.append(f"{name}_count{_labels(label_names, values)} {histogram.count}")
+
+
+def _samples(out, name, help_text, kind, label_names, samples):
+    samples = sorted(samples)
+    if not samples:
+        return
+    name = PREFIX + name
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} {kind}")
+    for values, value in samples:
+        out.append(f"{name}{_labels(label_names, values)} {_number(value)}")
+
+
+def scrape_gauges(caches, estimators, pool, event_log):
+    """Gauge families for Metrics.render(), read at scrape time.
+
+    caches and estimators are the server's QueueCache and DurationEstimator
+    per queue_id, pool is PoolMetrics.snapshot() and event_log the event log
+    writer's stats() (None without a database). Queue sizes come from the
+    caches, so a scrape sends no Mongo commands.
+    """
+    visits, doc_bytes, visit_bytes = [], [], []
+    for queue_id, cache in sorted(caches.items()):
+        if not cache.is_loaded():
+            continue
+        qdoc, active = cache.snapshot()
+        visits.append(((queue_id,), len(active)))
+        doc_bytes.append(((queue_id,), len(bson.encode(qdoc))))
+        visit_bytes.append(((queue_id,), sum(len(bson.encode(v)) for v in active)))
+
+    estimates, samples = [], []
+    for queue_id, estimator in sorted(estimators.items()):
+        for reason, summary in estimator.summary().items():
+            samples.append(((queue_id, reason), summary.pop("count")))
+            estimates.extend(((queue_id, reason, stat), value)
+                             for stat, value in summary.items() if value is not None)
+
+    families = [
+        ("queue_active_visits", "Active visits per queue (cached).", "gauge", ("queue_id",), visits),
+        ("queue_document_bytes", "BSON size of the queue document.", "gauge", ("queue_id",), doc_bytes),
+        ("queue_visits_bytes", "BSON size of the active visit documents.", "gauge", ("queue_id",), visit_bytes),
+        ("visit_duration_samples", "Checkouts learned from per reason.", "gauge", ("queue_id", "reason"), samples),
+        ("visit_duration_estimate_minutes", "Learned visit duration per reason.", "gauge",
+         ("queue_id", "reason", "stat"), estimates),
+        ("mongo_pool_checked_out", "Pooled connections in use.", "gauge", (), [((), pool["checked_out"])]),
+        ("mongo_pool_open", "Pooled connections open.", "gauge", (), [((), pool["open"])]),
+        ("mongo_pool_checkouts_total", "Connection checkouts.", "counter", (), [((), pool["checkouts"])]),
+        ("mongo_pool_checkout_failures_total", "Failed connection checkouts.", "counter", (),
+         [((), pool["checkout_failures"])]),
+        ("mongo_pool_wait_seconds_max", "Longest wait for a pooled connection.", "gauge", (),
+         [((), pool["wait_seconds_max"])]),
+    ]
+    if event_log is not None:
+        families += [
+            ("event_log_pending", "Queue events buffered, not yet written.", "gauge", (),
+             [((), event_log["pending"])]),
+            ("event_log_written_total", "Queue events written.", "counter", (), [((), event_log["written"])]),
+            ("event_log_duplicates_total", "Queue events skipped because they were already written.", "counter", (),
+             [((), event_log["duplicates"])]),
+            ("event_log_dropped_total", "Queue events dropped from a full buffer.", "counter", (),
+             [((), event_log["dropped"])]),
+            ("event_log_failed_batches_total", "Queue event batches that failed.", "counter", (),
+             [((), event_log["failed_batches"])]),
+        ]
+    return families
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Feeds every Mongo command's round trip into a Metrics registry."""
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.registry.observe_command(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.registry.observe_command(event.command_name, event.duration_micros / 1e6, failed=True)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request into a Metrics registry (async_server.py).
+
+    The route is read from the scope once the router has matched it, and the
+    request is recorded when its response starts.
+    """
+
+    def __init__(self, app, registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        pending = [self.registry.begin_request()]
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start" and pending:
+                route = scope.get("route")
+                self.registry.end_request(
+                    pending.pop(), getattr(route, "path", None), scope["method"],
+                    message["status"], time.perf_counter() - started
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            if pending:
+                # no response was started (the app raised)
+                self.registry.end_request(pending.pop(), getattr(scope.get("route"), "path", None),
+                                          scope["method"], 500, time.perf_counter() - started)
+
+
+registry = Metrics()
+command_metrics = CommandMetrics(registry)
@@ -1,29 +1,16 @@
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-import os
 from pathlib import Path
-from dotenv import load_dotenv
 import sys
 sys.path.append(str(Path(__file__).parent.parent / "src"))
-from q_system import PatientQueue
 from datetime import datetime
+import database
+from event_log import log_event
+from queue_logic import reset_queue
 
-# Load env from backend/.env
-_env_dir = Path(__file__).resolve().parent
-_env_path = _env_dir / ".env"
-if _env_path.exists():
-    load_dotenv(dotenv_path=_env_path)
-else:
-    _envfile = _env_dir / "envfile.txt"
-    if _envfile.exists():
-        load_dotenv(dotenv_path=_envfile)
-
-uri = os.environ.get("MONGODB_URI")
-if not uri:
+# Load env from backend/.env and build the shared client
+client = database.get_client()
+if client is None:
     raise SystemExit("MONGODB_URI not set. Add it to backend/.env or backend/envfile.txt")
 
-
-client = MongoClient(uri, server_api=ServerApi('1'))
 # ping DB to confirm a successful connection
 try:
     client.admin.command('ping')
@@ -31,18 +18,15 @@ try:
 except Exception as e:
     print(e)
 
-# Initialize new queue
+# Initialize new queue for one clinic: python ping_db.py [queue_id]
+queue_id = sys.argv[1] if len(sys.argv) > 1 else "main"
 db = client.urgentcare
-queue_collection = db.queue
 
-# Clear existing queue and create new one
-queue_collection.delete_many({})
-pq = PatientQueue(slot_seconds=900, start_time=datetime.now())
-queue_collection.insert_one({
-    "queue_id": "main",
-    "start_time": pq.start_time,
-    "slot_seconds": pq.slot_seconds,
-    "patients": [],
-    "created_at": datetime.now()
-})
-print("Queue initialized")
\ No newline at end of file
+# Reset this clinic's queue the way /api/staff/reset does; other clinics are left alone.
+# The version keeps counting up so running workers reload their caches, completed
+# visits are archived first, and the reset is logged so replay starts from it.
+database.ensure_indexes(db)
+now = datetime.now()
+doc = database.run_steps(reset_queue(queue_id, now), db)
+db.queue_log.insert_one(log_event(queue_id, doc["version"], "reset", now, meta=doc))
+print(f"Queue '{queue_id}' initialized")
@@ -0,0 +1,229 @@
+"""
+Filename: projection.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: What-if wait projections for /api/staff/queue/projection
+(needs numpy).
+
+Projections run on a snapshot of the cached queue and never write. Every
+room serves its pending visits back to back in queue order from the time it
+frees up, so each room's start times are one cumulative sum over its
+duration array. The requested changes are applied to the arrays and the
+result is compared against the same projection without them.
+
+Changes (JSON objects with a "type"):
+
+    {"type": "admit", "patient_name": ..., "room"?: n}  serve next in its (or the given) room
+    {"type": "remove", "patient_name": ...}             leaves the queue (no-show, walk-out)
+    {"type": "duration", "patient_name": ..., "minutes": m}
+    {"type": "close_room", "room": n}                   its line is spread over the other rooms
+    {"type": "delay_room", "room": n, "minutes": m}     room frees up m minutes later
+"""
+
+from datetime import timedelta
+
+import numpy as np
+
+from queue_logic import PENDING_STATUSES, normalize_name, queue_rooms
+
+PROJECTION_CHANGES_MAX = 50
+CHANGE_TYPES = ("admit", "remove", "duration", "close_room", "delay_room")
+DEFAULT_DURATION_MINUTES = 15
+MINUTE_MS = 60000
+
+
+def parse_changes(body):
+    """Validated list of changes from a request body ({"changes": [...]} or a list).
+
+    Raises ValueError with a message for the client.
+    """
+    if body is None:
+        return []
+    changes = body.get("changes", []) if isinstance(body, dict) else body
+    if not isinstance(changes, list):
+        raise ValueError("changes must be a list")
+    if len(changes) > PROJECTION_CHANGES_MAX:
+        raise ValueError(f"At most {PROJECTION_CHANGES_MAX} changes per projection")
+    for i, change in enumerate(changes):
+        if not isinstance(change, dict) or change.get("type") not in CHANGE_TYPES:
+            raise ValueError(f"Change {i}: type must be one of {', '.join(CHANGE_TYPES)}")
+        kind = change["type"]
+        if kind in ("admit", "remove", "duration") and not str(change.get("patient_name") or "").strip():
+            raise ValueError(f"Change {i}: patient_name is required")
+        # bool is an int subclass: true would pass as room 1 or 1 minute
+        room = change.get("room")
+        if (kind in ("close_room", "delay_room") or "room" in change) and (
+                not isinstance(room, int) or isinstance(room, bool)):
+            raise ValueError(f"Change {i}: room must be a room number")
+        if kind in ("duration", "delay_room"):
+            minutes = change.get("minutes")
+            if not isinstance(minutes, (int, float)) or isinstance(minutes, bool) or minutes < 0:
+                raise ValueError(f"Change {i}: minutes must be a non-negative number")
+    return changes
+
+
+class _Plan:
+    """Arrays describing the pending visits and the rooms serving them."""
+
+    def __init__(self, qdoc, visits, now):
+        self.now = now
+        self.rooms = [r["room"] for r in queue_rooms(qdoc)]
+        self.visits = [v for v in visits if v.get("status") in PENDING_STATUSES]
+        default_room = self.rooms[0]
+        self.position = np.array([v.get("position", 0) for v in self.visits], dtype=np.float64)
+        self.duration = np.array([
+            (v.get("expected_duration_minutes") or DEFAULT_DURATION_MINUTES) * MINUTE_MS for v in self.visits
+        ], dtype=np.int64)
+        self.room = np.array([
+            v.get("room") if v.get("room") in self.rooms else default_room for v in self.visits
+        ], dtype=np.int64)
+        self.active = np.ones(len(self.visits), dtype=bool)
+        # ms from now until each room can take its next patient: after its
+        # current (admitted) patient's expected end
+        self.base = {room: 0 for room in self.rooms}
+        for visit in visits:
+            if visit.get("status") != "admitted" or visit.get("admitted_at") is None:
+                continue
+            room = visit.get("room") if visit.get("room") in self.base else default_room
+            minutes = visit.get("expected_duration_minutes") or DEFAULT_DURATION_MINUTES
+            end = (visit["admitted_at"] - now).total_seconds() * 1000 + minutes * MINUTE_MS
+            self.base[room] = max(self.base[room], int(end))
+        self.open = set(self.rooms)
+
+    def copy(self):
+        plan = object.__new__(_Plan)
+        plan.__dict__.update(self.__dict__)
+        for name in ("position", "duration", "room", "active"):
+            setattr(plan, name, getattr(self, name).copy())
+        plan.base = dict(self.base)
+        plan.open = set(self.open)
+        return plan
+
+    def find(self, name):
+        key = normalize_name(name)
+        for i, visit in enumerate(self.visits):
+            if self.active[i] and visit.get("name_normalized") == key:
+                return i
+        raise ValueError(f"Patient '{name}' is not waiting in the queue")
+
+    def check_room(self, room):
+        if room not in self.open:
+            raise ValueError(f"Room {room} is not open")
+
+    def apply(self, change):
+        kind = change["type"]
+        if kind == "admit":
+            i = self.find(change["patient_name"])
+            room = change.get("room", int(self.room[i]))
+            self.check_room(room)
+            self.room[i] = room
+            # ahead of everyone, after patients admitted by earlier changes
+            self.position[i] = self.position.min() - 1
+        elif kind == "remove":
+            self.active[self.find(change["patient_name"])] = False
+        elif kind == "duration":
+            self.duration[self.find(change["patient_name"])] = int(change["minutes"] * MINUTE_MS)
+        elif kind == "delay_room":
+            self.check_room(change["room"])
+            self.base[change["room"]] += int(change["minutes"] * MINUTE_MS)
+        elif kind == "close_room":
+            self.check_room(change["room"])
+            if len(self.open) == 1:
+                raise ValueError("Cannot close the last open room")
+            self.open.discard(change["room"])
+            self._reassign(change["room"])
+
+    def _reassign(self, closed):
+        """Give each visit of the closed room, in queue order, to the open room with the least work left."""
+        load = {room: self.base[room] + int(self.duration[self.active & (self.room == room)].sum())
+                for room in self.open}
+        moved = np.flatnonzero(self.active & (self.room == closed))
+        for i in moved[np.argsort(self.position[moved], kind="stable")]:
+            room = min(load, key=lambda r: (load[r], r))
+            self.room[i] = room
+            load[room] += int(self.duration[i])
+
+    def starts(self):
+        """ms from now until each visit starts (NaN for removed visits), one cumsum per room."""
+        start = np.full(len(self.visits), np.nan)
+        free = {}
+        for room in self.open:
+            idx = np.flatnonzero(self.active & (self.room == room))
+            idx = idx[np.argsort(self.position[idx], kind="stable")]
+            ends = self.base[room] + np.cumsum(self.duration[idx])
+            start[idx] = ends - self.duration[idx]
+            free[room] = int(ends[-1]) if len(idx) else self.base[room]
+        return start, free
+
+
+def _iso(now, ms):
+    return (now + timedelta(milliseconds=float(ms))).isoformat()
+
+
+def _iso_array(now, ms):
+    """ISO strings of now + ms for a whole array at once (None where ms is NaN)."""
+    missing = np.isnan(ms)
+    times = np.datetime64(now.replace(tzinfo=None), "ms") + np.where(missing, 0, ms).astype("timedelta64[ms]")
+    strings = np.datetime_as_string(times, unit="ms")
+    return [None if m else s for s, m in zip(strings.tolist(), missing.tolist())]
+
+
+def _wait_stats(start):
+    waits = start[~np.isnan(start)] / MINUTE_MS
+    if not len(waits):
+        return {"mean_wait_minutes": 0.0, "p95_wait_minutes": 0.0, "max_wait_minutes": 0.0}
+    return {
+        "mean_wait_minutes": round(float(waits.mean()), 1),
+        "p95_wait_minutes": round(float(np.percentile(waits, 95)), 1),
+        "max_wait_minutes": round(float(waits.max()), 1),
+    }
+
+
+def project_queue(qdoc, visits, changes, now):
+    """Projected start of every pending visit with and without changes.
+
+    Raises ValueError if a change does not apply to this queue.
+    """
+    baseline_plan = _Plan(qdoc, visits, now)
+    plan = baseline_plan.copy()
+    for change in changes:
+        plan.apply(change)
+    baseline, _ = baseline_plan.starts()
+    projected, free = plan.starts()
+
+    # format whole columns at once; per-row datetime arithmetic dominates otherwise
+    order = np.argsort(baseline_plan.position, kind="stable")
+    visits = [plan.visits[i] for i in order.tolist()]
+    projected = projected[order]
+    baseline = baseline[order]
+    change = np.round((projected - baseline) / MINUTE_MS, 1)
+    patients = [{
+        "name": visit.get("name"),
+        "status": visit.get("status"),
+        "room": visit.get("room"),
+        "expected_start_time": visit["expected_start_time"].isoformat() if visit.get("expected_start_time") else None,
+        "baseline_start_time": baseline_time,
+        "projected_room": room if start is not None else None,
+        "projected_start_time": start,
+        "change_minutes": None if start is None else minutes,
+    } for visit, baseline_time, start, room, minutes in zip(
+        visits,
+        _iso_array(now, baseline),
+        _iso_array(now, projected),
+        plan.room[order].tolist(),
+        change.tolist(),
+    )]
+
+    return {
+        "queue_id": qdoc.get("queue_id"),
+        "projected_at": now.isoformat(),
+        "changes": changes,
+        "rooms": [{
+            "room": room,
+            "open": room in plan.open,
+            "projected_free_at": _iso(now, free[room]) if room in plan.open else None
+        } for room in plan.rooms],
+        "baseline": _wait_stats(baseline),
+        "projected": _wait_stats(projected),
+        "patients": patients,
+    }
@@ -0,0 +1,1060 @@
+"""
+Filename: queue_logic.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Scheduling rules, Mongo update pipelines, response formatting
+and the sequences of Mongo calls behind each request, shared by the sync
+(server.py) and async (async_server.py) backends. Nothing in here does I/O:
+a sequence is a step function that yields the calls it needs (see Op) and
+database.py runs it with blocking or awaited calls.
+"""
+
+from datetime import datetime, timedelta
+import json
+import math
+import os
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReplaceOne, ReturnDocument, UpdateOne
+
+# Queue used by the routes without a clinic in the path
+QUEUE_ID = "main"
+
+# Clinic (queue) ids allowed in /api/clinics/<queue_id>/... routes
+QUEUE_ID_PATTERN = r"[A-Za-z0-9_-]{1,64}"
+
+# Visit lifecycle, in order: waiting -> checked_in -> admitted -> completed
+VISIT_STATUSES = ["waiting", "checked_in", "admitted", "completed"]
+
+# Visit statuses that are still part of the live queue
+ACTIVE_STATUSES = ["waiting", "checked_in", "admitted"]
+
+# Visits still waiting for the room; their times move when the room runs late
+PENDING_STATUSES = ["waiting", "checked_in"]
+SHIFTED_FIELDS = ["scheduled_time", "expected_start_time", "expected_end_time", "checkin_deadline"]
+
+# Number of exam rooms patients are spread across. Read when the queue is reset;
+# the queue document keeps its own per-room free times from then on.
+ROOM_COUNT = max(1, int(os.environ.get("ROOM_COUNT", "1")))
+
+# A join's visit _ids stay listed on the queue document for this many seconds
+# after the reservation, so readers can wait for an insert still on its way.
+# Also the longest a late checkout waits for one that never lands.
+JOIN_SETTLE_SECONDS = float(os.environ.get("JOIN_SETTLE_SECONDS", "5"))
+# How often a late checkout looks again for visits still being inserted
+JOIN_POLL_SECONDS = 0.05
+
+# Least time a joining patient gets to check in, for rooms free sooner than
+# the 5 minutes before the start that check-in is otherwise due
+CHECKIN_GRACE_MINUTES = int(os.environ.get("CHECKIN_GRACE_MINUTES", "5"))
+
+# Largest number of patients accepted by one /api/patient/joinqueue/batch request
+JOIN_BATCH_MAX = int(os.environ.get("JOIN_BATCH_MAX", "500"))
+
+# Buffer time to prep room, can be adjusted by staff. Turnover happens after
+# checkout, so it is booked on top of the time the patient is in the room and
+# is not slack: a visit that runs over its estimate, however briefly, delays
+# the room by the whole overrun.
+PREP_MINUTES = 10
+
+# These are arbitrary estimates based on typical urgent care guidance.
+# They are used until a clinic has checked out DURATION_MIN_SAMPLES visits
+# for a reason; from then on the durations measured at checkout are used.
+REASON_ESTIMATE_MINUTES = {
+    "Flu-like symptoms": 20,
+    "Minor laceration": 25,
+    "COVID-19 test": 10,
+    "Common infections (ear, pink eye)": 15,
+    "Sore throat / strep check": 15,
+    "Sprain/strain": 30,
+    "Rash or allergic reaction (mild)": 15,
+    "Urinary symptoms (possible UTI)": 20,
+    "Medication refill/quick consult": 10,
+}
+
+
+# When a visit finishes early, move the room's pending visits earlier too
+# (off by default: patients are then asked to arrive sooner than first told).
+# No waiting patient's check-in deadline is moved closer than
+# PULL_IN_LEAD_MINUTES from now, so there is time to notify them.
+EARLY_FINISH_PULL_IN = os.environ.get("EARLY_FINISH_PULL_IN", "").lower() in ("1", "true", "yes")
+PULL_IN_LEAD_MINUTES = int(os.environ.get("PULL_IN_LEAD_MINUTES", "15"))
+
+# Learned durations (see src/estimator.py): smoothing of the running average,
+# or a quantile to book instead of it (e.g. 0.9 books for the slow end)
+DURATION_EWMA_ALPHA = float(os.environ.get("DURATION_EWMA_ALPHA", "0.2"))
+DURATION_QUANTILE = float(os.environ["DURATION_QUANTILE"]) if os.environ.get("DURATION_QUANTILE") else None
+DURATION_MIN_SAMPLES = int(os.environ.get("DURATION_MIN_SAMPLES", "5"))
+# Seconds between saves of the learned durations
+DURATION_STATS_SAVE_SECONDS = float(os.environ.get("DURATION_STATS_SAVE_SECONDS", "60"))
+
+# Completed visits moved to visit_history per round trip
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+
+
+def normalize_name(name):
+    return (name or "").strip().lower()
+
+
+def queue_rooms(qdoc):
+    """Per-room free times stored on the queue document.
+
+    Queue documents created before rooms were tracked describe a single room
+    through room_free_at.
+    """
+    rooms = qdoc.get("rooms")
+    if rooms:
+        return rooms
+    return [{"room": 1, "free_at": qdoc.get("room_free_at")}]
+
+
+def new_queue_doc(queue_id, now, version):
+    return {
+        "queue_id": queue_id,
+        "start_time": now,
+        "room_free_at": None,  # None means free now
+        # a past free_at also means free now
+        "rooms": [{"room": r, "free_at": now} for r in range(1, ROOM_COUNT + 1)],
+        "global_delay_minutes": 0,
+        "next_position": 0,
+        "active_count": 0,  # waiting + checked_in + admitted, gives a joining patient's position
+        "version": version,
+        "created_at": now
+    }
+
+
+def active_visits_query(queue_id, name=None):
+    query = {"queue_id": queue_id, "status": {"$in": ACTIVE_STATUSES}}
+    if name is not None:
+        query["name_normalized"] = normalize_name(name)
+    return query
+
+
+def expired_visits_query(now, queue_id=None):
+    """Waiting visits that never checked in before their deadline, in every queue unless queue_id is given."""
+    query = {
+        "status": "waiting",
+        "checked_in": False,
+        "checkin_deadline": {"$ne": None, "$lte": now}
+    }
+    if queue_id is not None:
+        query["queue_id"] = queue_id
+    return query
+
+
+def upcoming_deadline_query(now):
+    """Waiting visits in any queue whose check-in deadline is still ahead; sort by checkin_deadline for the next one."""
+    return {
+        "status": "waiting",
+        "checked_in": False,
+        "checkin_deadline": {"$gt": now}
+    }
+
+
+def shift_query(queue_id, room=None):
+    query = {"queue_id": queue_id, "status": {"$in": PENDING_STATUSES}}
+    if room is not None:
+        query["room"] = room
+    return query
+
+
+def shift_update(delta, statuses=None):
+    """Pipeline update moving every shifted time field by delta (only on a
+    visit in one of statuses, if given)."""
+    shift_ms = int(delta.total_seconds() * 1000)
+    moved = {field: {"$add": ["$" + field, shift_ms]} for field in SHIFTED_FIELDS}
+    if statuses is not None:
+        moved = {field: {"$cond": [{"$in": ["$status", statuses]}, value, "$" + field]} for field, value in moved.items()}
+    return [{"$set": moved}]
+
+
+def reason_key(reason):
+    return (reason or "").strip()
+
+
+def expected_duration_minutes_for(reason, estimator=None):
+    # Estimate expected duration: learned from the clinic's checkouts when
+    # there are enough of them, the static table otherwise. A measured
+    # duration runs from admit to checkout and does not cover the room's
+    # turnover after it, so both get the prep time added.
+    key = reason_key(reason)
+    learned = estimator.estimate(key) if estimator is not None else None
+    if learned is not None:
+        return PREP_MINUTES + int(round(learned))
+    estimated_reason_minutes = REASON_ESTIMATE_MINUTES.get(key, 15)
+    return PREP_MINUTES + estimated_reason_minutes
+
+
+def reserve_pipeline(durations, now, ids):
+    """Pipeline update on the queue document that books rooms for joining patients.
+
+    durations are the patients' expected minutes and ids their visits' _ids,
+    in join order. Each patient takes the earliest-free room (a free_at before
+    now means free now, ties go to the lowest room number) and that room's
+    free time moves to the end of their visit. Everything is computed
+    server-side in one update, so concurrent joins serialize on the queue
+    document and can never be handed the same slot.
+
+    The updated document's last_join field holds the reservation time, the
+    first booked seq, the queue position of the first patient and one
+    {id, room, start, end} slot per patient. Its inserting field lists
+    {id, room, at} for every visit reserved in the last JOIN_SETTLE_SECONDS,
+    including these: their inserts may not have landed yet.
+    """
+    # queue documents created before rooms were tracked describe one room
+    rooms = {"$ifNull": ["$rooms", [{"room": 1, "free_at": {"$ifNull": ["$room_free_at", now]}}]]}
+    earliest = {"$reduce": {
+        "input": "$$acc.rooms",
+        "initialValue": {"$arrayElemAt": ["$$acc.rooms", 0]},
+        "in": {"$cond": [
+            {"$lt": [{"$max": ["$$this.free_at", now]}, {"$max": ["$$value.free_at", now]}]},
+            "$$this",
+            "$$value"
+        ]}
+    }}
+    book = {"$let": {
+        "vars": {"acc": "$$value", "duration": "$$this.ms", "id": "$$this.id"},
+        "in": {"$let": {
+            "vars": {"best": earliest},
+            "in": {"$let": {
+                "vars": {"start": {"$max": ["$$best.free_at", now]}},
+                "in": {"$let": {
+                    "vars": {"end": {"$add": ["$$start", "$$duration"]}},
+                    "in": {
+                        "rooms": {"$map": {"input": "$$acc.rooms", "as": "r", "in": {"$cond": [
+                            {"$eq": ["$$r.room", "$$best.room"]},
+                            {"room": "$$r.room", "free_at": "$$end"},
+                            "$$r"
+                        ]}}},
+                        "slots": {"$concatArrays": ["$$acc.slots", [
+                            {"id": "$$id", "room": "$$best.room", "start": "$$start", "end": "$$end"}
+                        ]]}
+                    }
+                }}
+            }}
+        }}
+    }}
+    return [
+        {"$set": {"last_join": {"$reduce": {
+            "input": [{"ms": minutes * 60000, "id": visit_id} for minutes, visit_id in zip(durations, ids)],
+            "initialValue": {"rooms": rooms, "slots": []},
+            "in": book
+        }}}},
+        {"$set": {
+            "rooms": "$last_join.rooms",
+            "last_join": {
+                "at": now,
+                "seq": {"$ifNull": ["$next_position", 0]},
+                "position": {"$ifNull": ["$active_count", 0]},
+                "slots": "$last_join.slots"
+            },
+            "inserting": {"$concatArrays": [
+                {"$filter": {
+                    "input": {"$ifNull": ["$inserting", []]},
+                    "as": "j",
+                    "cond": {"$gt": ["$$j.at", now - timedelta(seconds=JOIN_SETTLE_SECONDS)]}
+                }},
+                {"$map": {
+                    "input": "$last_join.slots",
+                    "as": "s",
+                    "in": {"id": "$$s.id", "room": "$$s.room", "at": now}
+                }}
+            ]}
+        }},
+        {"$set": {
+            "room_free_at": {"$min": "$rooms.free_at"},
+            "next_position": {"$add": ["$last_join.seq", len(durations)]},
+            "active_count": {"$add": ["$last_join.position", len(durations)]},
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+        }}
+    ]
+
+
+def reserved_in_flight(qdoc, now, room=None):
+    """The {id, room, at} reservations on qdoc whose visit insert may not have landed yet.
+
+    Joins bump the queue version before the visit insert lands, so a reader in
+    between sees the reservation without the visit. A reserved visit cannot be
+    pruned, checked out or archived before it is inserted, or within
+    JOIN_SETTLE_SECONDS after it (its check-in deadline is at least
+    CHECKIN_GRACE_MINUTES away), so one of these _ids missing from Mongo is an
+    insert still on its way. Past JOIN_SETTLE_SECONDS it is given up on.
+    """
+    since = now - timedelta(seconds=JOIN_SETTLE_SECONDS)
+    return [j for j in qdoc.get("inserting") or []
+            if j["at"] > since and (room is None or j.get("room") == room)]
+
+
+def new_visit(queue_id, seq, position, fields, slot, now):
+    """Build the visit document for one joining patient.
+
+    fields holds the join form values, position is the patient's place among
+    active visits, seq the queue's next_position and slot the room booking
+    from reserve_pipeline(). Returns (visit, response row).
+    """
+    name = (fields.get("patient_name") or "").strip()
+    phone = fields.get("phone") or ""
+    dob = fields.get("dob") or ""
+    insurance = fields.get("insurance") or ""
+    reason = reason_key(fields.get("reason"))
+
+    room = slot["room"]
+    expected_start_time = slot["start"]
+    expected_end_time = slot["end"]
+    # the duration the slot was booked with (see expected_duration_minutes_for)
+    expected_duration_minutes = int(round((expected_end_time - expected_start_time).total_seconds() / 60))
+
+    # Initial wait minutes for this patient
+    wait_seconds = max(0, (expected_start_time - now).total_seconds())
+    initial_wait_minutes = int(math.ceil(wait_seconds / 60.0)) if wait_seconds > 0 else 0
+
+    # Set deadline 5 minutes prior to expected start, but no sooner than
+    # CHECKIN_GRACE_MINUTES after 'now': with a free room the start is already
+    # that close, and a deadline at 'now' would prune the patient as they join
+    checkin_deadline = None
+    # avoid conlicts with first patient check-in time requirements
+    check_in_by_str = "ASAP" if position == 0 else None
+    if position != 0:
+        deadline = max(expected_start_time - timedelta(minutes=5), now + timedelta(minutes=CHECKIN_GRACE_MINUTES))
+        checkin_deadline = deadline
+        check_in_by_str = deadline.isoformat()
+
+    patient = {
+        "_id": slot["id"],
+        "queue_id": queue_id,
+        "position": seq,
+        "name": name,
+        "name_normalized": normalize_name(name),
+        "phone": phone,
+        "dob": dob,
+        "insurance": insurance,
+        "reason": reason,
+        "room": room,
+        "scheduled_time": expected_start_time,
+        "expected_start_time": expected_start_time,
+        "expected_end_time": expected_end_time,
+        "expected_duration_minutes": expected_duration_minutes,
+        "initial_wait_minutes": initial_wait_minutes,
+        "checkin_deadline": checkin_deadline,
+        "status": "waiting",
+        "checked_in": False,
+        "checked_in_at": None,
+        "admitted_at": None,
+        "completed_at": None,
+        "actual_duration_minutes": None
+    }
+    row = {
+        "position": position,
+        "scheduled_time": expected_start_time.isoformat(),
+        "expected_start_time": expected_start_time.isoformat(),
+        "expected_end_time": expected_end_time.isoformat(),
+        "expected_duration_minutes": expected_duration_minutes,
+        "initial_wait_minutes": initial_wait_minutes,
+        "check_in_by": check_in_by_str,
+        "room": room
+    }
+    return patient, row
+
+
+def reserved_visits(queue_id, qdoc, rows, now):
+    """Visit documents and response rows for rows, from the reservation on qdoc."""
+    last_join = qdoc["last_join"]
+    patients = []
+    results = []
+    for i, (fields, slot) in enumerate(zip(rows, last_join["slots"])):
+        patient, row = new_visit(queue_id, last_join["seq"] + i, last_join["position"] + i, fields, slot, now)
+        patients.append(patient)
+        results.append(row)
+    return patients, results
+
+
+def parse_join_batch(text, mimetype):
+    """Rows of a batch join body: a JSON array of patients, or one JSON object
+    per line (NDJSON), using the same field names as the join form.
+
+    Raises ValueError with a message for the client.
+    """
+    try:
+        if mimetype in ("application/x-ndjson", "application/ndjson"):
+            rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            rows = json.loads(text or "null")
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON: {e}")
+
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        raise ValueError("Expected a JSON array of patient objects or NDJSON")
+    if not rows:
+        raise ValueError("No patients given")
+    return rows
+
+
+def choose_checkin_visit(name, dob, matching, narrow):
+    """Pick the visit a check-in refers to.
+
+    matching are the active visits with this name in position order and
+    narrow(dob) returns those with the given DOB. Returns (visit, None) or
+    (None, (error body, status)).
+    """
+    if not matching:
+        return None, ({"error": f"Patient '{name}' not found in queue"}, 404)
+
+    # If multiple patients with same name, use DOB to distinguish between them
+    if len(matching) > 1:
+        if not dob:
+            return None, ({
+                "error": f"Multiple patients named '{name}' found. Please provide date of birth.",
+                "requires_dob": True
+            }, 400)
+
+        # Filter by DOB
+        matching = narrow(dob)
+        if not matching:
+            return None, ({"error": f"No patient '{name}' with DOB {dob} found"}, 404)
+
+    return matching[0], None
+
+
+def transition_error_body(name, from_status, message, statuses):
+    """Error (body, status) for a transition that matched no visit, given the
+    statuses of every visit with that name."""
+    rank = VISIT_STATUSES.index(from_status)
+    ranks = [VISIT_STATUSES.index(status or "waiting") for status in statuses]
+
+    # patient exists but has not reached the required step yet
+    if any(r < rank for r in ranks):
+        return {"error": message}, 400
+
+    # patient already moved past this step, i.e. another terminal won the race
+    if ranks:
+        return {
+            "error": f"Patient '{name}' was already updated by another request",
+            "conflict": True
+        }, 409
+
+    return {"error": f"Patient '{name}' not found in queue"}, 404
+
+
+def checkout_update(completed_at):
+    # duration is computed server-side from admitted_at so the whole transition is one round trip
+    return [{"$set": {
+        "status": "completed",
+        "completed_at": completed_at,
+        "actual_duration_minutes": {"$ifNull": [
+            {"$round": [{"$divide": [{"$subtract": [completed_at, "$admitted_at"]}, 60000]}, 2]},
+            0
+        ]}
+    }}]
+
+
+def checkout_delta_minutes(visit):
+    """Minutes the visit ran over its estimate, negative if it finished early."""
+    # Determine expected vs actual to adjust scheduling. The actual duration
+    # is admit to checkout; the booked slot also holds the turnover after it.
+    actual_minutes = visit.get("actual_duration_minutes") or 0
+    expected_minutes = visit.get("expected_duration_minutes") - PREP_MINUTES
+    return int(round(actual_minutes - expected_minutes))
+
+
+def pull_in_shifts(visits, advance_minutes, now, lead_minutes):
+    """Whole minutes to move each of a room's pending visits earlier after
+    the room freed up advance_minutes early.
+
+    visits are the room's pending visits in queue order. No visit starts
+    before now, a waiting patient's check-in deadline stays at least
+    lead_minutes away, and no visit moves further than the one before it, so
+    the room's bookings cannot overlap. Returns [(visit, minutes)] for the
+    visits that move, a prefix of visits.
+    """
+    moves = []
+    limit = advance_minutes
+    for visit in visits:
+        bounds = [limit, (visit["expected_start_time"] - now).total_seconds() // 60]
+        deadline = visit.get("checkin_deadline")
+        if visit.get("status") == "waiting" and deadline is not None:
+            bounds.append((deadline - now).total_seconds() // 60 - lead_minutes)
+        limit = max(0, int(min(bounds)))
+        if limit == 0:
+            break
+        moves.append((visit, limit))
+    return moves
+
+
+def room_delay_pipeline(room, delta_minutes, now, pull_in=None):
+    """Queue document update after a checkout: move the room's free time by the
+    delay, drop the visit from active_count and bump the version.
+
+    Done relative to the stored values so a concurrent join is not
+    overwritten. Visits booked before rooms were tracked have no room and use
+    room_free_at.
+
+    pull_in=(free_at, minutes) moves the free time earlier by minutes instead
+    (not before now), but only if it is still free_at: a join booked since
+    holds a slot at the old free time that must not be overlapped. The
+    global delay only moves if the free time did.
+    """
+    delay_ms = delta_minutes * 60000
+
+    def moved(free_at):
+        if pull_in is None:
+            return {"$add": [{"$ifNull": [free_at, now]}, delay_ms]}
+        expected, minutes = pull_in
+        return {"$cond": [
+            {"$eq": [free_at, expected]},
+            {"$max": [{"$add": [free_at, -minutes * 60000]}, now]},
+            free_at
+        ]}
+
+    if pull_in is not None:
+        expected, minutes = pull_in
+        unchanged = {"$eq": ["$room_free_at", expected]} if room is None else {"$in": [True, {"$map": {
+            "input": "$rooms", "as": "r",
+            "in": {"$and": [{"$eq": ["$$r.room", room]}, {"$eq": ["$$r.free_at", expected]}]}
+        }}]}
+        delta_minutes = {"$cond": [unchanged, -minutes, 0]}
+    queue_update = {
+        "global_delay_minutes": {"$add": [{"$ifNull": ["$global_delay_minutes", 0]}, delta_minutes]},
+        "active_count": {"$max": [{"$add": [{"$ifNull": ["$active_count", 0]}, -1]}, 0]},
+        "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+    }
+    if room is None:
+        queue_update["room_free_at"] = moved("$room_free_at")
+        return [{"$set": queue_update}]
+    queue_update["rooms"] = {"$map": {"input": "$rooms", "as": "r", "in": {"$cond": [
+        {"$eq": ["$$r.room", room]},
+        {"room": "$$r.room", "free_at": moved("$$r.free_at")},
+        "$$r"
+    ]}}}
+    return [{"$set": queue_update}, {"$set": {"room_free_at": {"$min": "$rooms.free_at"}}}]
+
+
+def checkout_body(name, visit, delta_minutes, qdoc):
+    room_free_at = qdoc.get("room_free_at")
+    return {
+        "message": "Patient checked out successfully",
+        "patient_name": name,
+        "status": "completed",
+        "actual_duration_minutes": visit.get("actual_duration_minutes"),
+        "admitted_at": visit.get("admitted_at").isoformat() if visit.get("admitted_at") else None,
+        "completed_at": visit.get("completed_at").isoformat() if visit.get("completed_at") else None,
+        "expected_duration_minutes": visit.get("expected_duration_minutes"),
+        "delta_minutes": delta_minutes,
+        "room_free_at": room_free_at.isoformat() if room_free_at else None
+    }
+
+
+def render_queue(qdoc, patients):
+    """Serialize a queue snapshot for /api/staff/queue."""
+    # Format patient data for frontend
+    formatted_patients = []
+    for i, patient in enumerate(patients):
+        formatted_patients.append({"position": i, "id": str(patient["_id"]), **format_visit(patient)})
+
+    # Per-room state: when each room frees up, who is in it and how many are lined up for it
+    rooms = {}
+    for entry in queue_rooms(qdoc):
+        rooms[entry["room"]] = {
+            "room": entry["room"],
+            "free_at": entry.get("free_at").isoformat() if entry.get("free_at") else None,
+            "current_patient": None,
+            "waiting": 0
+        }
+    for patient in patients:
+        room = rooms.get(patient.get("room"))
+        if room is None:
+            continue
+        if patient.get("status") == "admitted":
+            room["current_patient"] = patient.get("name")
+        elif patient.get("status") in PENDING_STATUSES:
+            room["waiting"] += 1
+
+    return json.dumps({
+        "queue_id": qdoc.get("queue_id", "main"),
+        "start_time": qdoc.get("start_time").isoformat() if qdoc.get("start_time") else None,
+        "room_free_at": qdoc.get("room_free_at").isoformat() if qdoc.get("room_free_at") else None,
+        "global_delay_minutes": qdoc.get("global_delay_minutes", 0),
+        "rooms": list(rooms.values()),
+        "patients": formatted_patients,
+        "total_patients": len(formatted_patients)
+    }).encode("utf-8")
+
+
+def format_visit(patient):
+    return {
+        "name": patient.get("name", "Unknown"),
+        "phone": patient.get("phone", "N/A"),
+        "dob": patient.get("dob", "N/A"),
+        "reason": patient.get("reason", "N/A"),
+        "status": patient.get("status", "waiting"),
+        "room": patient.get("room"),
+        "checked_in": patient.get("checked_in", False),
+        "scheduled_time": patient.get("scheduled_time").isoformat() if patient.get("scheduled_time") else "N/A",
+        "expected_start_time": patient.get("expected_start_time").isoformat() if patient.get("expected_start_time") else None,
+        "expected_end_time": patient.get("expected_end_time").isoformat() if patient.get("expected_end_time") else None,
+        "expected_duration_minutes": patient.get("expected_duration_minutes"),
+        "initial_wait_minutes": patient.get("initial_wait_minutes"),
+        "checkin_deadline": patient.get("checkin_deadline").isoformat() if patient.get("checkin_deadline") else None,
+        "admitted_at": patient.get("admitted_at").isoformat() if patient.get("admitted_at") else None,
+        "completed_at": patient.get("completed_at").isoformat() if patient.get("completed_at") else None,
+        "actual_duration_minutes": patient.get("actual_duration_minutes"),
+    }
+
+
+def visit_delta(patient):
+    """Compact form of a visit for stream events: new visits carry the full row,
+    later transitions only what changed (and the start time, which a pull-in
+    moves)."""
+    if patient.get("status") == "waiting":
+        return dict(format_visit(patient), id=str(patient["_id"]), seq=patient.get("position"))
+    return {
+        "id": str(patient["_id"]),
+        "name": patient.get("name"),
+        "status": patient.get("status"),
+        "room": patient.get("room"),
+        "expected_start_time": patient.get("expected_start_time").isoformat() if patient.get("expected_start_time") else None,
+        "admitted_at": patient.get("admitted_at").isoformat() if patient.get("admitted_at") else None,
+        "completed_at": patient.get("completed_at").isoformat() if patient.get("completed_at") else None,
+    }
+
+
+def sse_message(event_type, data, event_id=None):
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {data}")
+    return "\n".join(lines) + "\n\n"
+
+
+def stream_step(event, version, snapshot_version):
+    """Decide what a queue stream does with one published event.
+
+    Returns "skip" (already in the snapshot), "resync" (reset or a missed
+    version) or "send".
+    """
+    if snapshot_version is not None and event["version"] <= snapshot_version:
+        return "skip"
+    if event["type"] == "reset" or (version is not None and event["version"] > version + 1):
+        return "resync"
+    return "send"
+
+
+# -----------------------------------------------------------
+# Mongo call sequences
+# -----------------------------------------------------------
+
+# A step function is a generator that yields one Op per Mongo call and is
+# sent back the call's result; its return value is the sequence's result.
+# database.run_steps() drives it with blocking calls (server.py, scripts),
+# database.run_steps_async() with awaited ones (async_server.py), so both
+# backends make the same calls in the same order. Effects inside the process
+# (caches, published events, tracked deadlines) are left to the caller.
+
+
+class Op:
+    """One Mongo call: db[collection].method(*args, **kwargs).
+
+    A find gives back its documents as a list. Op(None, "sleep", seconds)
+    waits instead of calling Mongo.
+    """
+
+    __slots__ = ("collection", "method", "args", "kwargs")
+
+    def __init__(self, collection, method, *args, **kwargs):
+        self.collection = collection
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f"Op({self.collection!r}, {self.method!r})"
+
+
+def find_active_visits(queue_id, name=None):
+    return (yield Op("visits", "find", active_visits_query(queue_id, name), sort=[("position", ASCENDING)]))
+
+
+def bump_version(queue_id):
+    """Increment the queue's version counter and return the new value."""
+    qdoc = yield Op(
+        "queue", "find_one_and_update",
+        {"queue_id": queue_id},
+        {"$inc": {"version": 1}},
+        projection={"version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return qdoc.get("version") if qdoc is not None else None
+
+
+def joins_settled(qdoc, visits):
+    """True unless a visit reserved on qdoc has not been inserted yet.
+
+    visits are the active visits, read after qdoc. Reserved visits that are
+    not among them are looked up by _id: they may have completed since.
+    """
+    seen = {v["_id"] for v in visits}
+    missing = [j["id"] for j in reserved_in_flight(qdoc, datetime.now()) if j["id"] not in seen]
+    if not missing:
+        return True
+    return (yield Op("visits", "count_documents", {"_id": {"$in": missing}})) == len(missing)
+
+
+def refresh_cache(cache, max_age):
+    """Return cache, reloaded from Mongo first if another worker changed the queue."""
+    if not cache.needs_check(max_age):
+        return cache
+
+    if cache.is_loaded():
+        head = yield Op("queue", "find_one", {"queue_id": cache.queue_id}, {"version": 1})
+        if head is not None and cache.confirm(head.get("version", 0)):
+            return cache
+
+    qdoc = yield Op("queue", "find_one", {"queue_id": cache.queue_id})
+    if qdoc is None:
+        cache.invalidate()
+    else:
+        visits = yield from find_active_visits(cache.queue_id)
+        cache.load(qdoc, visits, settled=(yield from joins_settled(qdoc, visits)))
+    return cache
+
+
+def transition_visit(query, from_status, update):
+    """Move the first visit matching query out of from_status in one round trip.
+
+    The expected prior status is part of the filter, so when two requests race
+    only one of them matches; the other gets None back instead of overwriting.
+    """
+    return (yield Op(
+        "visits", "find_one_and_update",
+        dict(query, status=from_status),
+        update,
+        sort=[("position", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    ))
+
+
+def transition_failure(queue_id, name, from_status, message):
+    """Error (body, status) for a transition that matched no visit."""
+    if (yield Op("queue", "find_one", {"queue_id": queue_id}, {"_id": 1})) is None:
+        return {"error": "queue not initialized"}, 400
+    visits = yield Op("visits", "find", {"queue_id": queue_id, "name_normalized": normalize_name(name)}, {"status": 1})
+    return transition_error_body(name, from_status, message, [v.get("status") for v in visits])
+
+
+def find_checkin_visit(cache, name, dob):
+    """The visit a check-in refers to, as (visit, None) or (None, (error body, status)).
+
+    Looks the name up in the cache's index first and in the (queue_id,
+    name_normalized, dob) Mongo index if this worker has not seen the join yet.
+    """
+    key = normalize_name(name)
+    matching = cache.find_by_name(key)
+    if matching:
+        def narrow(d):
+            return cache.find_by_name(key, d)
+    else:
+        matching = yield from find_active_visits(cache.queue_id, name)
+
+        def narrow(d):
+            return [p for p in matching if p.get("dob") == d]
+
+    return choose_checkin_visit(name, dob, matching, narrow)
+
+
+def reserve_and_insert(queue_id, rows, durations, now):
+    """Reserve slots for rows of join form values and insert their visits.
+
+    Two round trips: the atomic slot reservation on the queue document (see
+    reserve_pipeline), then the visit insert. The visits' _ids are made here
+    and reserved with their slots, so readers know exactly which inserts are
+    still on their way. Returns (queue document, visits, response rows), or
+    None if the queue does not exist.
+    """
+    ids = [ObjectId() for _ in rows]
+    qdoc = yield Op("queue", "find_one_and_update", {"queue_id": queue_id}, reserve_pipeline(durations, now, ids),
+                    return_document=ReturnDocument.AFTER)
+    if qdoc is None:
+        return None
+
+    patients, results = reserved_visits(queue_id, qdoc, rows, now)
+    if len(patients) == 1:
+        yield Op("visits", "insert_one", patients[0])
+    else:
+        yield Op("visits", "insert_many", patients)
+    return qdoc, patients, results
+
+
+def shift_booked_visits(queue_id, delta, room, qdoc, low=0, waited=None):
+    """Move the times of the room's pending visits booked between seq low and
+    qdoc's next_position by delta, each exactly once. Returns how many moved.
+
+    Everyone behind the room gets the same shift, so this is a single relative
+    update over the pending visits rather than a rewrite of the whole queue.
+
+    A join reserved before qdoc may still be inserting its visit (see
+    reserved_in_flight). Those of the room's reserved _ids not in Mongo yet are
+    left out of the update and shifted one by one as they land, each waited
+    for until JOIN_SETTLE_SECONDS after its reservation at most. That is
+    normally one insert round trip of a join that already holds its slot.
+    waited collects the _ids handled that way across calls.
+    """
+    waited = set() if waited is None else waited
+    reserved = [j for j in reserved_in_flight(qdoc, datetime.now(), room) if j["id"] not in waited]
+    pending = {}
+    if reserved:
+        landed = {v["_id"] for v in (yield Op("visits", "find", {"_id": {"$in": [j["id"] for j in reserved]}}, {"_id": 1}))}
+        pending = {j["id"]: j["at"] + timedelta(seconds=JOIN_SETTLE_SECONDS) for j in reserved if j["id"] not in landed}
+
+    query = dict(shift_query(queue_id, room), position={"$gte": low, "$lt": qdoc.get("next_position", 0)})
+    if pending:
+        query["_id"] = {"$nin": list(pending)}
+    shifted = (yield Op("visits", "update_many", query, shift_update(delta))).modified_count
+    while pending:
+        for visit_id, give_up in list(pending.items()):
+            result = yield Op("visits", "update_one", {"_id": visit_id}, shift_update(delta, PENDING_STATUSES))
+            if result.matched_count or datetime.now() >= give_up:
+                shifted += result.modified_count
+                waited.add(visit_id)
+                del pending[visit_id]
+        if pending:
+            yield Op(None, "sleep", JOIN_POLL_SECONDS)
+    return shifted
+
+
+def delay_room(queue_id, room, delta_minutes):
+    """Move the room's pending visits and then its free time later by delta_minutes.
+
+    The room update only applies while next_position is what it was when the
+    visits were shifted. A join that booked the room in between was booked
+    against the old free time, so its visits are shifted as well and the
+    update is tried again. Returns (queue document, number of visits moved).
+    """
+    delta = timedelta(minutes=delta_minutes)
+    qdoc = yield Op("queue", "find_one", {"queue_id": queue_id})
+    low, shifted, waited = 0, 0, set()
+    while qdoc is not None:
+        shifted += yield from shift_booked_visits(queue_id, delta, room, qdoc, low, waited)
+        moved = yield Op(
+            "queue", "find_one_and_update",
+            {"queue_id": queue_id, "next_position": qdoc.get("next_position")},
+            room_delay_pipeline(room, delta_minutes, datetime.now()),
+            return_document=ReturnDocument.AFTER
+        )
+        if moved is not None:
+            return moved, shifted
+        low = qdoc.get("next_position", 0)
+        qdoc = yield Op("queue", "find_one", {"queue_id": queue_id})
+        if qdoc is not None and qdoc.get("next_position", 0) < low:
+            low = 0  # the queue was reset in between
+    return None, shifted
+
+
+def pull_in_pending_visits(queue_id, room, advance_minutes, last_end, now):
+    """Move the room's pending visits earlier after a visit finished advance_minutes early.
+
+    Each visit moves by its own amount (see pull_in_shifts), in one unordered
+    bulk_write over just those visits. Returns (pull_in for
+    room_delay_pipeline, or None to leave the room's free time alone, the
+    updated visits). last_end is the end of the checked-out visit.
+
+    Nothing moves while one of the room's joins is still inserting its visit
+    (see reserved_in_flight): the visits behind it would be moved past it.
+    The queue document is read after the visits, so every join reserved
+    before them is listed; one reserved since is booked after all of them.
+    """
+    pending = yield Op("visits", "find", shift_query(queue_id, room), sort=[("position", ASCENDING)])
+    qdoc = yield Op("queue", "find_one", {"queue_id": queue_id}, {"inserting": 1})
+    listed = {v["_id"] for v in pending}
+    absent = [j["id"] for j in reserved_in_flight(qdoc or {}, now, room) if j["id"] not in listed]
+    if absent:
+        # reserved visits that already left the line (admitted, completed) are no obstacle
+        left = yield Op("visits", "find", {"_id": {"$in": absent}, "status": {"$nin": PENDING_STATUSES}}, {"_id": 1})
+        if len(left) < len(absent):
+            return None, []
+    moves = pull_in_shifts(pending, advance_minutes, now, PULL_IN_LEAD_MINUTES)
+    pulled = []
+    if moves:
+        yield Op("visits", "bulk_write", [UpdateOne(
+            {"_id": visit["_id"], "status": {"$in": PENDING_STATUSES}},
+            shift_update(timedelta(minutes=-minutes))
+        ) for visit, minutes in moves], ordered=False)
+        pulled = yield Op("visits", "find", {"_id": {"$in": [v["_id"] for v, _ in moves]}}, sort=[("position", ASCENDING)])
+    if len(moves) < len(pending):
+        return None, pulled  # the room stays booked until the visits that could not move
+    if pending:
+        # the room's free time is the end of its last booking, unless a join booked after it since
+        return (pending[-1]["expected_end_time"], moves[-1][1]), pulled
+    return (last_end, advance_minutes), pulled
+
+
+def pulled_in_minutes(qdoc, room, expected):
+    """Minutes a pull-in moved the room's free time from expected (negative), 0 if a join kept it there.
+
+    A pulled-in free time is never later than expected: the room was booked
+    past now, and a join booked since only moves it later.
+    """
+    if room is None:
+        free_at = qdoc.get("room_free_at")
+    else:
+        free_at = next((r["free_at"] for r in queue_rooms(qdoc) if r["room"] == room), None)
+    if free_at is None or free_at >= expected:
+        return 0
+    return -int(round((expected - free_at).total_seconds() / 60))
+
+
+def move_room(queue_id, room, delta_minutes, pull_in=None):
+    """Apply room_delay_pipeline to the queue document and return it."""
+    # Shift the room's free time by the delta so future estimated times account for the delay
+    return (yield Op(
+        "queue", "find_one_and_update",
+        {"queue_id": queue_id},
+        room_delay_pipeline(room, delta_minutes, datetime.now(), pull_in),
+        return_document=ReturnDocument.AFTER
+    ))
+
+
+def settle_checkout(queue_id, visit):
+    """Move the checked-out visit's room by how far it ran over its estimate.
+
+    Patients still waiting for the same room start later by the delay, and
+    so does the room's free time. Visits booked before rooms were tracked have
+    no room and share the one room. A visit that finished early moves them
+    earlier instead when EARLY_FINISH_PULL_IN is on.
+
+    Either way the visits move first and the room's free time after, in an
+    update that only applies if no join booked the room in between (see
+    delay_room and room_delay_pipeline's pull_in).
+
+    Returns (queue document, minutes the room's free time actually moved,
+    negative for a pull-in and 0 if it could not move, cache shift for
+    QueueCache.apply or None, visits pulled in, number of visits moved).
+    A delay moves every visit by the same amount and is cached as a shift; a
+    pull-in moves each visit by its own amount, so the cache takes the pulled
+    visits themselves instead.
+    """
+    delta = checkout_delta_minutes(visit)
+    # One-way delay to avoid future patients from being scheduled too early
+    delta_minutes = max(0, delta)
+
+    room = visit.get("room")
+    shifted = 0
+    pulled_in, pulled = None, []
+    if delta_minutes:
+        qdoc, shifted = yield from delay_room(queue_id, room, delta_minutes)
+    elif delta < 0 and EARLY_FINISH_PULL_IN:
+        # finished early: move them earlier, each only as far as its patient can still be told
+        pulled_in, pulled = yield from pull_in_pending_visits(
+            queue_id, room, -delta, visit.get("expected_end_time"), datetime.now()
+        )
+        shifted = len(pulled)
+        qdoc = yield from move_room(queue_id, room, 0, pulled_in)
+        if pulled_in is not None:
+            delta_minutes = pulled_in_minutes(qdoc, room, pulled_in[0])
+    else:
+        qdoc = yield from move_room(queue_id, room, 0)
+    shift = (timedelta(minutes=delta_minutes), PENDING_STATUSES, SHIFTED_FIELDS, room) if delta_minutes > 0 else None
+    return qdoc, delta_minutes, shift, pulled, shifted
+
+
+def remove_expired_visits(queue_id, expired):
+    """Delete one clinic's expired visits and move its queue version past the change.
+
+    Returns (queue document, ids of the visits actually removed).
+    """
+    # re-check status so a patient checking in right now is not removed
+    result = yield Op("visits", "delete_many", {"_id": {"$in": expired}, "status": "waiting"})
+    if result.deleted_count != len(expired):
+        # lost a race with a check-in, only report what was actually removed
+        remaining = {v["_id"] for v in (yield Op("visits", "find", {"_id": {"$in": expired}}, {"_id": 1}))}
+        expired = [i for i in expired if i not in remaining]
+    qdoc = yield Op(
+        "queue", "find_one_and_update",
+        {"queue_id": queue_id},
+        {"$inc": {"version": 1, "active_count": -len(expired)}},
+        return_document=ReturnDocument.AFTER
+    )
+    return qdoc, expired
+
+
+def expire_no_shows(now):
+    """Drop visits that never checked in before their deadline, in every clinic.
+
+    Returns ([(queue_id, queue document, removed ids)] per clinic, the next
+    check-in deadline still ahead or None).
+    """
+    expired = {}
+    for visit in (yield Op("visits", "find", expired_visits_query(now), {"queue_id": 1})):
+        expired.setdefault(visit["queue_id"], []).append(visit["_id"])
+    removed = []
+    for queue_id, visit_ids in expired.items():
+        qdoc, visit_ids = yield from remove_expired_visits(queue_id, visit_ids)
+        removed.append((queue_id, qdoc, visit_ids))
+    # the pruner sleeps until the next deadline, wherever it was set
+    upcoming = yield Op("visits", "find_one", upcoming_deadline_query(now), {"checkin_deadline": 1},
+                        sort=[("checkin_deadline", ASCENDING)])
+    return removed, upcoming["checkin_deadline"] if upcoming is not None else None
+
+
+def archive_visits(queue_id=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move completed visits from visits to visit_history in batches.
+
+    Visits keep their _id and are upserted, so a batch copied by a leader that
+    died before deleting it is just copied again. With queue_id set only that
+    clinic is archived (before a reset drops its visits).
+    """
+    query = {"status": "completed"} if queue_id is None else {"queue_id": queue_id, "status": "completed"}
+    while True:
+        done = yield Op("visits", "find", query, limit=batch_size)
+        if not done:
+            return
+        now = datetime.now()
+        yield Op("visit_history", "bulk_write",
+                 [ReplaceOne({"_id": v["_id"]}, dict(v, archived_at=now), upsert=True) for v in done],
+                 ordered=False)
+        yield Op("visits", "delete_many", {"_id": {"$in": [v["_id"] for v in done]}, "status": "completed"})
+        if len(done) < batch_size:
+            return
+
+
+def reset_queue(queue_id, now):
+    """Replace one clinic's queue document and drop its visits, archiving the
+    completed ones first. Other clinics are untouched. Returns the new queue document."""
+    # keep the version counter moving across resets so other workers' caches notice
+    old = (yield Op("queue", "find_one", {"queue_id": queue_id}, {"version": 1})) or {}
+    doc = new_queue_doc(queue_id, now, old.get("version", 0) + 1)
+    yield Op("queue", "replace_one", {"queue_id": queue_id}, doc, upsert=True)
+    yield from archive_visits(queue_id)
+    yield Op("visits", "delete_many", {"queue_id": queue_id})
+    return doc
+
+
+def find_clinics():
+    """Every clinic queue with its active visit and room counts, by queue_id."""
+    queues = yield Op("queue", "find", {}, {"queue_id": 1, "active_count": 1, "rooms.room": 1},
+                      sort=[("queue_id", ASCENDING)])
+    return [{
+        "queue_id": q["queue_id"],
+        "active_count": q.get("active_count", 0),
+        "rooms": len(q.get("rooms") or [None])
+    } for q in queues]
+
+
+def read_duration_stats(estimator_for):
+    """Load every saved duration statistic into estimator_for(queue_id)."""
+    for doc in (yield Op("duration_stats", "find")):
+        estimator_for(doc["queue_id"]).load(doc["reason"], doc["stats"])
+
+
+def write_duration_stats(estimators, now):
+    """Write the statistics of every reason that changed since the last save.
+
+    estimators are (queue_id, DurationEstimator) pairs.
+    """
+    for queue_id, estimator in estimators:
+        dirty = estimator.dirty()
+        if not dirty:
+            continue
+        yield Op("duration_stats", "bulk_write", [ReplaceOne(
+            {"queue_id": queue_id, "reason": reason},
+            {"queue_id": queue_id, "reason": reason, "stats": stats, "saved_at": now},
+            upsert=True
+        ) for reason, stats in dirty], ordered=False)
+        estimator.mark_saved([reason for reason, _ in dirty])
@@ -6,53 +6,243 @@ Created: 2025-10-10
 Description: Minimal Flask backend for UrgentCareQ
 """
 
-from flask import Flask, request
+from flask import Flask, Response, g, request, stream_with_context
+from werkzeug.routing import BaseConverter
+import atexit
 import json
 import os
 from pathlib import Path
-from dotenv import load_dotenv
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from datetime import datetime, timedelta
-import math
+from pymongo.errors import PyMongoError
+from datetime import datetime
+import sys
+import tempfile
 import threading
 import time
 
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+from queue_cache import QueueCache
+from deadline_index import DeadlineIndex
+from estimator import DurationEstimator
+from queue_events import QueueEventBroker
+import database
+import metrics
+from maintenance import MaintenanceRunner
+from lease import MongoLease
+from batch_writer import BatchWriter
+from projection import parse_changes, project_queue
+from event_log import (
+    EVENT_LOG_FLUSH_SECONDS, log_event, take_snapshots, restore_snapshots,
+)
+from queue_logic import (
+    QUEUE_ID, QUEUE_ID_PATTERN, ACTIVE_STATUSES, JOIN_BATCH_MAX, normalize_name,
+    expected_duration_minutes_for, parse_join_batch, checkout_update,
+    checkout_body, render_queue, visit_delta, sse_message, stream_step,
+    reason_key, DURATION_EWMA_ALPHA, DURATION_QUANTILE, DURATION_MIN_SAMPLES,
+    DURATION_STATS_SAVE_SECONDS,
+    # step functions, see run()
+    bump_version, refresh_cache, transition_visit, transition_failure,
+    find_checkin_visit, reserve_and_insert, settle_checkout, expire_no_shows,
+    archive_visits, reset_queue, find_clinics, read_duration_stats,
+    write_duration_stats,
+)
+
 PORT: int = 5001
 
 app = Flask(__name__)
 
-# Mongo client setup
-_env_dir = Path(__file__).resolve().parent
-_env_path = _env_dir / ".env"
-if _env_path.exists():
-    load_dotenv(dotenv_path=_env_path)
-else:
-    _envfile = _env_dir / "envfile.txt"
-    if _envfile.exists():
-        load_dotenv(dotenv_path=_envfile)
-
-uri = os.environ.get("MONGODB_URI")
-client = MongoClient(uri, server_api=ServerApi('1')) if uri else None
-db = client.urgentcare if client is not None else None
+
+class QueueIdConverter(BaseConverter):
+    regex = QUEUE_ID_PATTERN
+
+
+# Every clinic has its own queue under /api/clinics/<queue_id>/...; the
+# routes without a clinic serve the "main" queue.
+app.url_map.converters["queue_id"] = QueueIdConverter
+
+
+# Request timing for /metrics: from before the handler until its response is
+# built, labelled with the route template (see metrics.py)
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_commands = metrics.registry.begin_request()
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.registry.end_request(
+            g.pop("request_commands"),
+            request.url_rule.rule if request.url_rule is not None else None,
+            request.method,
+            response.status_code,
+            time.perf_counter() - started
+        )
+    return response
+
+# Mongo client setup: shared, env-configured client (see database.py).
+# Nothing connects until the first query.
+database.load_env()
+db = database.get_db()
 queue_collection = db.queue if db is not None else None
+# One document per patient visit, keyed by queue_id. The queue document only
+# holds queue-level state (rooms, room_free_at, global_delay_minutes, next_position).
+visits_collection = db.visits if db is not None else None
+# Append-only history of every queue change and the snapshots it is replayed
+# from on startup (see event_log.py)
+log_collection = db.queue_log if db is not None else None
+snapshots_collection = db.queue_snapshots if db is not None else None
+# Completed visits, moved out of visits by the maintenance leader so the hot
+# collection only holds live queues
+history_collection = db.visit_history if db is not None else None
+# Learned visit durations per clinic and reason (see src/estimator.py)
+stats_collection = db.duration_stats if db is not None else None
+change_log = BatchWriter(log_collection, flush_interval=EVENT_LOG_FLUSH_SECONDS) if db is not None else None
+
+# How long (seconds) a cached queue is served before its version is re-checked
+# against Mongo. Only matters when several backend workers share the database;
+# a single worker sees every write and keeps its cache current in place.
+QUEUE_CACHE_MAX_AGE = float(os.environ.get("QUEUE_CACHE_MAX_AGE", "1.0"))
+
+# queue_id -> QueueCache
+_queue_caches = {}
+_queue_caches_lock = threading.Lock()
+
+# queue_id -> DurationEstimator. Every process learns from its own checkouts
+# and saves what changed every DURATION_STATS_SAVE_SECONDS; with several
+# workers the last save of a reason wins, each being an estimate over a
+# share of that clinic's checkouts.
+_estimators = {}
+_estimators_lock = threading.Lock()
+_stats_stop = threading.Event()
+
+# Live staff screens subscribe to /api/staff/queue/stream. Each subscriber buffers
+# at most SSE_BUFFER_SIZE events before it is told to resync from a snapshot.
+SSE_BUFFER_SIZE = int(os.environ.get("SSE_BUFFER_SIZE", "256"))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+# Each open stream holds a request thread for its lifetime. Past this many per
+# process, new streams get 503 and the staff screen polls instead, so streams
+# cannot take every thread from the API (see gunicorn.conf.py)
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", "16"))
+# The staff front end is served from a different port, so the stream needs CORS
+STAFF_ORIGIN = os.environ.get("STAFF_ORIGIN", "http://127.0.0.1:5002")
+
+queue_events = QueueEventBroker(buffer_size=SSE_BUFFER_SIZE)
+
+# Background maintenance runs in one process across all replicas: the holder of
+# a lease in Mongo, renewed every third of MAINTENANCE_LEASE_SECONDS. Another
+# replica takes over within that long of the holder dying. Without Mongo
+# there is nothing to maintain and a host-local lock file is used instead.
+MAINTENANCE_LEASE_SECONDS = float(os.environ.get("MAINTENANCE_LEASE_SECONDS", "15"))
+MAINTENANCE_LOCK = os.environ.get("MAINTENANCE_LOCK", os.path.join(tempfile.gettempdir(), "urgentcareq-maintenance.lock"))
+# The pruner sleeps until the next check-in deadline. This is the longest it
+# sleeps without looking at Mongo, which picks up deadlines set by other workers.
+PRUNE_INTERVAL_SECONDS = float(os.environ.get("PRUNE_INTERVAL_SECONDS", "60"))
+
+# Check-in deadlines the pruner is waiting on (only filled in the maintenance leader)
+deadlines = DeadlineIndex()
+
+
+def ensure_indexes():
+    database.ensure_indexes(db)
+
+
+def run(steps):
+    """Run a queue_logic step function against the database."""
+    return database.run_steps(steps, db)
+
+
+def _queue_cache(queue_id):
+    with _queue_caches_lock:
+        cache = _queue_caches.get(queue_id)
+        if cache is None:
+            cache = _queue_caches[queue_id] = QueueCache(queue_id, ACTIVE_STATUSES)
+        return cache
+
+
+def get_estimator(queue_id):
+    with _estimators_lock:
+        estimator = _estimators.get(queue_id)
+        if estimator is None:
+            estimator = _estimators[queue_id] = DurationEstimator(
+                alpha=DURATION_EWMA_ALPHA, quantile=DURATION_QUANTILE, min_samples=DURATION_MIN_SAMPLES
+            )
+        return estimator
+
+
+def load_duration_stats():
+    run(read_duration_stats(get_estimator))
+
+
+def save_duration_stats():
+    with _estimators_lock:
+        estimators = list(_estimators.items())
+    run(write_duration_stats(estimators, datetime.now()))
+
+
+def _save_duration_stats_loop():
+    while not _stats_stop.wait(DURATION_STATS_SAVE_SECONDS):
+        try:
+            save_duration_stats()
+        except PyMongoError:
+            pass  # still dirty, retried next time
+
+
+def get_queue_cache(queue_id):
+    """Return the cache for queue_id, reloading it from Mongo if another worker changed the queue."""
+    return run(refresh_cache(_queue_cache(queue_id), QUEUE_CACHE_MAX_AGE))
 
-# Buffer time to prep room, can be adjusted by staff
-PREP_MINUTES = 10
 
-# These are arbitrary estimates based on typical urgent care guidance
-# in the future, these can be reassigned to estimates derived from data collected from the clinic
-REASON_ESTIMATE_MINUTES = {
-    "Flu-like symptoms": 20,
-    "Minor laceration": 25,
-    "COVID-19 test": 10,
-    "Common infections (ear, pink eye)": 15,
-    "Sore throat / strep check": 15,
-    "Sprain/strain": 30,
-    "Rash or allergic reaction (mild)": 15,
-    "Urinary symptoms (possible UTI)": 20,
-    "Medication refill/quick consult": 10,
-}
+def track_deadlines(visits):
+    """Tell the pruner about new or moved check-in deadlines (only the maintenance leader prunes)."""
+    if maintenance.is_leader:
+        for visit in visits:
+            deadlines.add(visit.get("checkin_deadline"))
+
+
+def record_change(queue_id, version, event_type, visit=None, meta=None, removed=(), shift=None, visits=(), **data):
+    """Apply a change that has already been persisted to Mongo to the cache and
+    publish it to live subscribers. visits is used instead of visit when one
+    write changed several visits."""
+    _queue_cache(queue_id).apply(version, visit=visit, meta=meta, removed=removed, shift=shift, visits=visits)
+    if version is None:
+        return  # queue document is gone, subscribers resync on their next check
+    change_log.add(log_event(queue_id, version, event_type, datetime.now(),
+                            visit=visit, meta=meta, removed=removed, shift=shift, visits=visits))
+    if visit is not None:
+        data["visit"] = visit_delta(visit)
+    if visits:
+        data["visits"] = [visit_delta(v) for v in visits]
+    publish_event(queue_id, version, event_type, **data)
+
+
+def publish_event(queue_id, version, event_type, **data):
+    queue_events.publish(queue_id, dict(data, type=event_type, version=version))
+
+
+def transition_error(queue_id, name, from_status, message):
+    """Build the error response for a transition that matched no visit."""
+    body, status = run(transition_failure(queue_id, name, from_status, message))
+    return json.dumps(body), status, {"Content-Type": "application/json"}
+
+
+def join_visits(queue_id, rows):
+    """Reserve slots for rows of join form values and insert their visits.
+
+    Returns (version, queue document, visits, response rows), or None if the
+    queue does not exist.
+    """
+    now = datetime.now()
+    estimator = get_estimator(queue_id)
+    durations = [expected_duration_minutes_for(fields.get("reason"), estimator) for fields in rows]
+    joined = run(reserve_and_insert(queue_id, rows, durations, now))
+    if joined is None:
+        return None
+    qdoc, patients, results = joined
+    # wakes the pruner early if one of these is now the next deadline
+    track_deadlines(patients)
+    return qdoc.get("version"), qdoc, patients, results
 
 
 # default route
@@ -69,72 +259,166 @@ def root_service():
 
 
 
+# staff/db/pool: connection pool counters, for tuning MONGO_MAX_POOL_SIZE and timeouts
+@app.get("/api/staff/db/pool")
+def staff_db_pool():
+    return json.dumps(database.pool_metrics.snapshot()), 200, {"Content-Type": "application/json"}
+
+# metrics: request latency, Mongo commands per route, queue sizes (Prometheus text format)
+@app.get("/metrics")
+def metrics_endpoint():
+    gauges = metrics.scrape_gauges(
+        dict(_queue_caches),
+        dict(_estimators),
+        database.pool_metrics.snapshot(),
+        change_log.stats() if change_log is not None else None
+    )
+    return metrics.registry.render(gauges), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+# clinics: every clinic queue this deployment serves
+@app.get("/api/clinics")
+def list_clinics():
+    # mongo uri check
+    if queue_collection is None:
+        return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
+
+    return json.dumps({"clinics": run(find_clinics())}), 200, {"Content-Type": "application/json"}
+
 # staff/queue: get current queue
 @app.get("/api/staff/queue")
-def staff_get_queue():
+@app.get("/api/clinics/<queue_id:queue_id>/staff/queue")
+def staff_get_queue(queue_id=QUEUE_ID):
     # mongo uri check
     if queue_collection is None:
         return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
 
-    qdoc = queue_collection.find_one({"queue_id": "main"}) or queue_collection.find_one({})
-    if qdoc is None:
+    cache = get_queue_cache(queue_id)
+    version, body = cache.serialized(render_queue)
+    if body is None:
         return json.dumps({"error": "queue not initialized", "patients": []}), 200, {"Content-Type": "application/json"}
 
-    patients = qdoc.get("patients", [])
-
-    # Format patient data for frontend
-    formatted_patients = []
-    for i, patient in enumerate(patients):
-        formatted_patients.append({
-            "position": i,
-            "name": patient.get("name", "Unknown"),
-            "phone": patient.get("phone", "N/A"),
-            "dob": patient.get("dob", "N/A"),
-            "reason": patient.get("reason", "N/A"),
-            "status": patient.get("status", "waiting"),
-            "checked_in": patient.get("checked_in", False),
-            "scheduled_time": patient.get("scheduled_time").isoformat() if patient.get("scheduled_time") else "N/A",
-            "expected_start_time": patient.get("expected_start_time").isoformat() if patient.get("expected_start_time") else None,
-            "expected_end_time": patient.get("expected_end_time").isoformat() if patient.get("expected_end_time") else None,
-            "expected_duration_minutes": patient.get("expected_duration_minutes"),
-            "initial_wait_minutes": patient.get("initial_wait_minutes"),
-            "checkin_deadline": patient.get("checkin_deadline").isoformat() if patient.get("checkin_deadline") else None,
-            "admitted_at": patient.get("admitted_at").isoformat() if patient.get("admitted_at") else None,
-            "completed_at": patient.get("completed_at").isoformat() if patient.get("completed_at") else None,
-            "actual_duration_minutes": patient.get("actual_duration_minutes"),
-        })
+    headers = {"Content-Type": "application/json", "Cache-Control": "no-cache"}
+    if not cache.settled:
+        # may still be missing a join that already moved the version, so no tag
+        return body, 200, headers
+
+    # the version is shared by all workers, so the tag is stable across them
+    etag = f"{cache.queue_id}-{version}"
+    headers["ETag"] = f'"{etag}"'
+    if request.if_none_match.contains(etag):
+        return b"", 304, headers
+    return body, 200, headers
+
+# staff/queue/stream: server-sent events for queue changes
+@app.get("/api/staff/queue/stream")
+@app.get("/api/clinics/<queue_id:queue_id>/staff/queue/stream")
+def staff_queue_stream(queue_id=QUEUE_ID):
+    # mongo uri check
+    if queue_collection is None:
+        return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
 
-    return json.dumps({
-        "queue_id": qdoc.get("queue_id", "main"),
-        "start_time": qdoc.get("start_time").isoformat() if qdoc.get("start_time") else None,
-        "room_free_at": qdoc.get("room_free_at").isoformat() if qdoc.get("room_free_at") else None,
-        "global_delay_minutes": qdoc.get("global_delay_minutes", 0),
-        "patients": formatted_patients,
-        "total_patients": len(formatted_patients)
-    }), 200, {"Content-Type": "application/json"}
+    # subscribe before taking the snapshot so no change falls in between
+    sub = queue_events.subscribe(queue_id, limit=SSE_MAX_STREAMS)
+    if sub is None:
+        return json.dumps({"error": "Too many open queue streams"}), 503, {
+            "Content-Type": "application/json",
+            "Retry-After": "30",
+            "Access-Control-Allow-Origin": STAFF_ORIGIN
+        }
+
+    def stream():
+        try:
+            resync = True
+            version = None
+            while True:
+                if resync:
+                    version, body = get_queue_cache(queue_id).serialized(render_queue)
+                    snapshot_version = version
+                    yield sse_message("resync", body.decode("utf-8") if body else "null", version)
+                    resync = False
+
+                overflowed, pending = sub.drain(SSE_HEARTBEAT_SECONDS)
+                if sub.closed:
+                    return  # server is shutting down, the client reconnects elsewhere
+                if overflowed:
+                    resync = True
+                    continue
+
+                if not pending:
+                    # changes made by other workers are not published in this process,
+                    # so fall back to the shared version counter while idle
+                    if get_queue_cache(queue_id).version != version:
+                        resync = True
+                    else:
+                        yield ": keepalive\n\n"
+                    continue
+
+                for event in pending:
+                    step = stream_step(event, version, snapshot_version)
+                    if step == "skip":
+                        continue  # already part of the snapshot
+                    if step == "resync":
+                        resync = True
+                        break
+                    version = event["version"]
+                    yield sse_message(event["type"], json.dumps(event), version)
+        finally:
+            queue_events.unsubscribe(sub)
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "Access-Control-Allow-Origin": STAFF_ORIGIN
+    })
+
+# staff/queue/projection: projected waits under hypothetical changes (nothing is written)
+@app.post("/api/staff/queue/projection")
+@app.post("/api/clinics/<queue_id:queue_id>/staff/queue/projection")
+def staff_queue_projection(queue_id=QUEUE_ID):
+    # mongo uri check
+    if queue_collection is None:
+        return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
+
+    body = request.get_json(silent=True)
+    if body is None and request.get_data():
+        return json.dumps({"error": "Body must be JSON"}), 400, {"Content-Type": "application/json"}
+    try:
+        changes = parse_changes(body)
+    except ValueError as e:
+        return json.dumps({"error": str(e)}), 400, {"Content-Type": "application/json"}
+
+    cache = get_queue_cache(queue_id)
+    if not cache.is_loaded():
+        return json.dumps({"error": "queue not initialized"}), 400, {"Content-Type": "application/json"}
+    qdoc, visits = cache.snapshot()
+
+    started = time.perf_counter()
+    try:
+        projection = project_queue(qdoc, visits, changes, datetime.now())
+    except ValueError as e:
+        return json.dumps({"error": str(e)}), 400, {"Content-Type": "application/json"}
+    projection["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return json.dumps(projection), 200, {"Content-Type": "application/json"}
 
-# staff/reset: reset the queue (delete existing queue if one, and create a new one in its place)
+# staff/reset: reset the clinic's queue (replace its queue document and drop its visits)
 @app.post("/api/staff/reset")
-def staff_reset():
+@app.post("/api/clinics/<queue_id:queue_id>/staff/reset")
+def staff_reset(queue_id=QUEUE_ID):
     # mongo uri check
     if queue_collection is None:
         return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
 
-    queue_collection.delete_many({})
+    # only this clinic's documents; other clinics are untouched
     now = datetime.now()
-    doc = {
-        "queue_id": "main",
-        "start_time": now,
-        "room_free_at": None,  # None means free now
-        "global_delay_minutes": 0,
-        "patients": [],
-        "created_at": now
-    }
-    queue_collection.insert_one(doc)
+    doc = run(reset_queue(queue_id, now))
+    _queue_cache(queue_id).load(doc, [])
+    change_log.add(log_event(queue_id, doc["version"], "reset", now, meta=doc))
+    publish_event(queue_id, doc["version"], "reset")
     return json.dumps({
-        "queue_id": "main",
+        "queue_id": queue_id,
         "start_time": now.isoformat(),
         "room_free_at": None,
+        "rooms": [{"room": r["room"], "free_at": r["free_at"].isoformat()} for r in doc["rooms"]],
         "global_delay_minutes": 0
     }), 200, {"Content-Type": "application/json"}
 
@@ -148,96 +432,51 @@ def staff_reset():
 
 # patient/joinqueue: adds patient to the queue
 @app.post("/api/patient/joinqueue")
-def patient_joinqueue():
+@app.post("/api/clinics/<queue_id:queue_id>/patient/joinqueue")
+def patient_joinqueue(queue_id=QUEUE_ID):
     # mongo uri check
     if queue_collection is None:
         return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
 
-    # ensure queue exists
-    qdoc = queue_collection.find_one({"queue_id": "main"}) or queue_collection.find_one({})
-    if qdoc is None:
+    # Reserve the earliest-free room and add the patient visit
+    joined = join_visits(queue_id, [request.form])
+    if joined is None:
         return json.dumps({"error": "queue not initialized"}), 400, {"Content-Type": "application/json"}
+    version, qdoc, patients, rows = joined
+    record_change(queue_id, version, "joined", visit=patients[0], meta=qdoc)
 
-    name = (request.form.get("patient_name") or "").strip()
-    phone = request.form.get("phone") or ""
-    dob = request.form.get("dob") or ""
-    insurance = request.form.get("insurance") or ""
-    reason = (request.form.get("reason") or "").strip()
+    return json.dumps(rows[0]), 200, {"Content-Type": "application/json"}
 
-    patients = qdoc.get("patients", [])
-    position = len(patients)
 
-    now = datetime.now()
-    room_free_at = qdoc.get("room_free_at")
-    effective_free_at = now if (room_free_at is None or room_free_at <= now) else room_free_at
-
-    # Estimate expected duration
-    reason_key = (reason or "").strip()
-    estimated_reason_minutes = REASON_ESTIMATE_MINUTES.get(reason_key, 15)
-    expected_duration_minutes = PREP_MINUTES + estimated_reason_minutes
-
-    expected_start_time = effective_free_at
-    expected_end_time = expected_start_time + timedelta(minutes=expected_duration_minutes)
-
-    # Initial wait minutes for this patient
-    wait_seconds = max(0, (effective_free_at - now).total_seconds())
-    initial_wait_minutes = int(math.ceil(wait_seconds / 60.0)) if wait_seconds > 0 else 0
-
-    # Set deadline 5 minutes prior to expected start
-    # but not before 'now' to avoid conflicts with first patient check-in time requirements
-    checkin_deadline = None
-    # avoid conlicts with first patient check-in time requirements
-    check_in_by_str = "ASAP" if position == 0 else None
-    if position != 0:
-        deadline = expected_start_time - timedelta(minutes=5)
-        if deadline < now:
-            deadline = now
-        checkin_deadline = deadline
-        check_in_by_str = deadline.isoformat()
-
-    patient = {
-        "name": name,
-        "phone": phone,
-        "dob": dob,
-        "insurance": insurance,
-        "reason": reason,
-        "scheduled_time": expected_start_time,
-        "expected_start_time": expected_start_time,
-        "expected_end_time": expected_end_time,
-        "expected_duration_minutes": expected_duration_minutes,
-        "initial_wait_minutes": initial_wait_minutes,
-        "checkin_deadline": checkin_deadline,
-        "status": "waiting",
-        "checked_in": False,
-        "checked_in_at": None,
-        "admitted_at": None,
-        "completed_at": None,
-        "actual_duration_minutes": None
-    }
-
-    # Add patient and advance room_free_at to expected_end_time
-    queue_collection.update_one(
-        {"_id": qdoc["_id"]},
-        {
-            "$push": {"patients": patient},
-            "$set": {"room_free_at": expected_end_time}
-        }
-    )
+# patient/joinqueue/batch: adds many patients in one request (partner intake, pre-registration imports)
+@app.post("/api/patient/joinqueue/batch")
+@app.post("/api/clinics/<queue_id:queue_id>/patient/joinqueue/batch")
+def patient_joinqueue_batch(queue_id=QUEUE_ID):
+    # mongo uri check
+    if queue_collection is None:
+        return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
 
-    return json.dumps({
-        "position": position,
-        "scheduled_time": expected_start_time.isoformat(),
-        "expected_start_time": expected_start_time.isoformat(),
-        "expected_end_time": expected_end_time.isoformat(),
-        "expected_duration_minutes": expected_duration_minutes,
-        "initial_wait_minutes": initial_wait_minutes,
-        "check_in_by": check_in_by_str
-    }), 200, {"Content-Type": "application/json"}
+    try:
+        rows = parse_join_batch(request.get_data(as_text=True), request.mimetype)
+    except ValueError as e:
+        return json.dumps({"error": str(e)}), 400, {"Content-Type": "application/json"}
+    if len(rows) > JOIN_BATCH_MAX:
+        return json.dumps({"error": f"At most {JOIN_BATCH_MAX} patients per batch"}), 413, {"Content-Type": "application/json"}
+
+    # One reservation for the whole batch, then a single insert_many
+    joined = join_visits(queue_id, rows)
+    if joined is None:
+        return json.dumps({"error": "queue not initialized"}), 400, {"Content-Type": "application/json"}
+    version, qdoc, patients, results = joined
+    record_change(queue_id, version, "joined", visits=patients, meta=qdoc)
+
+    return json.dumps({"count": len(results), "patients": results}), 200, {"Content-Type": "application/json"}
 
 
 # patient/checkin: marks a patient as checked in
 @app.post("/api/patient/checkin")
-def patient_checkin():
+@app.post("/api/clinics/<queue_id:queue_id>/patient/checkin")
+def patient_checkin(queue_id=QUEUE_ID):
     # mongo uri check
     if queue_collection is None:
         return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
@@ -249,47 +488,30 @@ def patient_checkin():
         return json.dumps({"error": "Patient name is required"}), 400, {"Content-Type": "application/json"}
 
     # Find queue
-    qdoc = queue_collection.find_one({"queue_id": "main"}) or queue_collection.find_one({})
-    if qdoc is None:
+    cache = get_queue_cache(queue_id)
+    if not cache.is_loaded():
         return json.dumps({"error": "queue not initialized"}), 400, {"Content-Type": "application/json"}
 
-    # Find patient in the queue by name
-    patients = qdoc.get("patients", [])
-    matching_patients = []
+    # Find patient by name through the in-memory index, or the Mongo index
+    # if this worker's cache has not seen the join yet
+    patient, error = run(find_checkin_visit(cache, name, dob))
+    if error is not None:
+        return json.dumps(error[0]), error[1], {"Content-Type": "application/json"}
 
-    for i, patient in enumerate(patients):
-        if patient.get("name", "").strip().lower() == name.lower():
-            matching_patients.append((i, patient))
-
-    if not matching_patients:
-        return json.dumps({"error": f"Patient '{name}' not found in queue"}), 404, {"Content-Type": "application/json"}
-
-    # If multiple patients with same name, use DOB to distinguish between them
-    if len(matching_patients) > 1:
-        if not dob:
-            return json.dumps({
-                "error": f"Multiple patients named '{name}' found. Please provide date of birth.",
-                "requires_dob": True
-            }), 400, {"Content-Type": "application/json"}
-
-        # Filter by DOB
-        matching_patients = [(i, p) for i, p in matching_patients if p.get("dob") == dob]
-
-        if not matching_patients:
-            return json.dumps({"error": f"No patient '{name}' with DOB {dob} found"}), 404, {"Content-Type": "application/json"}
-
-    # Mark patient as checked in
-    idx, patient = matching_patients[0]
-    patients[idx]["checked_in"] = True
-    patients[idx]["checked_in_at"] = datetime.now()
-    patients[idx]["status"] = "checked_in"
+    # Mark patient as checked in, only if still waiting
     scheduled_time = patient.get("scheduled_time")
 
-    # Update the queue with the modified patients array
-    queue_collection.update_one(
-        {"_id": qdoc["_id"]},
-        {"$set": {"patients": patients}}
-    )
+    updated = run(transition_visit(
+        {"_id": patient["_id"]},
+        "waiting",
+        {"$set": {"checked_in": True, "checked_in_at": datetime.now(), "status": "checked_in"}}
+    ))
+    if updated is None:
+        return json.dumps({
+            "error": f"Patient '{name}' was already checked in",
+            "conflict": True
+        }), 409, {"Content-Type": "application/json"}
+    record_change(updated["queue_id"], run(bump_version(updated["queue_id"])), "checked_in", visit=updated)
 
     return json.dumps({
         "message": "Check-in successful",
@@ -301,7 +523,8 @@ def patient_checkin():
 
 # staff/admit: mark patient as admitted (started)
 @app.post("/api/staff/admit")
-def staff_admit():
+@app.post("/api/clinics/<queue_id:queue_id>/staff/admit")
+def staff_admit(queue_id=QUEUE_ID):
     # mongo uri check
     if queue_collection is None:
         return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
@@ -310,35 +533,15 @@ def staff_admit():
     if not name:
         return json.dumps({"error": "Patient name is required"}), 400, {"Content-Type": "application/json"}
 
-    # Find queue
-    qdoc = queue_collection.find_one({"queue_id": "main"}) or queue_collection.find_one({})
-    if qdoc is None:
-        return json.dumps({"error": "queue not initialized"}), 400, {"Content-Type": "application/json"}
-
-    # Find patient in the queue by name
-    patients = qdoc.get("patients", [])
-    patient_found = False
-
-    for i, patient in enumerate(patients):
-        if patient.get("name", "").strip().lower() == name.lower():
-            # Check if patient is checked in
-            if not patient.get("checked_in"):
-                return json.dumps({"error": "Patient must be checked in before being admitted"}), 400, {"Content-Type": "application/json"}
-
-            # Mark as admitted
-            patients[i]["status"] = "admitted"
-            patients[i]["admitted_at"] = datetime.now()
-            patient_found = True
-            break
-
-    if not patient_found:
-        return json.dumps({"error": f"Patient '{name}' not found in queue"}), 404, {"Content-Type": "application/json"}
-
-    # Update the queue
-    queue_collection.update_one(
-        {"_id": qdoc["_id"]},
-        {"$set": {"patients": patients}}
-    )
+    # Admit the first checked-in patient with this name
+    updated = run(transition_visit(
+        {"queue_id": queue_id, "name_normalized": normalize_name(name)},
+        "checked_in",
+        {"$set": {"status": "admitted", "admitted_at": datetime.now()}}
+    ))
+    if updated is None:
+        return transition_error(queue_id, name, "checked_in", "Patient must be checked in before being admitted")
+    record_change(queue_id, run(bump_version(queue_id)), "admitted", visit=updated)
 
     return json.dumps({
         "message": "Patient admitted successfully",
@@ -349,7 +552,8 @@ def staff_admit():
 
 # staff/checkout: mark patient as completed, remove from queue, and calculate duration
 @app.post("/api/staff/checkout")
-def staff_checkout():
+@app.post("/api/clinics/<queue_id:queue_id>/staff/checkout")
+def staff_checkout(queue_id=QUEUE_ID):
     # mongo uri check
     if queue_collection is None:
         return json.dumps({"error": "MONGODB_URI not set"}), 500, {"Content-Type": "application/json"}
@@ -358,120 +562,132 @@ def staff_checkout():
     if not name:
         return json.dumps({"error": "Patient name is required"}), 400, {"Content-Type": "application/json"}
 
-    # Find queue
-    qdoc = queue_collection.find_one({"queue_id": "main"}) or queue_collection.find_one({})
-    if qdoc is None:
-        return json.dumps({"error": "queue not initialized"}), 400, {"Content-Type": "application/json"}
-
-    # Find patient in the queue by name
-    patients = qdoc.get("patients", [])
-    patient_found = False
-    patient_to_remove = None
-
-    for i, patient in enumerate(patients):
-        if patient.get("name", "").strip().lower() == name.lower():
-            # Check if patient is admitted
-            if patient.get("status") != "admitted":
-                return json.dumps({"error": "Patient must be admitted before checkout"}), 400, {"Content-Type": "application/json"}
+    # Complete the first admitted patient with this name
+    removed_patient = run(transition_visit(
+        {"queue_id": queue_id, "name_normalized": normalize_name(name)},
+        "admitted",
+        checkout_update(datetime.now())
+    ))
+    if removed_patient is None:
+        return transition_error(queue_id, name, "admitted", "Patient must be admitted before checkout")
+    # learn this reason's duration for future joins
+    get_estimator(queue_id).observe(reason_key(removed_patient.get("reason")), removed_patient.get("actual_duration_minutes"))
+
+    # Patients still waiting for the same room, and the room's free time, move by the delay
+    room = removed_patient.get("room")
+    qdoc, delta_minutes, shift, pulled, shifted = run(settle_checkout(queue_id, removed_patient))
+    # check-in deadlines moved earlier; the pruner must not sleep past them
+    track_deadlines(pulled)
+    record_change(queue_id, qdoc.get("version"), "completed", visit=removed_patient, meta=qdoc, shift=shift, visits=pulled)
+    if delta_minutes or pulled:
+        publish_event(
+            queue_id, qdoc.get("version"), "delay_changed",
+            delta_minutes=delta_minutes,
+            shifted=shifted,
+            room=room,
+            room_free_at=qdoc.get("room_free_at").isoformat(),
+            global_delay_minutes=qdoc.get("global_delay_minutes", 0)
+        )
+
+    return json.dumps(checkout_body(name, removed_patient, delta_minutes, qdoc)), 200, {"Content-Type": "application/json"}
 
-            # Calculate duration
-            admitted_at = patient.get("admitted_at")
-            completed_at = datetime.now()
+def prune_no_shows():
+    if queue_collection is None:
+        return
+    now = datetime.now()
+    deadlines.pop_due(now)
+    removed, upcoming = run(expire_no_shows(now))
+    for queue_id, qdoc, expired in removed:
+        version = qdoc.get("version") if qdoc is not None else None
+        record_change(queue_id, version, "pruned", meta=qdoc, removed=expired, ids=[str(i) for i in expired])
+    if upcoming is not None:
+        deadlines.add(upcoming)
 
-            if admitted_at:
-                duration = (completed_at - admitted_at).total_seconds() / 60
-                patient["actual_duration_minutes"] = round(duration, 2)
-            else:
-                patient["actual_duration_minutes"] = 0
 
-            patient["completed_at"] = completed_at
-            patient["status"] = "completed"
+def archive_completed_visits():
+    if visits_collection is not None:
+        run(archive_visits())
 
-            patient_to_remove = i
-            patient_found = True
-            break
 
-    if not patient_found:
-        return json.dumps({"error": f"Patient '{name}' not found in queue"}), 404, {"Content-Type": "application/json"}
+def snapshot_queues():
+    if queue_collection is not None:
+        run(take_snapshots())
 
-    # Remove patient from queue
-    removed_patient = patients.pop(patient_to_remove)
 
-    # Determine expected vs actual to adjust scheduling
-    actual_minutes = removed_patient.get("actual_duration_minutes") or 0
-    expected_minutes = removed_patient.get("expected_duration_minutes")
+def restore_queue_caches():
+    run(restore_snapshots(_queue_cache))
 
-    # One-way delay to avoid future patients from being scheduled too early
-    delta_raw = int(round(actual_minutes - expected_minutes))
-    delta_minutes = max(0, delta_raw)
 
-    # Shift room_free_at by the delta so future estimated times account for the delay
-    now = datetime.now()
-    current_room_free_at = qdoc.get("room_free_at")
-    base_time = current_room_free_at if current_room_free_at is not None else now
-    new_room_free_at = base_time + timedelta(minutes=delta_minutes)
-
-    # Update the queue: save patients, adjust room_free_at, and accumulate global delay
-    queue_collection.update_one(
-        {"_id": qdoc["_id"]},
-        {
-            "$set": {
-                "patients": patients,
-                "room_free_at": new_room_free_at
-            },
-            "$inc": {
-                "global_delay_minutes": delta_minutes
-            }
-        }
-    )
+maintenance = MaintenanceRunner(
+    [prune_no_shows, archive_completed_visits, snapshot_queues],
+    PRUNE_INTERVAL_SECONDS,
+    MongoLease(db.leases, "maintenance", MAINTENANCE_LEASE_SECONDS) if db is not None else MAINTENANCE_LOCK,
+    waiter=deadlines,
+    retry_interval=MAINTENANCE_LEASE_SECONDS / 3
+)
 
-    return json.dumps({
-        "message": "Patient checked out successfully",
-        "patient_name": name,
-        "status": "completed",
-        "actual_duration_minutes": removed_patient.get("actual_duration_minutes"),
-        "admitted_at": removed_patient.get("admitted_at").isoformat() if removed_patient.get("admitted_at") else None,
-        "completed_at": removed_patient.get("completed_at").isoformat() if removed_patient.get("completed_at") else None,
-        "expected_duration_minutes": expected_minutes,
-        "delta_minutes": delta_minutes,
-        "room_free_at": new_room_free_at.isoformat()
-    }), 200, {"Content-Type": "application/json"}
 
-def prune_no_shows():
-    if queue_collection is None:
-        return
-    qdoc = queue_collection.find_one({"queue_id": "main"}) or queue_collection.find_one({})
-    if qdoc is None:
-        return
-    patients = qdoc.get("patients", [])
-    if not patients:
-        return
-    now = datetime.now()
-    kept = []
-    for p in patients:
-        if p.get("checked_in"):
-            kept.append(p)
-            continue
-        deadline = p.get("checkin_deadline")
-        if deadline is None or deadline > now:
-            kept.append(p)
-    if len(kept) != len(patients):
-        queue_collection.update_one({"_id": qdoc["_id"]}, {"$set": {"patients": kept}})
-
-
-def _prune_loop():
-    while True:
+def start_prune_thread():
+    maintenance.start()
+
+
+_app_ready = False
+
+
+def create_app(run_maintenance=True):
+    """Prepare the app for serving and return it.
+
+    Called once per process (dev server or each WSGI worker). Every process
+    starts a maintenance runner, but only the one holding the maintenance
+    lease actually prunes.
+    """
+    global _app_ready
+    if not _app_ready:
+        if visits_collection is not None:
+            ensure_indexes()
+            restore_queue_caches()
+            load_duration_stats()
+            change_log.start()
+            threading.Thread(target=_save_duration_stats_loop, name="duration-stats", daemon=True).start()
+        if run_maintenance:
+            start_prune_thread()
+        atexit.register(shutdown)
+        _app_ready = True
+    return app
+
+
+def begin_shutdown():
+    """Stop background maintenance (handing the lease to another process) and end open streams."""
+    maintenance.stop(timeout=5)
+    queue_events.close()
+
+
+_shutdown_lock = threading.Lock()
+_shut_down = False
+
+
+def shutdown():
+    """Flush buffered writes and close the Mongo client.
+
+    Registered with atexit and also called from gunicorn's worker_exit hook;
+    only the first call does anything.
+    """
+    global _shut_down
+    with _shutdown_lock:
+        if _shut_down:
+            return
+        _shut_down = True
+    begin_shutdown()
+    if change_log is not None:
+        change_log.stop(timeout=5)
+        _stats_stop.set()
         try:
-            prune_no_shows()
-        except Exception:
+            save_duration_stats()
+        except PyMongoError:
             pass
-        time.sleep(60)
+    database.close_client()
 
 
-def start_prune_thread():
-    t = threading.Thread(target=_prune_loop, daemon=True)
-    t.start()
-
 if __name__ == "__main__":
-    start_prune_thread()
-    app.run(host="127.0.0.1", port=PORT)
\ No newline at end of file
+    create_app()
+    app.run(host="127.0.0.1", port=PORT)
@@ -0,0 +1,88 @@
+"""
+Filename: wsgi.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Production entry point for the UrgentCareQ backend.
+
+Run with gunicorn from the repository root:
+
+    gunicorn -c backend/gunicorn.conf.py
+
+or point any WSGI server at wsgi:app with backend/ as the working directory.
+Workers and threads are set in gunicorn.conf.py (WEB_CONCURRENCY,
+GUNICORN_THREADS). Every worker builds its own Mongo client after fork. Only
+the one worker, across all replicas, holding the maintenance lease (see
+lease.py) prunes no-shows. SIGTERM stops taking new requests, ends open queue
+streams, hands the maintenance lease over and closes the Mongo client once
+in-flight requests finish.
+
+Comparing throughput with the dev server
+----------------------------------------
+Use the same MongoDB and the same load for both runs. Reset the queue before
+each run so the tests start from the same queue size.
+
+    # dev server: one process, a thread per request
+    python backend/server.py
+    # production: gunicorn, e.g. 4 workers x 8 threads
+    WEB_CONCURRENCY=4 GUNICORN_THREADS=8 gunicorn -c backend/gunicorn.conf.py
+
+    # read path, conditional polls behave like the staff screen
+    hey -z 30s -c 64 http://127.0.0.1:5001/api/staff/queue
+    # write path
+    hey -z 30s -c 64 -m POST -T application/x-www-form-urlencoded \\
+        -d "patient_name=Load Test&reason=COVID-19 test" \\
+        http://127.0.0.1:5001/api/patient/joinqueue
+
+Compare requests/sec and the p99 latency of the two runs. The dev server
+handles everything in one process under the GIL. Under gunicorn, reads scale
+with workers until MongoDB or the cache re-check (QUEUE_CACHE_MAX_AGE) becomes
+the bottleneck. Joins serialize on the queue document whichever server runs
+them.
+
+bench/bench_http.py --url drives the same mixed traffic (join, check-in,
+admit, checkout, staff poll) from outside the server's process. The table below
+is a smoke test, not a capacity figure: it ran on one CPU with one gunicorn
+worker against mongomock (bench/mongomock_app.py), which takes a lock around
+every call, so nothing could run in parallel and neither Mongo round trips nor
+the connection pool were measured. Do not size WEB_CONCURRENCY or
+GUNICORN_THREADS from it; rerun the command above with several workers against
+a real mongod on a machine with cores to spare. Measured on 18 October 2026,
+Python 3.11, gunicorn 26.2, ROOM_COUNT=3, EARLY_FINISH_PULL_IN=1, the queue
+reset before each run, 16 clients for 20 s:
+
+    python bench/bench_http.py --url http://127.0.0.1:5001 --clients 16 --duration 20
+
+    server                             req/s   p50 ms (join/poll)   p99 ms (join/poll)
+    dev server, thread per request     118.6   69 / 71              790 / 884
+    gunicorn gthread, 1 worker x 8     123.9   70 / 92              671 / 883
+
+All it shows is that gunicorn serves the same traffic without 5xx and that
+capping the work in flight trims the p99.
+
+Queue streams
+-------------
+Under gthread every open /api/staff/queue/stream holds a worker thread until
+the staff screen closes it. A worker accepts at most SSE_MAX_STREAMS streams
+(default 16) and answers 503 beyond that; the staff screen then reloads every
+30 s instead of updating live. GUNICORN_THREADS (default 32) must stay above
+SSE_MAX_STREAMS so the API keeps threads of its own. For more screens than
+WEB_CONCURRENCY x SSE_MAX_STREAMS, send the stream routes to the async backend,
+which holds each stream as a coroutine rather than a thread:
+
+    # from backend/, next to gunicorn
+    uvicorn async_server:app --host 127.0.0.1 --port 5003
+
+and in the proxy route /api/staff/queue/stream and
+/api/clinics/<queue_id>/staff/queue/stream to port 5003, everything else to
+gunicorn. Changes made by the gunicorn workers reach those streams as a resync
+once the shared queue version moves, checked every SSE_HEARTBEAT_SECONDS.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from server import create_app  # noqa: E402
+
+app = create_app()
@@ -0,0 +1,377 @@
+"""
+Filename: bench_http.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: HTTP load test of backend/server.py under concurrent patient and
+staff traffic, with checks for lost updates.
+
+Run from the repository root:
+    python bench/bench_http.py [--clients 16] [--duration 10] [--mix join=3,checkin=3,admit=3,checkout=3,poll=4]
+                               [--late-share 0.3] [--no-pull-in] [--url http://127.0.0.1:5001]
+
+The app is served in-process on a local port by a threaded WSGI server,
+backed by mongomock (see mongomock_shim.py), or by a real mongod with
+--mongodb-uri. Only the "bench" clinic queue is used, and it is reset at the
+start, so other clinics in that database are left alone.
+
+With --url the load goes to a server that is already running instead (see
+mongomock_app.py), so the dev server and gunicorn can be compared from
+outside their process. Only requests, latencies and status codes are
+reported then: the database checks and --late-share need the app in-process.
+
+Each client runs closed-loop over one keep-alive connection. It picks a
+request by weight among the ones possible right now: join a new patient,
+or move a patient along (check-in, admit, checkout) that some client has
+taken to the step before, or poll the staff queue. Every request is timed.
+
+Bench visits are checked out moments after they are admitted, so they all
+finish early and pull in the room's pending visits (EARLY_FINISH_PULL_IN is
+on unless --no-pull-in). Before a share of the checkouts (--late-share) the
+visit's admit time is moved back, so it runs 1-20 minutes past its estimate
+and delays its room instead. Both run concurrently with joins on the same
+rooms.
+
+After the run every successful (2xx) transition is checked against the
+database; one whose change is not there is a lost update. Also checked:
+- the queue version went up exactly once per successful change
+- active_count matches the active visits
+- no two pending visits of a room overlap
+- no pending visit ends after its room's free time
+- the event log has every version since the reset
+- the staff queue lists exactly the active visits in the database, with
+  their start times
+- delays and pull-ins both happened (when enabled)
+
+Exits with status 1 if any check fails, so it can gate a deploy.
+"""
+
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(_root / "backend"))
+sys.path.append(str(Path(__file__).resolve().parent))
+
+QUEUE_ID = "bench"
+ENDPOINTS = ("join", "checkin", "admit", "checkout", "poll")
+PATHS = {
+    "join": f"/api/clinics/{QUEUE_ID}/patient/joinqueue",
+    "checkin": f"/api/clinics/{QUEUE_ID}/patient/checkin",
+    "admit": f"/api/clinics/{QUEUE_ID}/staff/admit",
+    "checkout": f"/api/clinics/{QUEUE_ID}/staff/checkout",
+    "poll": f"/api/clinics/{QUEUE_ID}/staff/queue",
+}
+# patients a transition applies to: taken from the stage before, on success put in the next
+STAGES = {"checkin": "joined", "admit": "checked_in", "checkout": "admitted"}
+NEXT_STAGE = {"join": "joined", "checkin": "checked_in", "admit": "admitted", "checkout": "completed"}
+REASONS = ["COVID-19 test", "Sprain/strain", "Flu-like symptoms", "Medication refill/quick consult"]
+ACTIVE = {"waiting", "checked_in", "admitted"}
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{name}', expected one of {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight)
+    return weights
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(q * len(values) + 0.5) - 1))]
+
+
+class Traffic:
+    """Patients at each stage and everything the clients recorded, shared by all clients."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = defaultdict(list)  # stage -> patient names
+        self.latencies = defaultdict(list)  # endpoint -> seconds
+        self.statuses = defaultdict(lambda: defaultdict(int))  # endpoint -> status -> count
+        self.succeeded = defaultdict(list)  # endpoint -> patient names
+        self.room_moves = defaultdict(int)  # "delay" / "pull_in" / "none" -> checkouts
+        self.joined_names = 0
+
+    def new_name(self):
+        with self.lock:
+            self.joined_names += 1
+            return f"bench patient {self.joined_names}"
+
+    def take(self, endpoint, rng):
+        """A patient ready for endpoint, or None."""
+        with self.lock:
+            waiting = self.stages[STAGES[endpoint]]
+            if not waiting:
+                return None
+            i = rng.randrange(len(waiting))
+            waiting[i], waiting[-1] = waiting[-1], waiting[i]
+            return waiting.pop()
+
+    def record(self, endpoint, name, status, seconds, body=b""):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+            if 200 <= status < 300 and name is not None:
+                self.succeeded[endpoint].append(name)
+                self.stages[NEXT_STAGE[endpoint]].append(name)
+                if endpoint == "checkout":
+                    delta = json.loads(body)["delta_minutes"]
+                    self.room_moves["delay" if delta > 0 else "pull_in" if delta < 0 else "none"] += 1
+
+    def available(self, endpoint):
+        return endpoint not in STAGES or bool(self.stages[STAGES[endpoint]])
+
+
+def backdate(visits, name, minutes_over):
+    """Move an admitted visit's admit time back so its checkout runs minutes_over past its estimate."""
+    from queue_logic import PREP_MINUTES
+
+    visit = visits.find_one({"queue_id": QUEUE_ID, "name": name, "status": "admitted"}, {"expected_duration_minutes": 1})
+    if visit is not None:
+        ran = visit["expected_duration_minutes"] - PREP_MINUTES + minutes_over
+        visits.update_one({"_id": visit["_id"], "status": "admitted"},
+                          {"$set": {"admitted_at": datetime.now() - timedelta(minutes=ran)}})
+
+
+def client(address, traffic, weights, deadline, seed, visits, late_share):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(*address, timeout=30)
+    while time.perf_counter() < deadline:
+        choices = [e for e in weights if weights[e] > 0 and traffic.available(e)]
+        endpoint = rng.choices(choices, [weights[e] for e in choices])[0]
+        name = None
+        if endpoint == "poll":
+            method, body, headers = "GET", None, {}
+        else:
+            name = traffic.new_name() if endpoint == "join" else traffic.take(endpoint, rng)
+            if name is None:
+                continue  # another client took the last one
+            form = {"patient_name": name}
+            if endpoint == "join":
+                form.update(reason=rng.choice(REASONS), phone="555-0100", dob="1990-01-01")
+            elif endpoint == "checkout" and rng.random() < late_share:
+                backdate(visits, name, rng.randint(1, 20))
+            method, body = "POST", urlencode(form)
+            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        started = time.perf_counter()
+        try:
+            conn.request(method, PATHS[endpoint], body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(*address, timeout=30)
+            status, data = 0, b""
+        traffic.record(endpoint, name, status, time.perf_counter() - started, data)
+    conn.close()
+
+
+def check_integrity(server, traffic, reset_version, staff_queue, expect_moves):
+    """Counts of every kind of inconsistency found after the run, per check."""
+    visits = {v["name"]: v for v in server.visits_collection.find({"queue_id": QUEUE_ID})}
+    for v in server.history_collection.find({"queue_id": QUEUE_ID}):
+        visits.setdefault(v["name"], v)
+
+    reached = {
+        "join": lambda v: v is not None,
+        "checkin": lambda v: v is not None and v.get("checked_in_at") is not None,
+        "admit": lambda v: v is not None and v.get("admitted_at") is not None,
+        "checkout": lambda v: v is not None and v.get("status") == "completed",
+    }
+    lost = {endpoint: sum(1 for name in traffic.succeeded[endpoint] if not check(visits.get(name)))
+            for endpoint, check in reached.items()}
+
+    qdoc = server.queue_collection.find_one({"queue_id": QUEUE_ID})
+    changes = sum(len(traffic.succeeded[e]) for e in reached)
+    active = [v for v in visits.values() if v.get("status") in ACTIVE]
+
+    overlaps = 0
+    by_room = defaultdict(list)
+    for v in active:
+        if v.get("status") != "admitted":
+            by_room[v.get("room")].append((v["expected_start_time"], v["expected_end_time"]))
+    for slots in by_room.values():
+        slots.sort()
+        overlaps += sum(1 for a, b in zip(slots, slots[1:]) if b[0] < a[1])
+
+    # a room whose free time moved without its visits (or the other way round) is booked over them
+    free_at = {r["room"]: r["free_at"] for r in qdoc.get("rooms", [])}
+    overbooked = sum(1 for room, slots in by_room.items() for _, end in slots if end > free_at.get(room, end))
+
+    server.change_log.flush()
+    logged = {e["version"] for e in server.log_collection.find(
+        {"queue_id": QUEUE_ID, "version": {"$gte": reset_version}}, {"version": 1})}
+    missing_events = sum(1 for v in range(reset_version, qdoc["version"] + 1) if v not in logged)
+
+    listed = {p["name"]: (p["status"], p["expected_start_time"]) for p in staff_queue["patients"]}
+    stale = sum(1 for v in active if listed.get(v["name"]) != (v["status"], v["expected_start_time"].isoformat())) + \
+        sum(1 for name in listed if visits.get(name, {}).get("status") not in ACTIVE)
+
+    return {
+        "lost_updates": lost,
+        "version_drift": reset_version + changes - qdoc["version"],
+        "active_count_drift": qdoc.get("active_count", 0) - len(active),
+        "overlapping_bookings": overlaps,
+        "visits_past_room_free_at": overbooked,
+        "missing_log_events": missing_events,
+        "stale_queue_entries": stale,
+        "room_moves_not_exercised": sum(1 for kind in expect_moves if not traffic.room_moves[kind]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test of backend/server.py with lost-update checks.")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of traffic")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("join=3,checkin=3,admit=3,checkout=3,poll=4"),
+                        help="request weights, e.g. join=3,checkin=3,admit=3,checkout=3,poll=4")
+    parser.add_argument("--rooms", type=int, default=3, help="exam rooms in the bench clinic")
+    parser.add_argument("--late-share", type=float, default=0.3,
+                        help="share of checkouts that run past their estimate and delay their room")
+    parser.add_argument("--no-pull-in", dest="pull_in", action="store_false",
+                        help="leave EARLY_FINISH_PULL_IN off, so early checkouts do not move anything")
+    parser.add_argument("--url", help="load this running server instead of one in-process (no database checks)")
+    parser.add_argument("--mongodb-uri", help="use this mongod instead of mongomock (only the bench clinic is touched)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    if args.url:
+        sys.exit(run_external(args))
+
+    os.environ["ROOM_COUNT"] = str(args.rooms)
+    if args.mongodb_uri:
+        os.environ["MONGODB_URI"] = args.mongodb_uri
+    else:
+        import mongomock_shim
+        mongomock_shim.install()
+        os.environ["MONGODB_URI"] = "mongodb://localhost"
+
+    import queue_logic
+    import server
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    queue_logic.EARLY_FINISH_PULL_IN = args.pull_in
+    app = server.create_app(run_maintenance=False)
+    httpd = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=httpd.serve_forever, name="bench-http", daemon=True).start()
+    address = ("127.0.0.1", httpd.server_port)
+
+    conn = http.client.HTTPConnection(*address)
+    conn.request("POST", f"/api/clinics/{QUEUE_ID}/staff/reset")
+    conn.getresponse().read()
+    reset_version = server.queue_collection.find_one({"queue_id": QUEUE_ID})["version"]
+
+    traffic = Traffic()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=client, args=(address, traffic, args.mix, deadline, args.seed + i,
+                                                     server.visits_collection, args.late_share))
+               for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    conn.request("GET", PATHS["poll"])
+    staff_queue = json.loads(conn.getresponse().read())
+    conn.close()
+    expect_moves = ["delay"] * (args.late_share > 0) + ["pull_in"] * args.pull_in
+    checks = check_integrity(server, traffic, reset_version, staff_queue, expect_moves)
+    httpd.shutdown()
+
+    failed = print_report(args, "mongod" if args.mongodb_uri else "mongomock", traffic, elapsed, checks)
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+def run_external(args):
+    """Load the server at args.url; returns the exit status."""
+    url = urlsplit(args.url)
+    address = (url.hostname, url.port or 80)
+
+    conn = http.client.HTTPConnection(*address)
+    conn.request("POST", f"/api/clinics/{QUEUE_ID}/staff/reset")
+    conn.getresponse().read()
+    conn.close()
+
+    traffic = Traffic()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=client, args=(address, traffic, args.mix, deadline, args.seed + i, None, 0))
+               for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    checks = {"lost_updates": {}, "server_errors": sum(
+        n for statuses in traffic.statuses.values() for status, n in statuses.items() if status == 0 or status >= 500)}
+    return 1 if print_report(args, args.url, traffic, elapsed, checks) else 0
+
+
+def print_report(args, backend, traffic, elapsed, checks):
+    """Print the run's numbers and checks; returns how many checks failed."""
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        latencies = traffic.latencies[endpoint]
+        statuses = traffic.statuses[endpoint]
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "errors": sum(n for status, n in statuses.items() if not 200 <= status < 300),
+            "statuses": dict(statuses),
+            "lost_updates": checks["lost_updates"].get(endpoint, 0),
+        }
+    total = sum(e["requests"] for e in endpoints.values())
+    report = {
+        "clients": args.clients,
+        "seconds": round(elapsed, 2),
+        "backend": backend,
+        "throughput_rps": round(total / elapsed, 1),
+        "endpoints": endpoints,
+        "checkouts": dict(traffic.room_moves),
+        "checks": {k: v for k, v in checks.items() if k != "lost_updates"},
+    }
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"{args.clients} clients, {elapsed:.1f}s against {backend}: {report['throughput_rps']} req/s")
+        print(f"{'endpoint':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}{'lost':>6}")
+        for endpoint, e in endpoints.items():
+            print(f"{endpoint:<10}{e['requests']:>10}{e['throughput_rps']:>10}{e['p50_ms']:>10}{e['p99_ms']:>10}"
+                  f"{e['errors']:>8}{e['lost_updates']:>6}")
+        print("checkouts: " + ", ".join(f"{kind} {n}" for kind, n in sorted(traffic.room_moves.items())))
+        for name, value in report["checks"].items():
+            print(f"{name}: {value}")
+    return sum(checks["lost_updates"].values()) + sum(abs(v) for v in report["checks"].values())
+
+
+if __name__ == "__main__":
+    main()
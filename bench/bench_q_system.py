@@ -0,0 +1,119 @@
+"""
+Filename: bench_q_system.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Per-operation cost of PatientQueue from 10 to 1,000,000 queued patients.
+
+Run from the repository root:
+    python bench/bench_q_system.py [--max 1000000] [--ops 20000]
+"""
+
+import argparse
+import gc
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+from q_system import PatientQueue
+
+
+class _Visit:
+    __slots__ = ("scheduled_time",)
+
+
+class BenchPatient:
+    """Minimal stand-in for patient.Patient; a million full Patient objects
+    would measure the allocator rather than the queue."""
+
+    __slots__ = ("name", "visit")
+
+    def __init__(self, n):
+        self.name = f"Patient {n}"
+        self.visit = _Visit()
+
+    def full_name(self):
+        return self.name
+
+
+def _per_op_ns(fn, ops):
+    # like timeit, keep the cyclic GC out of the timings: its full collections
+    # scan every live object and would otherwise grow with the queue size
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        fn(ops)
+        return (time.perf_counter() - start) * 1e9 / ops
+    finally:
+        gc.enable()
+
+
+def bench_size(size, ops, rng):
+    pq = PatientQueue(slot_seconds=900, start_time=datetime.now())
+    counter = size
+    handles = []
+    for n in range(size):
+        p = BenchPatient(n)
+        pq.enqueue(p)
+        handles.append(p)
+
+    def dequeue_enqueue(k):
+        nonlocal counter
+        for _ in range(k):
+            pq.dequeue()
+            counter += 1
+            pq.enqueue(BenchPatient(counter))
+
+    def remove_enqueue(k):
+        nonlocal counter
+        for _ in range(k):
+            # swap-in replacement keeps handles a list of live patients in O(1)
+            i = rng.randrange(size)
+            pq.remove_patient(handles[i])
+            counter += 1
+            handles[i] = BenchPatient(counter)
+            pq.enqueue(handles[i])
+
+    def positional(k):
+        for _ in range(k):
+            pq.get_patient_at(rng.randrange(size))
+
+    def find_by_name(k):
+        for _ in range(k):
+            pq.find_patient_by_name(f"Patient {counter - rng.randrange(size)}")
+
+    results = {"remove+enqueue": _per_op_ns(remove_enqueue, ops)}
+    results["dequeue+enqueue"] = _per_op_ns(dequeue_enqueue, ops)
+    results["get_patient_at"] = _per_op_ns(positional, ops)
+    results["find_by_name"] = _per_op_ns(find_by_name, ops)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[4])
+    parser.add_argument("--max", type=int, default=1_000_000, help="largest queue size")
+    parser.add_argument("--ops", type=int, default=20_000, help="minimum timed operations per size")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sizes = []
+    size = 10
+    while size <= args.max:
+        sizes.append(size)
+        size *= 10
+
+    columns = ["dequeue+enqueue", "remove+enqueue", "get_patient_at", "find_by_name"]
+    print(f"{'queued':>10}  " + "  ".join(f"{c:>16}" for c in columns) + "   (ns/op)")
+    for size in sizes:
+        # at least one operation per queued patient, so occasional O(n) ring
+        # resizes are averaged in rather than landing in or missing the window
+        results = bench_size(size, max(args.ops, size), rng)
+        print(f"{size:>10}  " + "  ".join(f"{results[c]:>16.0f}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Filename: mongomock_app.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: The backend's WSGI app (backend/wsgi.py) on mongomock, so
+bench_http.py --url can load the dev server and gunicorn without a mongod.
+Bench code only.
+
+Run from the repository root:
+
+    # dev server: werkzeug, a thread per request, as python backend/server.py
+    ROOM_COUNT=3 python bench/mongomock_app.py
+    # gunicorn with backend/gunicorn.conf.py
+    ROOM_COUNT=3 WEB_CONCURRENCY=1 GUNICORN_THREADS=8 \\
+        gunicorn -c backend/gunicorn.conf.py --pythonpath bench mongomock_app:app
+
+Every gunicorn worker gets its own mongomock store, so keep WEB_CONCURRENCY=1
+here: with more workers a patient joined in one worker is unknown to the
+others. Compare worker counts against a real mongod (MONGODB_URI).
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import mongomock_shim  # noqa: E402
+
+mongomock_shim.install()
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost")
+
+from wsgi import app  # noqa: E402
+
+if __name__ == "__main__":
+    import server
+
+    app.run(host="127.0.0.1", port=server.PORT)
@@ -0,0 +1,124 @@
+"""
+Filename: mongomock_shim.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Lets the backend run against mongomock for benchmarks. Bench
+code only, never imported by the app itself.
+
+install() must run before server.py is imported. It makes database.py build
+a mongomock client, teaches mongomock the aggregation operators the backend's
+update pipelines use, and serializes every collection call behind one lock.
+mongomock updates documents in Python without any locking of its own, so
+concurrent find_one_and_update calls could otherwise interleave and lose
+writes that mongod would never lose. With the lock each operation is atomic,
+as on a real server, but the store is single threaded: throughput measured on
+it is the app's, not a database's.
+"""
+
+from datetime import datetime, timedelta
+import functools
+import threading
+
+import mongomock
+import mongomock.aggregate as _aggregate
+import mongomock.collection as _collection
+
+_lock = threading.RLock()
+
+LOCKED_METHODS = (
+    "find_one", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "bulk_write", "count_documents", "aggregate",
+    "distinct", "create_index",
+)
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with _lock:
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def _patch_aggregation():
+    parser = _aggregate._Parser
+    arithmetic = parser._handle_arithmetic_operator
+    array = parser._handle_array_operator
+    basic = parser._parse_basic_expression
+
+    def handle_arithmetic(self, operator, values):
+        if operator == "$round":
+            value, places = self.parse_many(values)
+            return None if value is None else round(value, places)
+        if operator == "$add":
+            # date + milliseconds, as mongod does
+            parsed = list(self.parse_many(values))
+            if any(v is None for v in parsed):
+                return None
+            dates = [v for v in parsed if isinstance(v, datetime)]
+            if dates:
+                ms = sum(v for v in parsed if not isinstance(v, datetime))
+                return dates[0] + timedelta(milliseconds=ms)
+        return arithmetic(self, operator, values)
+
+    def handle_array(self, operator, value):
+        if operator == "$reduce":
+            acc = self.parse(value["initialValue"])
+            for item in self.parse(value["input"]) or []:
+                acc = parser(
+                    self._doc_dict,
+                    dict(self._user_vars, this=item, value=acc),
+                    ignore_missing_keys=self._ignore_missing_keys
+                ).parse(value["in"])
+            return acc
+        if operator == "$concatArrays":
+            out = []
+            for part in value:
+                out.extend([self.parse(x) for x in part] if isinstance(part, list) else self.parse(part))
+            return out
+        return array(self, operator, value)
+
+    def parse_basic(self, expression):
+        if expression == "$$NOW":
+            # the server clock, in ms precision like mongod
+            now = datetime.utcnow()
+            return now.replace(microsecond=now.microsecond // 1000 * 1000)
+        return basic(self, expression)
+
+    _aggregate.binary_arithmetic_operators.add("$round")
+    _aggregate.arithmetic_operators.add("$round")
+    parser._handle_arithmetic_operator = handle_arithmetic
+    parser._handle_array_operator = handle_array
+    parser._parse_basic_expression = parse_basic
+
+
+def _patch_bulk_sort():
+    # pymongo >= 4.11 passes sort= to the bulk replace/update builders
+    for name in ("add_replace", "add_update"):
+        method = getattr(_collection.BulkOperationBuilder, name)
+
+        def without_sort(self, *args, _method=method, **kwargs):
+            kwargs.pop("sort", None)
+            return _method(self, *args, **kwargs)
+        setattr(_collection.BulkOperationBuilder, name, without_sort)
+
+
+_installed = False
+
+
+def install():
+    """Patch mongomock and point database.py at it. Safe to call more than once."""
+    global _installed
+    if _installed:
+        return
+    import database
+
+    _patch_aggregation()
+    _patch_bulk_sort()
+    for name in LOCKED_METHODS:
+        setattr(_collection.Collection, name, _locked(getattr(_collection.Collection, name)))
+    # cursors read the store when first iterated
+    _collection.Cursor._compute_results = _locked(_collection.Cursor._compute_results)
+    database.MongoClient = mongomock.MongoClient
+    _installed = True
@@ -7,6 +7,7 @@ Description: Frontend module for UrgentCareQ staff dashboard UI
 """
 
 from flask import Flask, render_template_string, request, redirect, url_for
+import json
 import requests
 
 app = Flask(__name__)
@@ -379,30 +380,30 @@ staff_html = """
         <div class="stats-bar">
             <div class="stat-card">
                 <label>Waiting</label>
-                <div class="value">{{ queue_data.waiting_count }}</div>
+                <div class="value" id="waitingCount">{{ queue_data.waiting_count }}</div>
             </div>
             <div class="stat-card">
                 <label>Checked In</label>
-                <div class="value">{{ queue_data.checkedin_count }}</div>
+                <div class="value" id="checkedinCount">{{ queue_data.checkedin_count }}</div>
             </div>
             <div class="stat-card">
                 <label>Admitted</label>
-                <div class="value">{{ queue_data.admitted_count }}</div>
+                <div class="value" id="admittedCount">{{ queue_data.admitted_count }}</div>
             </div>
             <div class="stat-card">
                 <label>Total Patients</label>
-                <div class="value">{{ queue_data.total_patients }}</div>
+                <div class="value" id="totalCount">{{ queue_data.total_patients }}</div>
             </div>
         </div>
 
         <div class="queue-container" id="queueContainer">
-            {% if queue_data.patients %}
                 {% for patient in queue_data.patients %}
-                <div class="patient-card {{ patient.status }}" data-name="{{ patient.name|lower }}">
+                <div class="patient-card {{ patient.status }}" data-name="{{ patient.name|lower }}" data-full-name="{{ patient.name }}" data-dob="{{ patient.dob }}"
+                     data-id="{{ patient.id }}" data-room="{{ patient.room if patient.room is not none else '' }}">
                     <div class="patient-card-header">
                         <div class="patient-info">
                             <div class="patient-name">{{ patient.name }}</div>
-                            <div class="patient-meta">Position: #{{ patient.position + 1 }} • DOB: {{ patient.dob }}</div>
+                            <div class="patient-meta">Position: #<span class="position">{{ patient.position + 1 }}</span> • DOB: {{ patient.dob }}</div>
                         </div>
                         <span class="status-badge {{ patient.status }}">
                             {% if patient.status == 'waiting' %}Waiting{% endif %}
@@ -422,7 +423,7 @@ staff_html = """
                         </div>
                         <div class="detail-item">
                             <label>Expected Start</label>
-                            <div class="value">{{ patient.expected_start_time }}</div>
+                            <div class="value start-time" data-start="{{ patient.expected_start_iso }}">{{ patient.expected_start_time }}</div>
                         </div>
                         <div class="detail-item">
                             <label>Expected Duration</label>
@@ -455,13 +456,11 @@ staff_html = """
                     </div>
                 </div>
                 {% endfor %}
-            {% else %}
-                <div class="empty-state">
+                <div class="empty-state" id="emptyState"{% if queue_data.patients %} style="display: none;"{% endif %}>
                     <div class="empty-state-icon">—</div>
                     <h3>No patients in queue</h3>
                     <p>Queue is empty. New patients will appear here.</p>
                 </div>
-            {% endif %}
         </div>
         {% endif %}
 
@@ -488,26 +487,220 @@ staff_html = """
                 }
             });
         }
+
+        // Live updates: the backend pushes an event whenever any terminal changes the queue.
+        // Each event is applied to the cards in place. One this page cannot apply (a missed
+        // version, a reset) reloads it instead, at most once a second.
+        const STATUS_LABELS = {waiting: "Waiting", checked_in: "Checked In", admitted: "Admitted"};
+        const ACTIONS = {
+            waiting: ["/checkin", "btn-checkin", "Check In"],
+            checked_in: ["/admit", "btn-admit", "Admit Patient"],
+            admitted: ["/checkout", "btn-checkout", "Check Out"]
+        };
+        const container = document.getElementById("queueContainer");
+        let version = null;
+        let reloadTimer = null;
+
+        function scheduleReload() {
+            if (reloadTimer === null) {
+                reloadTimer = setTimeout(() => window.location.reload(), 1000);
+            }
+        }
+
+        function escapeHtml(text) {
+            const div = document.createElement("div");
+            div.textContent = text === null || text === undefined ? "" : String(text);
+            return div.innerHTML;
+        }
+
+        // the backend sends local times as ISO strings without a zone
+        function parseTime(iso) {
+            const m = /^(\\d+)-(\\d+)-(\\d+)T(\\d+):(\\d+):(\\d+)/.exec(iso || "");
+            return m ? new Date(m[1], m[2] - 1, m[3], m[4], m[5], m[6]) : null;
+        }
+
+        function isoTime(date) {
+            const pad = n => String(n).padStart(2, "0");
+            return `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())}` +
+                `T${pad(date.getHours())}:${pad(date.getMinutes())}:${pad(date.getSeconds())}`;
+        }
+
+        function setStart(card, iso) {
+            const cell = card.querySelector(".start-time");
+            const when = parseTime(iso);
+            cell.dataset.start = iso || "";
+            cell.textContent = when ? when.toLocaleTimeString([], {hour: "2-digit", minute: "2-digit"}) : "";
+        }
+
+        function setStatus(card, patient) {
+            card.className = `patient-card ${patient.status}`;
+            const badge = card.querySelector(".status-badge");
+            badge.className = `status-badge ${patient.status}`;
+            badge.textContent = STATUS_LABELS[patient.status] || "";
+            const action = ACTIONS[patient.status];
+            const dob = patient.status === "waiting"
+                ? `<input type="hidden" name="dob" value="${escapeHtml(card.dataset.dob)}">` : "";
+            card.querySelector(".action-buttons").innerHTML = action ? `
+                <form method="post" action="${action[0]}" style="flex: 1; min-width: 120px;">
+                    <input type="hidden" name="patient_name" value="${escapeHtml(card.dataset.fullName)}">
+                    ${dob}
+                    <button type="submit" class="btn ${action[1]}">${action[2]}</button>
+                </form>` : "";
+        }
+
+        function newCard(patient) {
+            const card = document.createElement("div");
+            card.dataset.name = (patient.name || "").toLowerCase();
+            card.dataset.fullName = patient.name || "";
+            card.dataset.dob = patient.dob || "";
+            card.dataset.id = patient.id;
+            card.dataset.room = patient.room === null ? "" : patient.room;
+            card.innerHTML = `
+                <div class="patient-card-header">
+                    <div class="patient-info">
+                        <div class="patient-name">${escapeHtml(patient.name)}</div>
+                        <div class="patient-meta">Position: #<span class="position"></span> • DOB: ${escapeHtml(patient.dob)}</div>
+                    </div>
+                    <span class="status-badge"></span>
+                </div>
+                <div class="patient-details">
+                    <div class="detail-item"><label>Reason</label><div class="value">${escapeHtml(patient.reason)}</div></div>
+                    <div class="detail-item"><label>Phone</label><div class="value">${escapeHtml(patient.phone)}</div></div>
+                    <div class="detail-item"><label>Expected Start</label><div class="value start-time"></div></div>
+                    <div class="detail-item"><label>Expected Duration</label><div class="value">${escapeHtml(patient.expected_duration_minutes)} min</div></div>
+                </div>
+                <div class="action-buttons"></div>`;
+            setStatus(card, patient);
+            setStart(card, patient.expected_start_time);
+            return card;
+        }
+
+        function findCard(id) {
+            return container.querySelector(`.patient-card[data-id="${CSS.escape(String(id))}"]`);
+        }
+
+        function addVisit(patient) {
+            if (!findCard(patient.id)) {
+                container.insertBefore(newCard(patient), document.getElementById("emptyState"));
+            }
+        }
+
+        function updateVisit(patient) {
+            const card = findCard(patient.id);
+            if (!card) {
+                if (patient.status in ACTIONS && patient.name !== undefined && patient.reason !== undefined) {
+                    addVisit(patient);
+                } else if (patient.status in ACTIONS) {
+                    scheduleReload();  // a visit this page never saw, without its full row
+                }
+                return;
+            }
+            if (!(patient.status in ACTIONS)) {
+                card.remove();
+                return;
+            }
+            setStatus(card, patient);
+            if (patient.expected_start_time !== undefined) {
+                setStart(card, patient.expected_start_time);
+            }
+        }
+
+        // positions and counts follow the cards on the page
+        function refreshCounts() {
+            const cards = container.querySelectorAll(".patient-card");
+            cards.forEach((card, i) => { card.querySelector(".position").textContent = i + 1; });
+            const count = status => container.querySelectorAll(`.patient-card.${status}`).length;
+            document.getElementById("waitingCount").textContent = count("waiting");
+            document.getElementById("checkedinCount").textContent = count("checked_in");
+            document.getElementById("admittedCount").textContent = count("admitted");
+            document.getElementById("totalCount").textContent = cards.length;
+            document.getElementById("emptyState").style.display = cards.length ? "none" : "";
+            filterPatients();
+        }
+
+        const HANDLERS = {
+            joined: data => (data.visits || [data.visit]).forEach(addVisit),
+            checked_in: data => updateVisit(data.visit),
+            admitted: data => updateVisit(data.visit),
+            // the checked-out visit, and the visits a pull-in moved earlier
+            completed: data => [data.visit].concat(data.visits || []).forEach(updateVisit),
+            pruned: data => (data.ids || []).forEach(id => { const card = findCard(id); if (card) card.remove(); }),
+            delay_changed: data => {
+                // a delay moves every pending visit of the room; pulled-in visits came with "completed"
+                if (data.delta_minutes <= 0) return;
+                container.querySelectorAll(".patient-card.waiting, .patient-card.checked_in").forEach(card => {
+                    const start = parseTime(card.querySelector(".start-time").dataset.start);
+                    if (start && (data.room === null || card.dataset.room === String(data.room))) {
+                        setStart(card, isoTime(new Date(start.getTime() + data.delta_minutes * 60000)));
+                    }
+                });
+            },
+            reset: () => scheduleReload()
+        };
+
+        if (window.EventSource && container) {
+            const stream = new EventSource("http://127.0.0.1:5001/api/staff/queue/stream");
+            stream.addEventListener("resync", event => {
+                // a full snapshot, on connect and after a gap the backend could not replay
+                const snapshot = JSON.parse(event.data);
+                container.querySelectorAll(".patient-card").forEach(card => card.remove());
+                snapshot.patients.forEach(addVisit);
+                version = Number(event.lastEventId);
+                refreshCounts();
+            });
+            stream.addEventListener("error", () => {
+                // refused (503: the backend is at SSE_MAX_STREAMS), so poll by
+                // reloading, which also tries the stream again
+                if (stream.readyState === EventSource.CLOSED) {
+                    setTimeout(() => window.location.reload(), 30000);
+                }
+            });
+            Object.keys(HANDLERS).forEach(type => {
+                stream.addEventListener(type, event => {
+                    const data = JSON.parse(event.data);
+                    // delay_changed follows its checkout's "completed" at the same version
+                    const expected = type === "delay_changed" ? version : version + 1;
+                    if (version === null || data.version !== expected) {
+                        scheduleReload();  // missed a change; the stream stays open meanwhile
+                        return;
+                    }
+                    version = data.version;
+                    HANDLERS[type](data);
+                    refreshCounts();
+                });
+            });
+        }
     </script>
 </body>
 </html>
 """
 
 
+# Last queue body and its ETag, reused when the backend answers 304 Not Modified
+_last_queue = {"etag": None, "body": None}
+
+
 def get_queue_data():
     try:
-        response = requests.get("http://127.0.0.1:5001/api/staff/queue")
-        if response.status_code == 200:
+        headers = {"If-None-Match": _last_queue["etag"]} if _last_queue["etag"] else {}
+        response = requests.get("http://127.0.0.1:5001/api/staff/queue", headers=headers)
+        data = None
+        if response.status_code == 304 and _last_queue["body"] is not None:
+            data = json.loads(_last_queue["body"])
+        elif response.status_code == 200:
             data = response.json()
-
+            _last_queue["etag"] = response.headers.get("ETag")
+            _last_queue["body"] = response.content
+        if data is not None:
             # Calculate status counts
             patients = data.get("patients", [])
             waiting_count = sum(1 for p in patients if p.get("status") == "waiting")
             checkedin_count = sum(1 for p in patients if p.get("status") == "checked_in")
             admitted_count = sum(1 for p in patients if p.get("status") == "admitted")
 
-            # Format times for display
+            # Format times for display, keeping the ISO time for live updates
             for patient in patients:
+                patient["expected_start_iso"] = patient.get("expected_start_time") or ""
                 if patient.get("expected_start_time"):
                     try:
                         from datetime import datetime
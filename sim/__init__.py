@@ -0,0 +1,30 @@
+"""
+Filename: __init__.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Discrete-event simulator for comparing scheduling policies.
+
+Drives the legacy PatientQueue and Scheduler and the backend's room booking
+(RoomScheduler plus the queue_logic rules) through a seeded day of patient
+arrivals, and reports waits, room utilization and no-show loss.
+
+Run from the repository root:
+    python -m sim [--arrivals 10000] [--policy rooms] [--seed 1]
+"""
+
+import sys
+from pathlib import Path
+
+_root = Path(__file__).resolve().parent.parent
+for _path in (_root / "src", _root / "backend"):
+    if str(_path) not in sys.path:
+        sys.path.append(str(_path))
+
+from .engine import Simulation, simulate  # noqa: E402
+from .policies import POLICIES, FixedSlots, RoomBooking, SingleQueue, make_policy  # noqa: E402
+from .workload import generate_arrivals, rooms_for  # noqa: E402
+
+__all__ = [
+    "Simulation", "simulate", "POLICIES", "FixedSlots", "RoomBooking", "SingleQueue",
+    "make_policy", "generate_arrivals", "rooms_for",
+]
@@ -0,0 +1,83 @@
+"""
+Filename: __main__.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Command line for the simulator: one seeded day per policy.
+
+Run from the repository root:
+    python -m sim [--arrivals 10000] [--rooms N] [--policy rooms] [--seed 1] [--json]
+
+Every policy sees the same arrivals. --max-seconds makes the run fail (exit 1)
+if any policy takes longer, for use as a CI check.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from . import POLICIES, generate_arrivals, rooms_for, simulate
+from .workload import HOURLY_PROFILE
+
+COLUMNS = [
+    ("mean_wait_minutes", "wait"),
+    ("p95_wait_minutes", "p95 wait"),
+    ("mean_join_to_room_minutes", "to room"),
+    ("p95_join_to_room_minutes", "p95 to room"),
+    ("p95_late_vs_promise_minutes", "p95 late"),
+    ("utilization", "util"),
+    ("no_shows_pruned", "no-shows"),
+    ("late_pruned", "late pruned"),
+    ("lost_share", "lost"),
+    ("elapsed_ms", "ms"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a clinic day under each scheduling policy.")
+    parser.add_argument("--arrivals", type=int, default=10000, help="expected arrivals over the day")
+    parser.add_argument("--rooms", type=int, help="exam rooms (default: enough for 85%% utilization)")
+    parser.add_argument("--policy", action="append", choices=POLICIES, help="policy to run (repeatable, default all)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--service-scale", type=float, default=1.0,
+                        help="true visit durations relative to the estimate table")
+    parser.add_argument("--service-cv", type=float, default=0.5, help="coefficient of variation of visit durations")
+    parser.add_argument("--no-show-rate", type=float, default=0.08)
+    parser.add_argument("--json", action="store_true", help="print one JSON report per line")
+    parser.add_argument("--max-seconds", type=float, help="fail if a policy's run takes longer")
+    args = parser.parse_args()
+
+    arrivals = generate_arrivals(
+        args.seed,
+        args.arrivals,
+        service_scale=args.service_scale,
+        service_cv=args.service_cv,
+        no_show_rate=args.no_show_rate
+    )
+    rooms = args.rooms or rooms_for(arrivals, len(HOURLY_PROFILE) * 60)
+
+    reports = []
+    for name in args.policy or POLICIES:
+        started = time.perf_counter()
+        report = simulate(name, arrivals, rooms)
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        reports.append(report)
+
+    if args.json:
+        for report in reports:
+            print(json.dumps(report))
+    else:
+        print(f"{len(arrivals)} arrivals, {rooms} rooms, seed {args.seed}  (minutes)")
+        print(f"{'policy':<16}" + "".join(f"{label:>12}" for _, label in COLUMNS))
+        for report in reports:
+            print(f"{report['policy']:<16}" + "".join(f"{report[key]:>12}" for key, _ in COLUMNS))
+
+    if args.max_seconds is not None:
+        slow = [r["policy"] for r in reports if r["elapsed_ms"] > args.max_seconds * 1000]
+        if slow:
+            print(f"Slower than {args.max_seconds}s: {', '.join(slow)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
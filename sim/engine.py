@@ -0,0 +1,264 @@
+"""
+Filename: engine.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Discrete-event simulation of one clinic day under a scheduling
+policy.
+
+Events (join, check-in, check-in deadline, checkout) are kept in one heap
+ordered by time. A visit moves through the backend's lifecycle:
+
+- join: the policy books a room line and a start time. Like new_visit(),
+  everyone but the first in an empty queue must check in 5 minutes before
+  their start, and never sooner than CHECKIN_GRACE_MINUTES after joining.
+- check-in: the patient comes in `early` minutes before their current start
+  time (they are told when it moves), or never for a no-show.
+- deadline: a visit still waiting then is pruned, as the backend's pruner does.
+- admit: whenever a room is free, staff admit the first checked-in patient in
+  its line (or in the shared line). Nobody is admitted out of their line.
+- checkout: the visit held its room for its sampled duration; the policy
+  then adjusts the room's bookings. The room takes PREP_MINUTES of turnover
+  before the next patient is admitted.
+
+Moving a room's pending visits back is one offset per line, so a delay costs
+O(1) however long the line is. A check-in or deadline event that finds its
+visit's time has moved since is pushed again at the new time.
+"""
+
+import heapq
+import math
+
+from queue_logic import CHECKIN_GRACE_MINUTES, PREP_MINUTES
+
+from .policies import make_policy, to_datetime
+
+EPSILON = 1e-9
+
+WAITING, CHECKED_IN, ADMITTED, COMPLETED, PRUNED = range(5)
+
+
+class Visit:
+    __slots__ = (
+        "seq", "arrival", "reason", "service", "no_show", "early",
+        "room", "line", "base", "deadline_base", "expected", "promised",
+        "state", "checked_in_at", "admitted_at",
+        "visit", "scheduled_time"
+    )
+
+    def __init__(self, arrival):
+        self.seq = arrival.seq
+        self.arrival = arrival.at
+        self.reason = arrival.reason
+        self.service = arrival.service
+        self.no_show = arrival.no_show
+        self.early = arrival.early
+        self.room = None
+        self.line = None
+        self.base = 0.0  # start time less the line's offset
+        self.deadline_base = None
+        self.expected = None  # booked minutes
+        self.promised = None  # start time given at join
+        self.state = WAITING
+        self.checked_in_at = None
+        self.admitted_at = None
+        # PatientQueue writes visit.scheduled_time on the patient it holds
+        self.visit = self
+        self.scheduled_time = None
+
+    def full_name(self):
+        return f"Patient {self.seq}"
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+class Simulation:
+    def __init__(self, policy, rooms, arrivals):
+        self.policy = policy
+        self.rooms = rooms
+        self.arrivals = arrivals
+        self.events = []
+        self._counter = 0
+        lines = [None] if policy.shared_line else range(1, rooms + 1)
+        self.lines = {line: {} for line in lines}  # line -> {seq: visit} pending, in booking order
+        self.ready = {line: [] for line in lines}  # line -> heap of (seq, visit) checked in
+        self.offset = {line: 0.0 for line in lines}
+        self.free_rooms = list(range(1, rooms + 1))  # heap, shared line only
+        self.busy = [False] * (rooms + 1)  # by room, one line per room only
+        self.active = 0
+        self.busy_minutes = 0.0
+        self.last_checkout = 0.0
+        self.visits = []
+
+    def push(self, when, handler, visit):
+        self._counter += 1
+        heapq.heappush(self.events, (when, self._counter, handler, visit))
+
+    # times of a visit, including the moves of its line since it joined
+
+    def start(self, visit):
+        return visit.base + self.offset[visit.line]
+
+    def deadline(self, visit):
+        if visit.deadline_base is None:
+            return None
+        return visit.deadline_base + self.offset[visit.line]
+
+    def show_time(self, visit):
+        return max(visit.arrival, self.start(visit) - visit.early)
+
+    # used by policies
+
+    def shift_room(self, room, minutes):
+        """Move every pending visit of the room's line back by minutes."""
+        self.offset[room] += minutes
+
+    def pending_count(self, line):
+        return len(self.lines[line])
+
+    def last_pending(self, line):
+        pending = self.lines[line]
+        return pending[next(reversed(pending))] if pending else None
+
+    def pending_docs(self, line):
+        """The line's pending visits in queue order, shaped like visit documents."""
+        for visit in self.lines[line].values():
+            deadline = self.deadline(visit)
+            yield {
+                "visit": visit,
+                "status": "waiting" if visit.state == WAITING else "checked_in",
+                "expected_start_time": to_datetime(self.start(visit)),
+                "checkin_deadline": to_datetime(deadline) if deadline is not None else None,
+            }
+
+    def pull_in(self, visit, minutes, now):
+        """Move one pending visit earlier; its patient is told and may come in sooner."""
+        visit.base -= minutes
+        if visit.deadline_base is not None:
+            visit.deadline_base -= minutes
+        if visit.state == WAITING:
+            if not visit.no_show:
+                self.push(max(now, self.show_time(visit)), self.on_show, visit)
+            if visit.deadline_base is not None:
+                self.push(max(now, self.deadline(visit)), self.on_deadline, visit)
+
+    # events
+
+    def on_join(self, visit, now):
+        first = self.active == 0
+        self.active += 1
+        room, start = self.policy.book(visit, now)
+        visit.room = room
+        visit.line = None if self.policy.shared_line else room
+        visit.promised = start
+        visit.base = start - self.offset[visit.line]
+        if not first:
+            visit.deadline_base = max(start - 5, now + CHECKIN_GRACE_MINUTES) - self.offset[visit.line]
+        self.lines[visit.line][visit.seq] = visit
+        if not visit.no_show:
+            self.push(self.show_time(visit), self.on_show, visit)
+        if visit.deadline_base is not None:
+            self.push(self.deadline(visit), self.on_deadline, visit)
+
+    def on_show(self, visit, now):
+        if visit.state != WAITING:
+            return
+        when = self.show_time(visit)
+        if when > now + EPSILON:
+            self.push(when, self.on_show, visit)  # their start moved back since
+            return
+        visit.state = CHECKED_IN
+        visit.checked_in_at = now
+        heapq.heappush(self.ready[visit.line], (visit.seq, visit))
+        self.admit_next(visit.line, now)
+
+    def on_deadline(self, visit, now):
+        if visit.state != WAITING:
+            return
+        deadline = self.deadline(visit)
+        if deadline > now + EPSILON:
+            self.push(deadline, self.on_deadline, visit)
+            return
+        visit.state = PRUNED
+        del self.lines[visit.line][visit.seq]
+        self.active -= 1
+        self.policy.removed(visit)
+
+    def on_checkout(self, visit, now):
+        visit.state = COMPLETED
+        self.active -= 1
+        self.busy_minutes += visit.service + PREP_MINUTES
+        self.last_checkout = now
+        self.policy.checked_out(self, visit, now)
+        self.push(now + PREP_MINUTES, self.on_room_ready, visit)
+
+    def on_room_ready(self, visit, now):
+        if self.policy.shared_line:
+            heapq.heappush(self.free_rooms, visit.room)
+        else:
+            self.busy[visit.room] = False
+        self.admit_next(visit.line, now)
+
+    def admit_next(self, line, now):
+        ready = self.ready[line]
+        if line is None:
+            while ready and self.free_rooms:
+                self.admit(heapq.heappop(ready)[1], heapq.heappop(self.free_rooms), now)
+        elif ready and not self.busy[line]:
+            self.admit(heapq.heappop(ready)[1], line, now)
+
+    def admit(self, visit, room, now):
+        visit.state = ADMITTED
+        visit.room = room
+        visit.admitted_at = now
+        del self.lines[visit.line][visit.seq]
+        if visit.line is not None:
+            self.busy[room] = True
+        self.policy.admitted(visit, now)
+        self.push(now + visit.service, self.on_checkout, visit)
+
+    def run(self):
+        for arrival in self.arrivals:
+            visit = Visit(arrival)
+            self.visits.append(visit)
+            self.push(arrival.at, self.on_join, visit)
+        events = self.events
+        while events:
+            now, _, handler, visit = heapq.heappop(events)
+            handler(visit, now)
+        return self.report()
+
+    def report(self):
+        waits = sorted(v.admitted_at - v.checked_in_at for v in self.visits if v.admitted_at is not None)
+        to_room = sorted(v.admitted_at - v.arrival for v in self.visits if v.admitted_at is not None)
+        late_vs_promise = sorted(v.admitted_at - v.promised for v in self.visits if v.admitted_at is not None)
+        pruned = [v for v in self.visits if v.state == PRUNED]
+        no_shows = sum(1 for v in pruned if v.no_show)
+        span = max(self.last_checkout, 1e-9)
+        return {
+            "policy": self.policy.name,
+            "rooms": self.rooms,
+            "arrivals": len(self.visits),
+            "seen": len(waits),
+            "mean_wait_minutes": round(sum(waits) / len(waits), 1) if waits else 0.0,
+            "p95_wait_minutes": round(percentile(waits, 0.95), 1),
+            "mean_join_to_room_minutes": round(sum(to_room) / len(to_room), 1) if to_room else 0.0,
+            "p95_join_to_room_minutes": round(percentile(to_room, 0.95), 1),
+            "p95_late_vs_promise_minutes": round(percentile(late_vs_promise, 0.95), 1),
+            "utilization": round(self.busy_minutes / (self.rooms * span), 3),
+            "no_shows_pruned": no_shows,
+            "late_pruned": len(pruned) - no_shows,
+            "lost_share": round(len(pruned) / len(self.visits), 3) if self.visits else 0.0,
+            "last_checkout_minutes": round(self.last_checkout, 1),
+        }
+
+
+def simulate(policy, arrivals, rooms):
+    """Run one day of arrivals under a policy (a name from POLICIES or a Policy). Returns the report."""
+    if isinstance(policy, str):
+        policy = make_policy(policy, rooms)
+    return Simulation(policy, rooms, arrivals).run()
@@ -0,0 +1,159 @@
+"""
+Filename: policies.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Scheduling policies the simulator compares, each a thin wrapper
+around the code it models.
+
+A policy books each joining patient: book() returns the room whose line they
+join (None for one line shared by every room) and the start time they are
+told. The simulator then calls admitted(), removed() and checked_out() as
+the visit moves on. Times are minutes after opening.
+"""
+
+from datetime import datetime, timedelta
+
+from estimator import DurationEstimator
+from q_system import PatientQueue
+from queue_logic import (
+    DURATION_EWMA_ALPHA, DURATION_MIN_SAMPLES, DURATION_QUANTILE, PULL_IN_LEAD_MINUTES,
+    checkout_delta_minutes, expected_duration_minutes_for, pull_in_shifts
+)
+from room_scheduler import RoomScheduler
+from scheduler import Scheduler
+
+# Any fixed date works; the legacy classes only need datetimes
+OPENING = datetime(2026, 1, 5, 8, 0)
+
+
+def to_minutes(when):
+    return (when - OPENING).total_seconds() / 60
+
+
+def to_datetime(minutes):
+    return OPENING + timedelta(minutes=minutes)
+
+
+class Policy:
+    name = None
+    shared_line = False
+
+    def book(self, visit, now):
+        raise NotImplementedError
+
+    def admitted(self, visit, now):
+        pass
+
+    def removed(self, visit):
+        pass
+
+    def checked_out(self, sim, visit, now):
+        pass
+
+
+class FixedSlots(Policy):
+    """Legacy Scheduler: every patient gets one fixed-length slot in the
+    earliest-free room, booked back to back from opening whatever the clock
+    says."""
+
+    name = "fixed-slots"
+
+    def __init__(self, rooms, slot_minutes=15):
+        self.scheduler = Scheduler(slot_seconds=slot_minutes * 60, start_time=OPENING, rooms=rooms)
+
+    def book(self, visit, now):
+        start = self.scheduler.schedule_patient(visit)
+        return self.scheduler.room_assignments[-1], to_minutes(start)
+
+
+class SingleQueue(Policy):
+    """Legacy PatientQueue: one line for every room, each place in it worth
+    slot_minutes / rooms. Patients keep the time they were given at join."""
+
+    name = "single-queue"
+    shared_line = True
+
+    def __init__(self, rooms, slot_minutes=15):
+        self.queue = PatientQueue(slot_seconds=slot_minutes * 60 / rooms, start_time=OPENING)
+
+    def book(self, visit, now):
+        if not self.queue.size():
+            # the line restarts from now once it has emptied
+            self.queue.start_time = to_datetime(now)
+        return None, to_minutes(self.queue.enqueue(visit))
+
+    def admitted(self, visit, now):
+        self.queue.remove_patient(visit)
+
+    def removed(self, visit):
+        self.queue.remove_patient(visit)
+
+
+class RoomBooking(Policy):
+    """The backend's booking: each patient takes the earliest-free room for
+    their reason's expected duration (reserve_pipeline), a checkout that runs
+    over pushes the room and its pending visits back (room_delay_pipeline),
+    and optionally one that finishes early pulls them in (pull_in_shifts).
+
+    learn books on durations learned at checkout (DurationEstimator) once a
+    reason has enough of them, as server.py does.
+    """
+
+    def __init__(self, rooms, learn=False, pull_in=False, lead_minutes=PULL_IN_LEAD_MINUTES):
+        self.name = "rooms" + ("-learned" if learn else "") + ("-pull-in" if pull_in else "")
+        self.rooms = RoomScheduler([{"room": r, "free_at": 0.0} for r in range(1, rooms + 1)], 0.0)
+        self.estimator = DurationEstimator(
+            alpha=DURATION_EWMA_ALPHA,
+            quantile=DURATION_QUANTILE,
+            min_samples=DURATION_MIN_SAMPLES
+        ) if learn else None
+        self.pull_in = pull_in
+        self.lead_minutes = lead_minutes
+
+    def book(self, visit, now):
+        visit.expected = expected_duration_minutes_for(visit.reason, self.estimator)
+        room, start, _end = self.rooms.assign(visit.expected, now)
+        return room, start
+
+    def checked_out(self, sim, visit, now):
+        if self.estimator is not None:
+            self.estimator.observe(visit.reason, visit.service)
+        room = visit.room
+        delta = checkout_delta_minutes({
+            "actual_duration_minutes": round(visit.service, 2),
+            "expected_duration_minutes": visit.expected
+        })
+        if delta > 0:
+            sim.shift_room(room, delta)
+            self.rooms.set_free_at(room, self.rooms.free_at[room] + delta)
+        elif delta < 0 and self.pull_in:
+            self._pull_in(sim, room, -delta, now, visit.admitted_at + visit.expected)
+
+    def _pull_in(self, sim, room, advance, now, last_end):
+        last = sim.last_pending(room)
+        if last is not None:
+            last_end = sim.start(last) + last.expected
+        moves = pull_in_shifts(sim.pending_docs(room), advance, to_datetime(now), self.lead_minutes)
+        for doc, minutes in moves:
+            sim.pull_in(doc["visit"], minutes, now)
+        if len(moves) < sim.pending_count(room):
+            return  # the room stays booked until the visits that could not move
+        minutes = moves[-1][1] if moves else advance
+        free_at = self.rooms.free_at[room]
+        # as in the backend, only while the room's free time is the end of its last booking
+        if abs(free_at - last_end) < 1e-6:
+            self.rooms.set_free_at(room, max(free_at - minutes, now))
+
+
+def make_policy(name, rooms):
+    """Policy by name, see POLICIES."""
+    if name == "fixed-slots":
+        return FixedSlots(rooms)
+    if name == "single-queue":
+        return SingleQueue(rooms)
+    if name.startswith("rooms"):
+        return RoomBooking(rooms, learn="-learned" in name, pull_in=name.endswith("-pull-in"))
+    raise ValueError(f"Unknown policy '{name}'")
+
+
+POLICIES = ("fixed-slots", "single-queue", "rooms", "rooms-learned", "rooms-pull-in")
@@ -0,0 +1,98 @@
+"""
+Filename: workload.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Seeded patient arrivals and visit durations for the simulator.
+
+Arrivals are a Poisson process whose rate follows a time-of-day profile
+(piecewise constant per hour), so inter-arrival gaps within an hour are
+exponential at that hour's rate. Each patient draws a visit reason from
+REASON_MIX, a lognormal visit duration around that reason's entry in the
+backend's estimate table, whether they will turn up at all, and how early
+they come in before the start time they were given.
+"""
+
+import math
+import random
+
+from queue_logic import PREP_MINUTES, REASON_ESTIMATE_MINUTES
+
+# Share of arrivals per hour after opening, 8am to 8pm: a morning peak,
+# a lunchtime dip and a smaller after-work peak
+HOURLY_PROFILE = (7, 10, 10, 9, 8, 6, 7, 8, 9, 10, 9, 7)
+
+# Share of visits per reason
+REASON_MIX = {
+    "Flu-like symptoms": 18,
+    "Minor laceration": 7,
+    "COVID-19 test": 12,
+    "Common infections (ear, pink eye)": 12,
+    "Sore throat / strep check": 14,
+    "Sprain/strain": 9,
+    "Rash or allergic reaction (mild)": 8,
+    "Urinary symptoms (possible UTI)": 10,
+    "Medication refill/quick consult": 10,
+}
+
+
+class Arrival:
+    """One patient of a simulated day. Times are minutes after opening."""
+
+    __slots__ = ("seq", "at", "reason", "service", "no_show", "early")
+
+    def __init__(self, seq, at, reason, service, no_show, early):
+        self.seq = seq
+        self.at = at  # joins the queue
+        self.reason = reason
+        self.service = service  # minutes in the room, admit to checkout
+        self.no_show = no_show  # never checks in
+        self.early = early  # comes in this many minutes before their start time
+
+
+def service_params(minutes, cv):
+    """(mu, sigma) of a lognormal with the given mean and coefficient of variation."""
+    sigma = math.sqrt(math.log(1 + cv * cv))
+    return math.log(minutes) - sigma * sigma / 2, sigma
+
+
+def generate_arrivals(seed, expected, profile=HOURLY_PROFILE, service_scale=1.0, service_cv=0.5,
+                      no_show_rate=0.08, early_mean=15.0, early_sd=5.0):
+    """One day of arrivals, in arrival order. The same seed gives the same day.
+
+    expected is the mean number of arrivals over the day. A visit's mean
+    duration (admit to checkout) is its reason's REASON_ESTIMATE_MINUTES
+    entry times service_scale (above 1 when visits run longer than the table
+    says). The room's PREP_MINUTES of turnover comes on top, see engine.py.
+    """
+    rng = random.Random(seed)
+    reasons = list(REASON_MIX)
+    weights = [REASON_MIX[r] for r in reasons]
+    params = {r: service_params(REASON_ESTIMATE_MINUTES[r] * service_scale, service_cv)
+              for r in reasons}
+    total = sum(profile)
+
+    arrivals = []
+    for hour, weight in enumerate(profile):
+        rate = expected * weight / total / 60  # per minute
+        if rate <= 0:
+            continue
+        t = hour * 60 + rng.expovariate(rate)
+        while t < (hour + 1) * 60:
+            reason = rng.choices(reasons, weights)[0]
+            mu, sigma = params[reason]
+            arrivals.append(Arrival(
+                len(arrivals),
+                t,
+                reason,
+                rng.lognormvariate(mu, sigma),
+                rng.random() < no_show_rate,
+                max(0.0, rng.gauss(early_mean, early_sd))
+            ))
+            t += rng.expovariate(rate)
+    return arrivals
+
+
+def rooms_for(arrivals, day_minutes, utilization=0.85):
+    """Rooms needed to keep them busy utilization of the day with these arrivals."""
+    work = sum(a.service + PREP_MINUTES for a in arrivals if not a.no_show)
+    return max(1, math.ceil(work / (day_minutes * utilization)))
@@ -0,0 +1,87 @@
+"""
+Filename: deadline_index.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Upcoming check-in deadlines, so the no-show pruner can sleep
+until the next one is due.
+"""
+
+from datetime import datetime
+import heapq
+import threading
+import time
+
+
+class DeadlineIndex:
+    """Min-heap of upcoming deadlines guarded by a condition variable.
+
+    wait() blocks until the earliest deadline has passed, a timeout expires or
+    wake() is called. add() wakes a waiter early when the new deadline becomes
+    the earliest one. Entries are only hints: the pruner re-checks every
+    visit against Mongo, so a deadline that was moved or a visit that checked
+    in since is harmless and simply popped once due.
+    """
+
+    def __init__(self, clock=datetime.now):
+        self.clock = clock
+        self._heap = []
+        self._woken = False
+        self.cond = threading.Condition()
+
+    def add(self, deadline):
+        """Track deadline. Returns True if it is now the earliest one.
+
+        A deadline already due is not armed, so nothing is pruned the moment
+        its deadline is set. The pruner's next look at Mongo (at most
+        PRUNE_INTERVAL_SECONDS away) still removes such a visit.
+        """
+        if deadline is None or deadline <= self.clock():
+            return False
+        with self.cond:
+            earliest = not self._heap or deadline < self._heap[0]
+            heapq.heappush(self._heap, deadline)
+            if earliest:
+                self.cond.notify_all()
+            return earliest
+
+    def next_deadline(self):
+        with self.cond:
+            return self._heap[0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """Remove and return every deadline at or before now, earliest first."""
+        now = self.clock() if now is None else now
+        due = []
+        with self.cond:
+            while self._heap and self._heap[0] <= now:
+                due.append(heapq.heappop(self._heap))
+        return due
+
+    def wait(self, timeout):
+        """Block until a deadline is due, timeout seconds pass or wake() is called.
+
+        Returns True if a deadline is due.
+        """
+        give_up = time.monotonic() + timeout
+        with self.cond:
+            while not self._woken:
+                remaining = give_up - time.monotonic()
+                if self._heap:
+                    until = (self._heap[0] - self.clock()).total_seconds()
+                    if until <= 0:
+                        return True
+                    remaining = min(remaining, until)
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            self._woken = False
+            return False
+
+    def wake(self):
+        """Release the current (or next) wait without a due deadline, e.g. on shutdown."""
+        with self.cond:
+            self._woken = True
+            self.cond.notify_all()
+
+    def size(self):
+        return len(self._heap)
@@ -0,0 +1,193 @@
+"""
+Filename: estimator.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Online visit duration estimates per visit reason, learned from
+the durations measured at checkout.
+"""
+
+import threading
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile with the P-square algorithm
+    (Jain & Chlamtac, 1985).
+
+    Keeps five markers whose heights approximate the minimum, the p/2, p and
+    (1+p)/2 quantiles and the maximum, adjusted by piecewise-parabolic
+    interpolation as values arrive. O(1) time and memory per update, no
+    samples are stored.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []  # the first five values until the markers are set up
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+        self.count = 0
+
+    def add(self, x):
+        self.count += 1
+        h = self.heights
+        if len(h) < 5:
+            h.append(x)
+            h.sort()
+            return
+
+        # find the cell x falls in, extending the extremes if needed
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= h[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # move the three middle markers towards their desired positions
+        n = self.positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not h[i - 1] < height < h[i + 1]:
+                    height = h[i] + step * (h[i + step] - h[i]) / (n[i + step] - n[i])
+                h[i] = height
+                n[i] += step
+
+    def _parabolic(self, i, d):
+        h, n = self.heights, self.positions
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            # exact quantile of the few values seen so far
+            return self.heights[min(len(self.heights) - 1, int(self.p * len(self.heights)))]
+        return self.heights[2]
+
+    def to_dict(self):
+        return {"p": self.p, "count": self.count, "heights": list(self.heights),
+                "positions": list(self.positions), "desired": list(self.desired)}
+
+    @classmethod
+    def from_dict(cls, data):
+        q = cls(data["p"])
+        q.count = data.get("count", 0)
+        q.heights = list(data.get("heights", []))
+        q.positions = list(data.get("positions", q.positions))
+        q.desired = list(data.get("desired", q.desired))
+        return q
+
+
+class ReasonStats:
+    """Duration statistics of one visit reason: count, EWMA and a few quantiles."""
+
+    def __init__(self, alpha, quantiles):
+        self.alpha = alpha
+        self.count = 0
+        self.ewma = None
+        self.quantiles = {q: P2Quantile(q) for q in quantiles}
+
+    def add(self, minutes):
+        self.count += 1
+        self.ewma = minutes if self.ewma is None else self.ewma + self.alpha * (minutes - self.ewma)
+        for sketch in self.quantiles.values():
+            sketch.add(minutes)
+
+    def quantile(self, q):
+        sketch = self.quantiles.get(q)
+        return sketch.value() if sketch is not None else None
+
+    def to_dict(self):
+        return {"count": self.count, "ewma": self.ewma,
+                "quantiles": [s.to_dict() for s in self.quantiles.values()]}
+
+    @classmethod
+    def from_dict(cls, data, alpha):
+        stats = cls(alpha, [])
+        stats.count = data.get("count", 0)
+        stats.ewma = data.get("ewma")
+        for q in data.get("quantiles", []):
+            stats.quantiles[q["p"]] = P2Quantile.from_dict(q)
+        return stats
+
+
+class DurationEstimator:
+    """Per-reason visit duration estimates for one clinic.
+
+    observe() folds in a measured duration and estimate() reads the current
+    estimate, both in O(1) regardless of how many visits were seen. The
+    estimate is the EWMA of the durations, or a tracked quantile if quantile
+    is set (e.g. 0.9 to book rooms for the slow end). Reasons with fewer than
+    min_samples observations return None so the caller keeps its default.
+
+    Reasons whose statistics changed since the last mark_saved() are listed by
+    dirty(), so they can be persisted periodically.
+    """
+
+    def __init__(self, alpha=0.2, quantiles=(0.5, 0.9), quantile=None, min_samples=5):
+        self.alpha = alpha
+        self.quantile = quantile
+        self.quantiles = tuple(sorted(set(quantiles) | ({quantile} if quantile is not None else set())))
+        self.min_samples = min_samples
+        self.stats = {}  # reason -> ReasonStats
+        self._dirty = set()
+        self.lock = threading.Lock()
+
+    def observe(self, reason, minutes):
+        if not minutes or minutes < 0:
+            return  # no admitted_at, nothing was measured
+        with self.lock:
+            stats = self.stats.get(reason)
+            if stats is None:
+                stats = self.stats[reason] = ReasonStats(self.alpha, self.quantiles)
+            stats.add(minutes)
+            self._dirty.add(reason)
+
+    def estimate(self, reason):
+        """Estimated duration in minutes, or None if reason has too few samples."""
+        with self.lock:
+            stats = self.stats.get(reason)
+            if stats is None or stats.count < self.min_samples:
+                return None
+            if self.quantile is not None:
+                return stats.quantile(self.quantile)
+            return stats.ewma
+
+    def summary(self):
+        """{reason: {count, ewma, p50, p90, ...}} for reporting."""
+        with self.lock:
+            return {reason: dict(
+                {"count": s.count, "ewma": s.ewma},
+                **{f"p{round(q * 100):d}": s.quantile(q) for q in sorted(s.quantiles)}
+            ) for reason, s in self.stats.items()}
+
+    def dirty(self):
+        """(reason, serialized stats) of every reason changed since the last save."""
+        with self.lock:
+            return [(reason, self.stats[reason].to_dict()) for reason in self._dirty]
+
+    def mark_saved(self, reasons):
+        with self.lock:
+            self._dirty.difference_update(reasons)
+
+    def load(self, reason, data):
+        """Restore a reason's statistics saved from dirty()."""
+        with self.lock:
+            stats = ReasonStats.from_dict(data, self.alpha)
+            for q in self.quantiles:
+                stats.quantiles.setdefault(q, P2Quantile(q))
+            self.stats[reason] = stats
@@ -0,0 +1,70 @@
+"""
+Filename: fenwick.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Fenwick (binary indexed) tree for prefix sums and order statistics.
+"""
+
+from itertools import accumulate
+
+
+class FenwickTree:
+    """Prefix sums over a fixed number of slots with O(log n) point updates.
+
+    Slots are 0-based. Values only need to support + and -, so counts,
+    minutes and timedeltas (with a matching zero) all work.
+    """
+
+    def __init__(self, size, zero=0):
+        self.size = size
+        self.zero = zero
+        self.tree = [zero] * (size + 1)
+
+    @classmethod
+    def from_values(cls, values, zero=0):
+        """Build a tree over values in O(n)."""
+        fw = cls(0, zero)
+        fw.size = len(values)
+        # tree[i] holds the sum of the lowbit(i) slots ending at slot i - 1
+        sums = [zero]
+        sums.extend(accumulate(values))
+        fw.tree = [zero] + [sums[i] - sums[i - (i & -i)] for i in range(1, fw.size + 1)]
+        return fw
+
+    def add(self, index, delta):
+        i = index + 1
+        tree = self.tree
+        while i <= self.size:
+            tree[i] = tree[i] + delta
+            i += i & -i
+
+    def prefix_sum(self, count):
+        """Sum of the first count slots, i.e. slots [0, count)."""
+        total = self.zero
+        i = count
+        tree = self.tree
+        while i > 0:
+            total = total + tree[i]
+            i -= i & -i
+        return total
+
+    def total(self):
+        return self.prefix_sum(self.size)
+
+    def find_kth(self, k):
+        """Index of the slot holding the k-th unit (0-based), for non-negative integer values.
+
+        With 0/1 values this is the index of the k-th occupied slot.
+        Returns size if k is out of range.
+        """
+        pos = 0
+        remaining = k + 1
+        step = 1 << self.size.bit_length()
+        tree = self.tree
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and tree[nxt] < remaining:
+                pos = nxt
+                remaining -= tree[nxt]
+            step >>= 1
+        return pos
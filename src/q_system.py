@@ -1,84 +1,286 @@
 """
 Filename: q_system.py
 Author: Kush Parmar
-Last Update: 30 November 2025
+Last Update: 18 October 2026
 Description: Legacy UrgentCareQ system.
 """
 
 from datetime import timedelta
+from fenwick import FenwickTree
+
+
+class _Node:
+    __slots__ = ("patient", "seq", "prev", "next")
+
+    def __init__(self, patient, seq):
+        self.patient = patient
+        self.seq = seq
+        self.prev = None
+        self.next = None
+
 
 class PatientQueue:
+    """Patients in arrival order.
+
+    Backed by a doubly linked list plus a patient -> node map, so enqueue,
+    dequeue and removal by patient are O(1). Positional access is O(log n)
+    through a Fenwick tree of occupied slots. Each node gets an increasing
+    sequence number that maps onto a ring of slots, so FIFO traffic never
+    renumbers. List changes are queued as pending slot updates and folded into
+    the tree on the next positional call.
+
+    A patient's scheduled time is start_time + (served + index) slots, where
+    served counts patients dequeued since the queue was last empty. Removing a
+    patient therefore moves everyone behind them up a slot without touching
+    them; the new time is written to patient.visit.scheduled_time whenever the
+    patient is read back through the queue (peek, dequeue, get_patient_at,
+    find_patient_by_name, get_all_patients, get_scheduled_times).
+    """
+
+    _MIN_SLOTS = 16
+
     def __init__(self, slot_seconds=900, start_time=None):
         self.slot_seconds = slot_seconds
         self.start_time = start_time
-        self.patients = []  # renamed from queue to patients for clarity
         self.current_time = start_time
+        self._head = None
+        self._tail = None
+        self._count = 0
+        self._nodes = {}  # patient -> node
+        # full name -> {patient: None} in queue order.
+        # Names are indexed at enqueue time and assumed not to change while queued.
+        self._by_name = {}
+        # ring of slots for positional access, indexed by seq & (capacity - 1)
+        self._slot_nodes = [None] * self._MIN_SLOTS
+        self._slots = FenwickTree(self._MIN_SLOTS)
+        self._slots_valid = True
+        self._pending = []  # (slot, +1/-1) not yet applied to self._slots
+        self._next_seq = 0
+        self._served = 0  # dequeued since the queue was last empty
+
+    @property
+    def patients(self):
+        # renamed from queue to patients for clarity; now a snapshot, O(n)
+        return self.get_all_patients()
+
+    def _iter_nodes(self):
+        node = self._head
+        while node is not None:
+            yield node
+            node = node.next
 
     def enqueue(self, patient):
+        if patient in self._nodes:
+            raise ValueError("patient is already queued")
         scheduled_time = self.get_next_available_time()
         patient.visit.scheduled_time = scheduled_time
-        self.patients.append(patient)
+
+        capacity = len(self._slot_nodes)
+        if self._head is not None and self._next_seq - self._head.seq >= capacity:
+            self._resize_slots()
+        node = _Node(patient, self._next_seq)
+        self._next_seq += 1
+        slot = node.seq & (len(self._slot_nodes) - 1)
+        self._slot_nodes[slot] = node
+        self._record(slot, 1)
+
+        node.prev = self._tail
+        if self._tail is None:
+            self._head = node
+        else:
+            self._tail.next = node
+        self._tail = node
+        self._nodes[patient] = node
+        self._count += 1
+        self._by_name.setdefault(patient.full_name(), {})[patient] = None
         return scheduled_time
 
-    def get_next_available_time(self):
-        if not self.patients:
-            return self.start_time
+    def _unlink(self, node):
+        if node.prev is None:
+            self._head = node.next
+        else:
+            node.prev.next = node.next
+        if node.next is None:
+            self._tail = node.prev
         else:
-            last_patient_time = self.patients[-1].visit.scheduled_time
-            return last_patient_time + timedelta(seconds=self.slot_seconds)
+            node.next.prev = node.prev
+        node.prev = node.next = None
+
+        patient = node.patient
+        del self._nodes[patient]
+        slot = node.seq & (len(self._slot_nodes) - 1)
+        self._slot_nodes[slot] = None
+        self._record(slot, -1)
+        self._count -= 1
+        if self._count == 0:
+            self._served = 0
+
+        name = patient.full_name()
+        same_name = self._by_name.get(name)
+        if same_name is not None:
+            same_name.pop(patient, None)
+            if not same_name:
+                del self._by_name[name]
+        return patient
+
+    def _record(self, slot, delta):
+        if not self._slots_valid:
+            return
+        self._pending.append((slot, delta))
+        # past this point a rebuild is cheaper than replaying the changes
+        if len(self._pending) > len(self._slot_nodes):
+            self._slots_valid = False
+            self._pending = []
+
+    def _resize_slots(self):
+        """Renumber live nodes onto a ring sized for the current queue.
+
+        Only needed when the oldest queued patient is a full ring behind the
+        newest, which takes at least capacity / 2 enqueues after the previous
+        resize, so the O(n) walk is amortized O(1) per enqueue.
+        """
+        capacity = self._MIN_SLOTS
+        while capacity < 2 * (self._count + 1):
+            capacity *= 2
+        self._slot_nodes = [None] * capacity
+        seq = 0
+        for node in self._iter_nodes():
+            node.seq = seq
+            self._slot_nodes[seq] = node
+            seq += 1
+        self._next_seq = seq
+        self._slots_valid = False
+        self._pending = []
+
+    def _flush(self):
+        if not self._slots_valid:
+            self._slots = FenwickTree.from_values([0 if n is None else 1 for n in self._slot_nodes])
+            self._slots_valid = True
+            return
+        for slot, delta in self._pending:
+            self._slots.add(slot, delta)
+        self._pending = []
+
+    def _node_at(self, index):
+        if not 0 <= index < self._count:
+            return None
+        if index == 0:
+            return self._head
+        if index == self._count - 1:
+            return self._tail
+        self._flush()
+        # slots at or after the head's come first in queue order, then the wrapped ones
+        head_slot = self._head.seq & (len(self._slot_nodes) - 1)
+        wrapped = self._slots.prefix_sum(head_slot)
+        unwrapped = self._count - wrapped
+        if index < unwrapped:
+            slot = self._slots.find_kth(wrapped + index)
+        else:
+            slot = self._slots.find_kth(index - unwrapped)
+        return self._slot_nodes[slot]
+
+    def _index_of(self, node):
+        if node is self._head:
+            return 0
+        if node is self._tail:
+            return self._count - 1
+        self._flush()
+        mask = len(self._slot_nodes) - 1
+        head_slot = self._head.seq & mask
+        slot = node.seq & mask
+        if slot >= head_slot:
+            return self._slots.prefix_sum(slot) - self._slots.prefix_sum(head_slot)
+        wrapped = self._slots.prefix_sum(head_slot)
+        return self._count - wrapped + self._slots.prefix_sum(slot)
+
+    def _scheduled_time(self, index):
+        if self.start_time is None:
+            return None
+        return self.start_time + timedelta(seconds=self.slot_seconds * (self._served + index))
+
+    def _materialize(self, node, index=None):
+        if index is None:
+            index = self._index_of(node)
+        node.patient.visit.scheduled_time = self._scheduled_time(index)
+        return node.patient
+
+    def get_next_available_time(self):
+        return self._scheduled_time(self._count)
 
     def peek(self):
-        return self.patients[0] if self.patients else None
+        return self._materialize(self._head, 0) if self._head is not None else None
 
     def size(self):
-        return len(self.patients)
+        return self._count
 
     def dequeue(self):
-        return self.patients.pop(0) if self.patients else None
+        if self._head is None:
+            return None
+        patient = self._materialize(self._head, 0)
+        self._unlink(self._head)
+        if self._count:
+            self._served += 1
+        return patient
 
     def advance_time(self):
         if self.current_time:
             self.current_time += timedelta(seconds=self.slot_seconds)
 
     def get_scheduled_times(self):
-        return [(patient.full_name(), patient.visit.scheduled_time) for patient in self.patients]
+        return [(patient.full_name(), patient.visit.scheduled_time) for patient in self.get_all_patients()]
 
     def get_all_patients(self):
-        return list(self.patients)
+        return [self._materialize(node, i) for i, node in enumerate(self._iter_nodes())]
+
+    def get_patient_at(self, index):
+        """Return the patient at the given queue index, or None if the index is invalid. O(log n)."""
+        node = self._node_at(index)
+        return self._materialize(node, index) if node is not None else None
 
     # New: Find and return a patient by name
     def find_patient_by_name(self, full_name):
         """Find and return the first patient matching the full name. Returns None if not found."""
-        for patient in self.patients:
-            if patient.full_name() == full_name:
-                return patient
-        return None
+        same_name = self._by_name.get(full_name)
+        if not same_name:
+            return None
+        return self._materialize(self._nodes[next(iter(same_name))])
+
 
     # New: Remove a specific patient by object reference
     def remove_patient(self, patient):
         """Remove a specific patient from the schedule. Returns True if removed, False if not found."""
-        if patient in self.patients:
-            self.patients.remove(patient)
-            return True
-        return False
+        node = self._nodes.get(patient)
+        if node is None:
+            return False
+        self._unlink(node)
+        return True
 
     # New: Remove patient by full name
     def remove_patient_by_name(self, full_name):
         """Remove the first patient matching the full name. Returns True if removed, False if not found."""
-        for patient in self.patients:
-            if patient.full_name() == full_name:
-                self.patients.remove(patient)
-                return True
-        return False
+        patient = self.find_patient_by_name(full_name)
+        if patient is None:
+            return False
+        return self.remove_patient(patient)
 
     # New: Remove patient at a specific index
     def remove_at_index(self, index):
         """Remove patient at the given index. Returns the removed patient or None if index is invalid."""
-        if 0 <= index < len(self.patients):
-            return self.patients.pop(index)
-        return None
+        node = self._node_at(index)
+        if node is None:
+            return None
+        return self._unlink(node)
 
     # New: Clear all patients from schedule
     def clear_schedule(self):
         """Remove all patients from the schedule."""
-        self.patients.clear()
\ No newline at end of file
+        self._head = self._tail = None
+        self._count = 0
+        self._nodes.clear()
+        self._by_name.clear()
+        self._slot_nodes = [None] * self._MIN_SLOTS
+        self._slots = FenwickTree(self._MIN_SLOTS)
+        self._slots_valid = True
+        self._pending = []
+        self._next_seq = 0
+        self._served = 0
@@ -0,0 +1,180 @@
+"""
+Filename: queue_cache.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: In-process, write-through cache of the live queue state.
+"""
+
+import threading
+import time
+
+
+class QueueCache:
+    """Live visits of one queue in position order, tagged with the version
+    counter stored on the queue document.
+
+    Writers persist to Mongo first and then apply the documents their write
+    returned, together with the version that write produced. A gap in the
+    version sequence means another worker wrote in between, so the cache drops
+    its state and is reloaded on the next read.
+    """
+
+    def __init__(self, queue_id, active_statuses):
+        self.queue_id = queue_id
+        self.active_statuses = set(active_statuses)
+        self.version = None  # None until loaded, or after an invalidation
+        self.meta = {}  # queue-level fields (start_time, room_free_at, ...)
+        self.visits = {}  # visit _id -> visit document, in position order
+        self.max_position = -1
+        # name_normalized -> dob -> {visit _id: visit}
+        self.by_name = {}
+        self.checked_at = 0.0
+        self.settled = True  # False if loaded while a write was still landing
+        self.lock = threading.RLock()
+        # pre-serialized snapshot and the version it was rendered at
+        self._serialized = None
+        self._serialized_version = None
+
+    def is_loaded(self):
+        return self.version is not None
+
+    def needs_check(self, max_age):
+        """True if the cache is empty or has not been validated for max_age seconds."""
+        return self.version is None or not self.settled or time.monotonic() - self.checked_at >= max_age
+
+    def load(self, qdoc, visits, settled=True):
+        """Replace the cached state with a fresh read of the queue document and its active visits.
+
+        settled=False means the read may be missing a write that already moved
+        the version; the state is served but reloaded on the next check.
+        """
+        with self.lock:
+            self.meta = dict(qdoc)
+            self.visits = {}
+            self.by_name = {}
+            self.max_position = -1
+            for visit in sorted(visits, key=lambda v: v.get("position", 0)):
+                self.visits[visit["_id"]] = visit
+                self._index(visit)
+                self.max_position = visit.get("position", 0)
+            self.version = qdoc.get("version", 0)
+            self.settled = settled
+            self._serialized_version = None
+            self.checked_at = time.monotonic()
+
+    def confirm(self, version):
+        """Compare against the stored version. Returns True if the cache is still current."""
+        with self.lock:
+            if self.version is not None and self.settled and version == self.version:
+                self.checked_at = time.monotonic()
+                return True
+            self.invalidate()
+            return False
+
+    def expire(self):
+        """Keep the state but check the version against Mongo on the next read."""
+        with self.lock:
+            self.checked_at = 0.0
+
+    def invalidate(self):
+        with self.lock:
+            self.version = None
+
+    def apply(self, version, visit=None, meta=None, removed=(), shift=None, visits=()):
+        """Apply one persisted change. Returns False (and invalidates) if a change was missed.
+
+        visits holds further visit documents written by the same change (batch joins).
+
+        shift is an optional (delta, statuses, fields[, room]) tuple: every
+        cached visit in one of statuses (and assigned to room, if given) has
+        the given time fields moved by delta.
+        """
+        with self.lock:
+            if self.version is None or version != self.version + 1:
+                self.invalidate()
+                return False
+            self.version = version
+            if meta is not None:
+                self.meta = dict(meta)
+            for changed in ([visit] if visit is not None else []) + list(visits):
+                if changed.get("status") in self.active_statuses:
+                    self._put(changed)
+                else:
+                    self._remove(changed["_id"])
+            for visit_id in removed:
+                self._remove(visit_id)
+            if shift is not None:
+                self._shift(*shift)
+            return True
+
+    def _put(self, visit):
+        position = visit.get("position", 0)
+        known = visit["_id"] in self.visits
+        self.visits[visit["_id"]] = visit
+        self._index(visit)
+        if known:
+            return
+        if position >= self.max_position:
+            self.max_position = position
+            return
+        # joins normally arrive in position order; re-sort only when writes
+        # from this process landed out of order
+        self.visits = dict(sorted(self.visits.items(), key=lambda kv: kv[1].get("position", 0)))
+
+    def snapshot(self):
+        """Return (queue metadata, active visits in order) as copies safe to read without the lock."""
+        with self.lock:
+            return dict(self.meta), list(self.visits.values())
+
+    def _index(self, visit):
+        by_dob = self.by_name.setdefault(visit.get("name_normalized", ""), {})
+        by_dob.setdefault(visit.get("dob", ""), {})[visit["_id"]] = visit
+
+    def _remove(self, visit_id):
+        visit = self.visits.pop(visit_id, None)
+        if visit is None:
+            return
+        name = visit.get("name_normalized", "")
+        dob = visit.get("dob", "")
+        by_dob = self.by_name.get(name, {})
+        same = by_dob.get(dob, {})
+        same.pop(visit_id, None)
+        if not same:
+            by_dob.pop(dob, None)
+            if not by_dob:
+                self.by_name.pop(name, None)
+
+    def _shift(self, delta, statuses, fields, room=None):
+        for visit in self.visits.values():
+            if visit.get("status") in statuses and (room is None or visit.get("room") == room):
+                for field in fields:
+                    if visit.get(field) is not None:
+                        visit[field] = visit[field] + delta
+
+    def find_by_name(self, name_normalized, dob=None):
+        """Active visits with this normalized name (and DOB, if given), in position order."""
+        with self.lock:
+            by_dob = self.by_name.get(name_normalized)
+            if not by_dob:
+                return []
+            if dob is None:
+                found = [v for same in by_dob.values() for v in same.values()]
+            else:
+                found = list(by_dob.get(dob, {}).values())
+        return sorted(found, key=lambda v: v.get("position", 0))
+
+    def serialized(self, render):
+        """Return (version, render(meta, visits)), rendering at most once per version.
+
+        render is expected to return bytes ready to be sent as-is.
+        """
+        with self.lock:
+            if self.version is None:
+                return None, None
+            if self._serialized_version != self.version:
+                self._serialized = render(dict(self.meta), list(self.visits.values()))
+                self._serialized_version = self.version
+            return self.version, self._serialized
+
+    def size(self):
+        return len(self.visits)
@@ -0,0 +1,140 @@
+"""
+Filename: queue_events.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Fan-out of queue change events to live subscribers (SSE).
+"""
+
+import asyncio
+from collections import deque
+import threading
+
+
+class Subscriber:
+    """One listener's bounded event buffer.
+
+    A slow listener never blocks publishers: when its buffer is full the
+    pending events are dropped and the listener is told to resync from a
+    full snapshot instead.
+    """
+
+    def __init__(self, queue_id, buffer_size):
+        self.queue_id = queue_id
+        self.buffer_size = buffer_size
+        self.events = deque()
+        self.overflowed = False
+        self.closed = False  # set on shutdown, the listener should disconnect
+        self.cond = threading.Condition()
+
+    def push(self, event):
+        with self.cond:
+            if len(self.events) >= self.buffer_size:
+                self.events.clear()
+                self.overflowed = True
+            else:
+                self.events.append(event)
+            self.cond.notify()
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds for events.
+
+        Returns (overflowed, events). When overflowed is True the events were
+        dropped and the caller should send a snapshot instead.
+        """
+        with self.cond:
+            if not self.events and not self.overflowed and not self.closed:
+                self.cond.wait(timeout)
+            overflowed, self.overflowed = self.overflowed, False
+            events = list(self.events)
+            self.events.clear()
+            return overflowed, events
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+
+class AsyncSubscriber:
+    """Subscriber for listeners running on an asyncio event loop.
+
+    Same buffering as Subscriber, but drain() is awaited instead of blocking a
+    thread. push() and close() must be called from the loop's thread.
+    """
+
+    def __init__(self, queue_id, buffer_size):
+        self.queue_id = queue_id
+        self.buffer_size = buffer_size
+        self.events = deque()
+        self.overflowed = False
+        self.closed = False
+        self._ready = asyncio.Event()
+
+    def push(self, event):
+        if len(self.events) >= self.buffer_size:
+            self.events.clear()
+            self.overflowed = True
+        else:
+            self.events.append(event)
+        self._ready.set()
+
+    async def drain(self, timeout):
+        """Wait up to timeout seconds for events. Returns (overflowed, events)."""
+        if not self.events and not self.overflowed and not self.closed:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._ready.clear()
+        overflowed, self.overflowed = self.overflowed, False
+        events = list(self.events)
+        self.events.clear()
+        return overflowed, events
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+
+class QueueEventBroker:
+    def __init__(self, buffer_size=256, subscriber_class=Subscriber):
+        self.buffer_size = buffer_size
+        self.subscriber_class = subscriber_class
+        self.subscribers = {}  # queue_id -> set of Subscriber
+        self.lock = threading.Lock()
+
+    def subscribe(self, queue_id, limit=None):
+        """Add a subscriber, or return None if `limit` subscribers are already open."""
+        sub = self.subscriber_class(queue_id, self.buffer_size)
+        with self.lock:
+            if limit is not None and sum(len(subs) for subs in self.subscribers.values()) >= limit:
+                return None
+            self.subscribers.setdefault(queue_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            subs = self.subscribers.get(sub.queue_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self.subscribers[sub.queue_id]
+
+    def publish(self, queue_id, event):
+        with self.lock:
+            subs = list(self.subscribers.get(queue_id, ()))
+        for sub in subs:
+            sub.push(event)
+
+    def subscriber_count(self, queue_id=None):
+        with self.lock:
+            if queue_id is not None:
+                return len(self.subscribers.get(queue_id, ()))
+            return sum(len(subs) for subs in self.subscribers.values())
+
+    def close(self):
+        """Wake every subscriber and tell it to disconnect (server shutdown)."""
+        with self.lock:
+            subs = [sub for subs in self.subscribers.values() for sub in subs]
+        for sub in subs:
+            sub.close()
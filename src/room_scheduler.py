@@ -0,0 +1,67 @@
+"""
+Filename: room_scheduler.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: Assigns patients to the earliest-free exam room.
+"""
+
+import heapq
+
+
+class RoomScheduler:
+    """Exam rooms ordered by the time each one becomes free.
+
+    A min-heap of (free_at, room) keeps the earliest-free room on top, so
+    assigning a patient is O(log rooms). Ties go to the lowest room number.
+    Moving a room's free time out of turn (e.g. a checkout running late)
+    pushes a fresh entry and leaves the old one behind; stale entries are
+    skipped when they reach the top.
+
+    Free times at or before now mean the room is free now, same as a None
+    room_free_at on the queue document.
+    """
+
+    def __init__(self, rooms, now):
+        """rooms is an iterable of {"room": id, "free_at": datetime or None}."""
+        self.free_at = {}  # room -> datetime
+        for entry in rooms:
+            free_at = entry.get("free_at")
+            self.free_at[entry["room"]] = now if free_at is None or free_at < now else free_at
+        self._heap = [(free_at, room) for room, free_at in self.free_at.items()]
+        heapq.heapify(self._heap)
+
+    def _top(self):
+        heap = self._heap
+        while heap and self.free_at.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def next_free(self, now=None):
+        """Return (room, start) for the room that frees up first, without assigning it."""
+        top = self._top()
+        if top is None:
+            return None, now
+        free_at, room = top
+        return room, free_at if now is None or free_at > now else now
+
+    def assign(self, duration, now):
+        """Book the earliest-free room for duration. Returns (room, start, end)."""
+        room, start = self.next_free(now)
+        if room is None:
+            raise ValueError("no rooms configured")
+        end = start + duration
+        self.free_at[room] = end
+        heapq.heapreplace(self._heap, (end, room))
+        return room, start, end
+
+    def set_free_at(self, room, free_at):
+        """Move one room's free time, e.g. after a late checkout."""
+        self.free_at[room] = free_at
+        heapq.heappush(self._heap, (free_at, room))
+
+    def to_list(self):
+        """Rooms in room order, in the shape stored on the queue document."""
+        return [{"room": room, "free_at": self.free_at[room]} for room in sorted(self.free_at)]
+
+    def size(self):
+        return len(self.free_at)
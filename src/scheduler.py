@@ -1,21 +1,26 @@
 """
 Filename: scheduler.py
 Author: Kush Parmar
-Last Update: 30 November 2025
+Last Update: 18 October 2026
 Description: Legacy scheduling system in UrgentCareQ.
 """
 
 from datetime import datetime, timedelta
+from room_scheduler import RoomScheduler
 
 class Scheduler:
-    def __init__(self, slot_seconds=900, start_time=None):
+    def __init__(self, slot_seconds=900, start_time=None, rooms=1):
         self.slot_seconds = slot_seconds
         self.start_time = start_time if start_time else datetime.now()
         self.schedule = []
+        # each patient takes one slot in whichever room frees up first
+        self.rooms = RoomScheduler([{"room": r, "free_at": self.start_time} for r in range(1, rooms + 1)], self.start_time)
+        self.room_assignments = []  # room per schedule entry
 
     def schedule_patient(self, patient):
-        scheduled_time = self.start_time + timedelta(seconds=len(self.schedule) * self.slot_seconds)
+        room, scheduled_time, _ = self.rooms.assign(timedelta(seconds=self.slot_seconds), self.start_time)
         self.schedule.append((patient, scheduled_time))
+        self.room_assignments.append(room)
         return scheduled_time
 
     def get_schedule(self):
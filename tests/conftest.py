@@ -0,0 +1,28 @@
+"""
+Filename: conftest.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: pytest setup: puts backend/ and src/ on the import path and
+teaches mongomock the update pipelines the backend uses (see
+bench/mongomock_shim.py). Needs mongomock.
+"""
+
+from pathlib import Path
+import sys
+
+import mongomock
+import pytest
+
+_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(_root / "backend"))
+sys.path.append(str(_root / "src"))
+sys.path.append(str(_root / "bench"))
+
+import mongomock_shim  # noqa: E402
+
+mongomock_shim.install()
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().urgentcare
@@ -0,0 +1,177 @@
+"""
+Filename: test_checkout.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: A late checkout must shift every visit booked against the
+room's old free time, including joins that land while it is running.
+"""
+
+from datetime import datetime, timedelta
+
+import database
+import queue_logic
+from queue_logic import (
+    PREP_MINUTES, checkout_update, reserve_and_insert, reserve_pipeline, reserved_visits,
+    reset_queue, settle_checkout, transition_visit,
+)
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+
+def run_with(steps, db, before):
+    """database.run_steps, calling before(op) ahead of each Mongo call."""
+    advance, value = steps.send, None
+    while True:
+        try:
+            op = advance(value)
+        except StopIteration as done:
+            return done.value
+        before(op)
+        if op.collection is None:
+            value = None
+        else:
+            value = getattr(db[op.collection], op.method)(*op.args, **op.kwargs)
+            if op.method == "find":
+                value = list(value)
+
+
+def join(db, name, minutes=20):
+    now = datetime.now()
+    _, patients, _ = database.run_steps(reserve_and_insert("main", [{"patient_name": name}], [minutes], now), db)
+    return patients[0]
+
+
+def overrun(db, name, minutes):
+    """Admit name and check them out minutes past their expected duration."""
+    visit = db.visits.find_one({"name": name})
+    admitted_at = datetime.now() - timedelta(minutes=visit["expected_duration_minutes"] - PREP_MINUTES + minutes)
+    db.visits.update_one({"_id": visit["_id"]}, {"$set": {"status": "admitted", "admitted_at": admitted_at}})
+    return database.run_steps(transition_visit({"_id": visit["_id"]}, "admitted", checkout_update(datetime.now())), db)
+
+
+def times(db, name):
+    visit = db.visits.find_one({"name": name})
+    return visit["expected_start_time"], visit["expected_end_time"]
+
+
+def free_at(db):
+    return db.queue.find_one({"queue_id": "main"})["rooms"][0]["free_at"]
+
+
+def test_join_between_shift_and_room_update_is_shifted(db):
+    database.run_steps(reset_queue("main", datetime.now()), db)
+    join(db, "A")
+    join(db, "B")
+    visit = overrun(db, "A", 30)
+    b_start, _ = times(db, "B")
+    joined = []
+
+    def join_before_room_update(op):
+        # a join books the room between the visit shift and the room update
+        if op.collection == "queue" and op.method == "find_one_and_update" and not joined:
+            joined.append(join(db, "C"))
+
+    qdoc, delay, _, _, shifted = run_with(settle_checkout("main", visit), db, join_before_room_update)
+
+    assert delay == 30 and shifted == 2
+    assert times(db, "B")[0] == b_start + timedelta(minutes=30)
+    # C was booked against the old free time, so it moved with the room
+    assert times(db, "C")[0] == joined[0]["expected_start_time"] + timedelta(minutes=30)
+    assert times(db, "B")[1] <= times(db, "C")[0]
+    assert free_at(db) == times(db, "C")[1]
+    assert qdoc["active_count"] == 2
+
+
+def test_join_inserted_during_checkout_is_shifted_once(db, monkeypatch):
+    monkeypatch.setattr(queue_logic, "JOIN_SETTLE_SECONDS", 5)
+    database.run_steps(reset_queue("main", datetime.now()), db)
+    join(db, "A")
+    join(db, "B")
+    visit = overrun(db, "A", 30)
+
+    # C reserved its slot before the checkout, its insert lands while it runs
+    now = datetime.now()
+    qdoc = db.queue.find_one_and_update({"queue_id": "main"}, reserve_pipeline([20], now, [ObjectId()]),
+                                        return_document=ReturnDocument.AFTER)
+    (late,), _ = reserved_visits("main", qdoc, [{"patient_name": "C"}], now)
+    booked_start = late["expected_start_time"]
+
+    def insert_while_waiting(op):
+        if op.collection is None and not db.visits.find_one({"name": "C"}):
+            db.visits.insert_one(late)
+
+    _, _, _, _, shifted = run_with(settle_checkout("main", visit), db, insert_while_waiting)
+
+    assert shifted == 2
+    assert times(db, "C")[0] == booked_start + timedelta(minutes=30)
+    assert free_at(db) == times(db, "C")[1]
+
+
+def finish_early(db, name, minutes):
+    """Admit name and check them out minutes before their expected duration is up."""
+    visit = db.visits.find_one({"name": name})
+    admitted_at = datetime.now() - timedelta(minutes=visit["expected_duration_minutes"] - PREP_MINUTES - minutes)
+    db.visits.update_one({"_id": visit["_id"]}, {"$set": {"status": "admitted", "admitted_at": admitted_at}})
+    return database.run_steps(transition_visit({"_id": visit["_id"]}, "admitted", checkout_update(datetime.now())), db)
+
+
+def test_pull_in_reports_the_applied_delta(db, monkeypatch):
+    monkeypatch.setattr(queue_logic, "EARLY_FINISH_PULL_IN", True)
+    database.run_steps(reset_queue("main", datetime.now()), db)
+    join(db, "A", 40)
+    join(db, "B", 40)
+    db.visits.update_one({"name": "B"}, {"$set": {"status": "checked_in"}})
+    room_free = free_at(db)
+    visit = finish_early(db, "A", 30)
+
+    qdoc, delta, shift, pulled, _ = database.run_steps(settle_checkout("main", visit), db)
+
+    moved = round((room_free - free_at(db)).total_seconds() / 60)
+    assert delta == -moved and delta < 0
+    assert qdoc["global_delay_minutes"] == delta
+    # the pulled visits go to the cache as documents, not as a shift
+    assert shift is None and [v["name"] for v in pulled] == ["B"]
+
+
+def test_pull_in_blocked_by_a_join_reports_no_delta(db, monkeypatch):
+    monkeypatch.setattr(queue_logic, "EARLY_FINISH_PULL_IN", True)
+    database.run_steps(reset_queue("main", datetime.now()), db)
+    join(db, "A", 40)
+    join(db, "B", 40)
+    db.visits.update_one({"name": "B"}, {"$set": {"status": "checked_in"}})
+    visit = finish_early(db, "A", 30)
+    joined = []
+
+    def join_before_room_update(op):
+        if op.collection == "queue" and op.method == "find_one_and_update" and not joined:
+            joined.append(join(db, "C"))
+
+    qdoc, delta, _, pulled, _ = run_with(settle_checkout("main", visit), db, join_before_room_update)
+
+    assert pulled and delta == 0
+    assert qdoc["global_delay_minutes"] == 0
+    assert free_at(db) == times(db, "C")[1]
+
+
+def test_pull_in_waits_for_a_join_still_inserting(db, monkeypatch):
+    monkeypatch.setattr(queue_logic, "EARLY_FINISH_PULL_IN", True)
+    database.run_steps(reset_queue("main", datetime.now()), db)
+    join(db, "A", 40)
+    join(db, "B", 40)
+    db.visits.update_one({"name": "B"}, {"$set": {"status": "checked_in"}})
+    # C reserved its slot but has not inserted its visit; D joined after it and landed
+    now = datetime.now()
+    qdoc = db.queue.find_one_and_update({"queue_id": "main"}, reserve_pipeline([20], now, [ObjectId()]),
+                                        return_document=ReturnDocument.AFTER)
+    (late,), _ = reserved_visits("main", qdoc, [{"patient_name": "C"}], now)
+    join(db, "D")
+    d_times = times(db, "D")
+    visit = finish_early(db, "A", 30)
+
+    _, delta, _, pulled, _ = database.run_steps(settle_checkout("main", visit), db)
+
+    # moving B and D earlier would put D over C once C lands
+    assert pulled == [] and delta == 0
+    assert times(db, "D") == d_times
+    db.visits.insert_one(late)
+    assert times(db, "C")[1] <= times(db, "D")[0]
@@ -0,0 +1,57 @@
+"""
+Filename: test_estimates.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: A booked slot covers the visit plus the room's turnover, and a
+checkout that took exactly the estimate is neither late nor early. Any
+overrun delays the room, even one shorter than the turnover.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from estimator import DurationEstimator
+from queue_logic import (
+    PREP_MINUTES, REASON_ESTIMATE_MINUTES, checkout_delta_minutes, checkout_update, expected_duration_minutes_for,
+    reserve_and_insert, reset_queue, settle_checkout, transition_visit,
+)
+
+
+def learned(minutes, samples=10):
+    estimator = DurationEstimator(alpha=0.2, min_samples=5)
+    for _ in range(samples):
+        estimator.observe("Flu-like symptoms", minutes)
+    return estimator
+
+
+def test_learned_estimate_books_room_turnover():
+    assert expected_duration_minutes_for("Flu-like symptoms", learned(25)) == PREP_MINUTES + 25
+
+
+def test_checkout_on_estimate_has_no_delta():
+    for estimator, actual in ((None, REASON_ESTIMATE_MINUTES["Flu-like symptoms"]), (learned(25), 25)):
+        booked = expected_duration_minutes_for("Flu-like symptoms", estimator)
+        visit = {"expected_duration_minutes": booked, "actual_duration_minutes": actual}
+        assert checkout_delta_minutes(visit) == 0
+        assert checkout_delta_minutes(dict(visit, actual_duration_minutes=actual + 7)) == 7
+
+
+@pytest.mark.parametrize("estimator", [None, learned(25)], ids=["table", "learned"])
+def test_overrun_shorter_than_turnover_delays_the_room(db, estimator):
+    now = datetime.now()
+    database.run_steps(reset_queue("main", now), db)
+    booked = expected_duration_minutes_for("Flu-like symptoms", estimator)
+    forms = [{"patient_name": name, "reason": "Flu-like symptoms"} for name in ("A", "B")]
+    _, (a, b), _ = database.run_steps(reserve_and_insert("main", forms, [booked] * 2, now), db)
+
+    # A stays 3 minutes past the estimate, well inside the 10 minutes of turnover
+    admitted_at = datetime.now() - timedelta(minutes=booked - PREP_MINUTES + 3)
+    db.visits.update_one({"_id": a["_id"]}, {"$set": {"status": "admitted", "admitted_at": admitted_at}})
+    visit = database.run_steps(transition_visit({"_id": a["_id"]}, "admitted", checkout_update(datetime.now())), db)
+    _, delay, _, _, shifted = database.run_steps(settle_checkout("main", visit), db)
+
+    assert delay == 3 and shifted == 1
+    moved = db.visits.find_one({"_id": b["_id"]})["expected_start_time"]
+    assert abs(moved - b["expected_start_time"] - timedelta(minutes=3)) < timedelta(milliseconds=1)
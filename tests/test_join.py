@@ -0,0 +1,76 @@
+"""
+Filename: test_join.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: With several rooms, a patient whose room is free when they join
+still gets time to check in before the pruner may remove them, and the
+pruner never arms a deadline that is already due. A reader can tell a
+reserved visit whose insert is still on its way from one that already left.
+"""
+
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+import database
+from deadline_index import DeadlineIndex
+import queue_logic
+from queue_logic import (
+    CHECKIN_GRACE_MINUTES, expire_no_shows, find_active_visits, joins_settled, reserve_and_insert, reserve_pipeline,
+    reserved_visits, reset_queue,
+)
+
+
+def test_free_rooms_get_checkin_grace(db, monkeypatch):
+    monkeypatch.setattr(queue_logic, "ROOM_COUNT", 3)
+    now = datetime.now()
+    database.run_steps(reset_queue("main", now), db)
+    forms = [{"patient_name": name} for name in ("A", "B", "C", "D")]
+    _, patients, rows = database.run_steps(reserve_and_insert("main", forms, [20] * 4, now), db)
+
+    # A, B and C each get a free room; D waits for the first one to free up
+    assert [p["room"] for p in patients[:3]] == [1, 2, 3]
+    assert rows[0]["check_in_by"] == "ASAP" and patients[0]["checkin_deadline"] is None
+    grace = now + timedelta(minutes=CHECKIN_GRACE_MINUTES)
+    assert [p["checkin_deadline"] for p in patients[1:3]] == [grace, grace]
+    assert patients[3]["checkin_deadline"] == patients[3]["expected_start_time"] - timedelta(minutes=5)
+
+    removed, upcoming = database.run_steps(expire_no_shows(now + timedelta(seconds=1)), db)
+    # stored to the millisecond
+    assert removed == [] and abs(upcoming - grace) < timedelta(milliseconds=1)
+    assert db.visits.count_documents({"queue_id": "main"}) == 4
+
+    # B and C never came in
+    removed, _ = database.run_steps(expire_no_shows(grace), db)
+    assert [len(ids) for _, _, ids in removed] == [2]
+
+
+def test_due_deadline_is_not_armed():
+    now = datetime.now()
+    deadlines = DeadlineIndex(clock=lambda: now)
+    assert not deadlines.add(now)
+    assert not deadlines.add(now - timedelta(minutes=1))
+    assert deadlines.size() == 0 and not deadlines.wait(0)
+    assert deadlines.add(now + timedelta(seconds=1))
+
+
+def test_reload_waits_for_the_reserved_insert(db):
+    now = datetime.now()
+    database.run_steps(reset_queue("main", now), db)
+    database.run_steps(reserve_and_insert("main", [{"patient_name": "A"}], [20], now), db)
+    # B's slot is reserved, its insert has not landed yet
+    qdoc = db.queue.find_one_and_update({"queue_id": "main"}, reserve_pipeline([20], now, [ObjectId()]),
+                                        return_document=ReturnDocument.AFTER)
+    (late,), _ = reserved_visits("main", qdoc, [{"patient_name": "B"}], now)
+
+    def settled():
+        return database.run_steps(joins_settled(qdoc, database.run_steps(find_active_visits("main"), db)), db)
+
+    assert [j["id"] for j in qdoc["inserting"]] == [db.visits.find_one({"name": "A"})["_id"], late["_id"]]
+    assert not settled()
+    db.visits.insert_one(late)
+    assert settled()
+    # a reserved visit that already completed is no longer active, but it landed
+    db.visits.update_one({"_id": late["_id"]}, {"$set": {"status": "completed"}})
+    assert settled()
@@ -0,0 +1,27 @@
+"""
+Filename: test_projection.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: What-if changes are validated before any projection runs.
+Needs numpy.
+"""
+
+import pytest
+
+from projection import parse_changes
+
+
+@pytest.mark.parametrize("change", [
+    {"type": "close_room", "room": True},
+    {"type": "admit", "patient_name": "A", "room": False},
+    {"type": "delay_room", "room": 1, "minutes": True},
+    {"type": "duration", "patient_name": "A", "minutes": False},
+])
+def test_booleans_are_not_numbers(change):
+    with pytest.raises(ValueError):
+        parse_changes({"changes": [change]})
+
+
+def test_numbers_are_accepted():
+    changes = [{"type": "delay_room", "room": 2, "minutes": 7.5}, {"type": "admit", "patient_name": "A", "room": 1}]
+    assert parse_changes({"changes": changes}) == changes
@@ -0,0 +1,22 @@
+"""
+Filename: test_queue_events.py
+Author: Kush Parmar
+Last Update: 18 October 2026
+Description: The broker refuses streams past its limit, so open streams
+cannot hold every request thread of a worker.
+"""
+
+from queue_events import QueueEventBroker
+
+
+def test_subscribe_stops_at_the_limit():
+    broker = QueueEventBroker()
+    first = broker.subscribe("main", limit=2)
+    assert broker.subscribe("other", limit=2) is not None
+    # the limit counts every queue's streams
+    assert broker.subscribe("main", limit=2) is None
+    assert broker.subscriber_count() == 2
+
+    broker.unsubscribe(first)
+    assert broker.subscribe("main", limit=2) is not None
+    assert broker.subscribe("main") is not None